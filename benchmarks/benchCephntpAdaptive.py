@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark of cephntp.py's adaptiveRunConfig, against a stand-in for
+clknetsim.bash whose simulations write logs with a made up safety buffer,
+which drops below zero past a latency mean that depends on the drift and
+the alpha.
+
+usage: python3 benchmarks/benchCephntpAdaptive.py [-j jobs] [-s coarseStep]
+
+The default grid of multiRunConfig is searched coarse to fine. Every point
+next to the safe operating boundary (a grid neighbour on the other side of
+it) must have been simulated, and every simulated point must have the
+safety buffer of its parameters in its directory. The number of simulations
+is printed against the size of the grid.
+"""
+import os
+import sys
+import getopt
+import shutil
+import tempfile
+import time
+import contextlib
+import io
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples"))
+import cephntp
+
+usage = "usage: python3 benchCephntpAdaptive.py [-j jobs] [-s coarseStep]"
+
+# stand-in for clknetsim.bash, which keeps its files in ./tmp as clknetsim.bash does
+standIn = """
+start_client() {{
+    echo "$2 $3" > tmp/client.$1
+}}
+start_server() {{
+    local out="" error="" offset=""
+    while [ $# -gt 0 ]; do
+        case "$1" in
+            -o) out="$2" ;;
+            -a) error="$2" ;;
+            -c) offset="$2" ;;
+        esac
+        shift
+    done
+    echo run >> {runs}
+    {python} {surface} tmp/conf "$out" "$error" "$offset"
+    echo "RMS offset: 0" > tmp/stats
+}}
+get_stat() {{
+    echo 0
+}}
+"""
+
+# writes the logs of the config it is given, with the safety buffer of surface.py
+logWriter = """
+import re, sys
+sys.path.insert(0, {directory!r})
+from surface import minBuffer, maxError
+conf, out, error, offset = sys.argv[1:]
+with open(conf) as f:
+    text = f.read()
+drift = float(re.search(r"node2_freq = \\(sum \\(\\* (\\S+) \\(normal", text).group(1))
+alpha, theta = map(float, re.search(r"node2_delay1 = \\(gamma (\\S+) (\\S+)\\)", text).groups())
+least = minBuffer(drift, alpha, alpha * theta)
+rows = range({rows})
+with open(error, "w") as f:
+    f.writelines("0\\t%r\\n" % maxError for i in rows)
+with open(offset, "w") as f:
+    f.writelines("0\\t0\\n" for i in rows)
+# the safety buffer is maxError / 1000 - realOffset * 1000 ms, least or a ms more
+with open(out, "w") as f:
+    f.writelines("0\\t%r\\n" % ((maxError / 1000.0 - least - i % 2) / 1000.0) for i in rows)
+"""
+
+surface = """
+maxError = 1e6
+
+def minBuffer(drift, alpha, mean):
+    return 1.0 - (mean / 1e-4) * (drift / 1e-8) ** 0.5 / alpha ** 0.5
+"""
+
+def adaptiveRun(jobs, coarseStep):
+    """ Runs the search, returns its time and its output directory """
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        cephntp.adaptiveRunConfig(jobs=jobs, coarseStep=coarseStep)
+    seconds = time.time() - start
+    sweeps = [name for name in os.listdir("tmp") if name[0].isdigit()]
+    return seconds, os.path.join("tmp", sweeps[0])
+
+def checkSearch(output, minBuffer):
+    """ Whether the boundary points were simulated, and whether what was is right """
+    axes = cephntp.sweepParameters(None, None, None)
+    simulated = set(os.listdir(output))
+    name = lambda point: "{:.2e}_{:.2e}_{:.2e}".format(*point)
+    boundary = True
+    for index in itertools.product(*[range(len(values)) for values in axes]):
+        point = tuple(values[i] for values, i in zip(axes, index))
+        for axis in range(3):
+            if index[axis] + 1 == len(axes[axis]):
+                continue
+            neighbour = tuple(value if i != axis else axes[axis][index[axis] + 1] for i, value in enumerate(point))
+            if (minBuffer(*point) > 0) != (minBuffer(*neighbour) > 0):
+                boundary = boundary and name(point) in simulated and name(neighbour) in simulated
+    # folders are named with the parameters, as examples/3dPlot.py reads them
+    points = dict((name(point), point) for point in itertools.product(*axes))
+    correct = simulated <= set(points)
+    for folder in simulated & set(points):
+        point = points[folder]
+        mean, least = cephntp.safetyBuffer(os.path.join(output, folder))
+        correct = correct and abs(least - minBuffer(*point)) < 1e-6 and abs(mean - least - 0.5) < 1e-6
+    return len(simulated), boundary, correct
+
+def main(argv):
+    jobs = os.cpu_count()
+    coarseStep = 8
+    try:
+        opts, args = getopt.getopt(argv, "hj:s:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-s":
+            coarseStep = int(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCephntpAdaptive")
+    cwd = os.getcwd()
+    try:
+        # clknetsim.bash is in .. of where the search runs
+        runs = os.path.join(directory, "runs")
+        with open(os.path.join(directory, "surface.py"), "w") as f:
+            f.write(surface)
+        with open(os.path.join(directory, "logWriter.py"), "w") as f:
+            f.write(logWriter.format(directory=directory, rows=cephntp.firstRowsOfJunk + 100))
+        with open(os.path.join(directory, "clknetsim.bash"), "w") as f:
+            f.write(standIn.format(runs=runs, python=sys.executable, surface=os.path.join(directory, "logWriter.py")))
+        sys.path.insert(0, directory)
+        import surface as made
+        simulations = os.path.join(directory, "examples")
+        os.mkdir(simulations)
+        os.chdir(simulations)
+        cephntp.sweepCache = None
+        seconds, output = adaptiveRun(jobs, coarseStep)
+        total = 1
+        for values in cephntp.sweepParameters(None, None, None):
+            total *= len(values)
+        simulated, boundary, correct = checkSearch(output, made.minBuffer)
+        with open(runs) as f:
+            ran = len(f.read().split())
+        print("%8.2f s   simulated %d (%d runs) of %d points (%.1f%%)   boundary found: %s   outputs correct: %s" %
+              (seconds, simulated, ran, total, 100.0 * simulated / total, boundary, correct))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the sweep of cephntp.py's multiRunConfig, against a stand-in
+for clknetsim.bash whose simulations take a delay and write the config they
+were given in place of log.timeoffset.
+
+usage: python3 benchmarks/benchCephntpSweep.py [-n means] [-j jobs] [-d delaySeconds]
+
+A sweep of 2 drifts, 2 alphas and means latency means is run without the
+result cache with one job and with jobs jobs. Every output directory must
+end up with the config of its own parameters, and no working directory may
+be left behind.
+
+Then the sweep is run twice with the cache, the second time simulating
+nothing, and a sweep with twice the means is killed halfway and resumed,
+which must only simulate what the killed one didn't finish, into the same
+output directory.
+
+Last, a sweep with an alpha whose simulations fail must leave no directory
+for its points, only for the others. The script exits with status 1 when a
+check fails.
+"""
+import os
+import sys
+import getopt
+import shutil
+import tempfile
+import time
+import contextlib
+import io
+import signal
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples"))
+import cephntp
+
+usage = "usage: python3 benchCephntpSweep.py [-n means] [-j jobs] [-d delaySeconds]"
+
+# stand-in for clknetsim.bash, which keeps its files in ./tmp as clknetsim.bash does
+standIn = """
+start_client() {{
+    echo "$2 $3" > tmp/client.$1
+}}
+start_server() {{
+    # the simulations of failAlpha fail
+    grep -q "(gamma {failAlpha} " tmp/conf && exit 1
+    local out=""
+    while [ $# -gt 0 ]; do
+        [ "$1" = -o ] && out="$2"
+        shift
+    done
+    sleep {delay}
+    echo run >> {runs}
+    cp tmp/conf "$out"
+    echo "RMS offset: 0" > tmp/stats
+}}
+get_stat() {{
+    echo 0
+}}
+"""
+
+# sweep run by a process that is killed, from the directory the sweeps run in
+killedSweep = """
+import sys
+sys.path.insert(0, {examples!r})
+import cephntp
+cephntp.multiRunConfig([1e-8, 2e-8], [1.0, 2.0], [10**((float(x)/10.0) - 5) for x in range({means})], {jobs})
+"""
+
+def sweeps(directory):
+    return set(name for name in os.listdir(os.path.join(directory, "tmp")) if name[0].isdigit())
+
+# alpha of the simulations the stand-in fails
+failAlpha = 3.0
+
+def runSweep(directory, means, jobs, resume=False, alphas=(1.0, 2.0)):
+    """ Runs a sweep from directory, returns its time and the output directories it made """
+    before = sweeps(directory) if os.path.isdir(os.path.join(directory, "tmp")) else set()
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        cephntp.multiRunConfig([1e-8, 2e-8], list(alphas), [10**((float(x)/10.0) - 5) for x in range(means)], jobs,
+                               resume)
+    seconds = time.time() - start
+    return seconds, sweeps(directory) - before
+
+def countLines(name):
+    if not os.path.exists(name):
+        return 0
+    with open(name) as f:
+        return len(f.read().split())
+
+def checkSweep(directory, created, means):
+    """ Whether the sweep made just one output directory, with the right config in each run """
+    if len(created) != 1:
+        return False
+    output = os.path.join(directory, "tmp", created.pop())
+    return checkOutput(output, means)
+
+def checkOutput(output, means):
+    runs = 0
+    for driftStdDev in [1e-8, 2e-8]:
+        for alpha in [1.0, 2.0]:
+            for mean in [10**((float(x)/10.0) - 5) for x in range(means)]:
+                name = os.path.join(output, "{:.2e}_{:.2e}_{:.2e}".format(driftStdDev, alpha, mean), "log.timeoffset")
+                if not os.path.exists(name):
+                    return False
+                with open(name) as f:
+                    if f.read() != cephntp.sweepConf(2, driftStdDev, alpha, mean):
+                        return False
+                runs += 1
+    return runs == len(os.listdir(output))
+
+def checkFailed(directory, created):
+    """ Whether the sweep with failAlpha made no directory for its failed points """
+    if len(created) != 1:
+        return False
+    output = os.path.join(directory, "tmp", created.pop())
+    alphas = set(float(name.split("_")[1]) for name in os.listdir(output))
+    return alphas == {1.0}
+
+def main(argv):
+    means = 8
+    jobs = os.cpu_count()
+    delay = 0.5
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:d:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            means = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-d":
+            delay = float(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCephntpSweep")
+    cwd = os.getcwd()
+    try:
+        # clknetsim.bash is in .. of where the sweep runs
+        runs = os.path.join(directory, "runs")
+        with open(os.path.join(directory, "clknetsim.bash"), "w") as f:
+            f.write(standIn.format(delay=delay, runs=runs, failAlpha=failAlpha))
+        simulations = os.path.join(directory, "examples")
+        os.mkdir(simulations)
+        os.chdir(simulations)
+        cephntp.sweepCache = None
+        passed = True
+        for n in (1, jobs):
+            seconds, created = runSweep(simulations, means, n)
+            correct = checkSweep(simulations, created, means)
+            passed &= correct
+            print("%3d jobs %8.2f s for %d runs   outputs correct: %s" % (n, seconds, 4 * means, correct))
+
+        cephntp.sweepCache = "./tmp/cache"
+        for cycle in range(2):
+            before = countLines(runs)
+            seconds, created = runSweep(simulations, means, jobs)
+            simulated = countLines(runs) - before
+            correct = checkSweep(simulations, created, means)
+            passed &= correct and simulated == (4 * means if cycle == 0 else 0)
+            print("cached, sweep %d %8.2f s   simulated: %d of %d   outputs correct: %s" %
+                  (cycle + 1, seconds, simulated, 4 * means, correct))
+
+        # killed halfway through the new points, with its pool
+        before = countLines(runs)
+        killed = subprocess.Popen([sys.executable, "-c", killedSweep.format(examples=os.path.dirname(cephntp.__file__),
+                                                                            means=2 * means, jobs=jobs)],
+                                  stdout=subprocess.DEVNULL, start_new_session=True)
+        time.sleep(0.5 + delay * -(-4 * means // jobs) / 2)
+        os.killpg(killed.pid, signal.SIGKILL)
+        killed.wait()
+        simulatedBefore = countLines(runs) - before
+        latest = max(sweeps(simulations))
+        before = countLines(runs)
+        seconds, created = runSweep(simulations, 2 * means, jobs, resume=True)
+        simulated = countLines(runs) - before
+        correct = checkOutput(os.path.join(simulations, "tmp", latest), 2 * means)
+        passed &= not created and correct and simulatedBefore + simulated == 4 * means
+        print("resumed %8.2f s   simulated: %d + %d of %d new   same directory: %s   outputs correct: %s" %
+              (seconds, simulatedBefore, simulated, 4 * means, not created, correct))
+
+        seconds, created = runSweep(simulations, means, jobs, alphas=(1.0, failAlpha))
+        correct = checkFailed(simulations, created)
+        passed &= correct
+        print("failing %8.2f s   no directory for failed points: %s" % (seconds, correct))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+    if not passed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
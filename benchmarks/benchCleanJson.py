@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of cleanJson.py: the original line wrapping check against the
+streaming cleaner, on a generated freqOffset dump.
+
+usage: python benchmarks/benchCleanJson.py [-s sizeInMB] [-d directory] [-k]
+
+The generated input (2 GB by default) has the layout of the cluster dumps,
+one entry per line, with a corrupted line every so often. Both cleaners must
+produce byte identical output; their throughput is printed next to the time
+it takes to just read the file.
+"""
+import os, sys, getopt, random, time, filecmp, simplejson
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import cleanJson
+
+usage = "usage: python benchCleanJson.py [-s sizeInMB] [-d directory] [-k]"
+
+fillerLine = "{\"date\": -1, \"time\": 0.0, \"freqOffset\": 0.0}]"
+nodeNames = ["burnupi", "mira", "plana"]
+entriesPerNode = 50000
+# one line in this many gets corrupted
+corruptEvery = 5000
+
+def makeInput(fileName, size):
+    """ Writes a freqOffset dump of roughly size bytes """
+    rand = random.Random(42)
+    written = 0
+    nodeNum = 0
+    with open(fileName, 'w', cleanJson.bufferSize) as out:
+        out.write("[")
+        while written < size:
+            if nodeNum > 0:
+                out.write(",\n")
+            name = "%s%03d" % (nodeNames[nodeNum % len(nodeNames)], nodeNum)
+            lines = []
+            for i in xrange(entriesPerNode):
+                line = "{\"date\": %d, \"time\": %.1f, \"freqOffset\": %.3f}" % (
+                    57000 + i / 86400, float(i % 86400), rand.gauss(0, 15))
+                if rand.randint(0, corruptEvery) == 0:
+                    line = line[:rand.randint(1, len(line) - 1)]
+                lines.append(line)
+            chunk = "{\"node\": \"%s\", \"entries\":[" % name + ",\n".join(lines) + "]}"
+            out.write(chunk)
+            written += len(chunk)
+            nodeNum += 1
+        out.write("]\n")
+
+def checkForError(line):
+    """ The check cleanJson.py used to run on every line """
+    try:
+        simplejson.loads("[" + line + "\n" + fillerLine)
+        return True
+    except Exception as e:
+        return False
+
+def timeRead(fileName):
+    start = time.time()
+    with open(fileName, 'r', cleanJson.bufferSize) as f:
+        for line in f:
+            pass
+    return time.time() - start
+
+def timeClean(fileName, outName, legacy):
+    start = time.time()
+    stdout = sys.stdout
+    # the cleaners report corrupted lines, which is not what we are timing
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        with open(fileName, 'r', cleanJson.bufferSize) as json_data:
+            with open(outName, 'w', cleanJson.bufferSize) as newJsonData:
+                with open(outName + ".bad", 'w') as badlines:
+                    if legacy:
+                        cleaner = cleanJson.JsonCleaner(fillerLine, newJsonData, badlines, checkForError)
+                        cleaner.cleanLines(json_data)
+                    else:
+                        cleaner = cleanJson.JsonCleaner(fillerLine, newJsonData, badlines)
+                        cleaner.cleanStream(json_data)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return time.time() - start
+
+def main(argv):
+    size = 2048
+    directory = "."
+    keep = False
+    try:
+        opts, args = getopt.getopt(argv, "hs:d:k")
+    except getopt.GetoptError:
+        print usage
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print usage
+            sys.exit()
+        elif opt == "-s":
+            size = int(arg)
+        elif opt == "-d":
+            directory = arg
+        elif opt == "-k":
+            keep = True
+
+    inputName = os.path.join(directory, "benchInput.json")
+    wrappedName = os.path.join(directory, "benchWrapped.json")
+    streamName = os.path.join(directory, "benchStream.json")
+
+    print "Generating %d MB of input..." % size
+    makeInput(inputName, size << 20)
+    megabytes = os.path.getsize(inputName) / float(1 << 20)
+
+    results = [("read only", timeRead(inputName)),
+               ("line wrapping", timeClean(inputName, wrappedName, True)),
+               ("streaming", timeClean(inputName, streamName, False))]
+    for name, seconds in results:
+        print "%-14s %8.2f s %8.1f MB/s" % (name, seconds, megabytes / seconds)
+
+    identical = (filecmp.cmp(wrappedName, streamName, shallow=False) and
+                 filecmp.cmp(wrappedName + ".bad", streamName + ".bad", shallow=False))
+    print "Outputs identical:", identical
+
+    if not keep:
+        for name in (inputName, wrappedName, wrappedName + ".bad", streamName, streamName + ".bad"):
+            os.remove(name)
+    if not identical:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the collection of copyntpstats.py, against a local stand-in for
+the copy script instead of rsync over ssh, on a made up inventory of hosts
+that copy after a delay, fail or hang.
+
+usage: python3 benchmarks/benchCopyNtpStats.py [-n hosts] [-j jobs] [-d delaySeconds]
+
+The collection is timed with one job and with jobs jobs. Both must log one
+line per host, with the output of the hosts that copied or failed and a
+timeout for those that hang. A collection is then stopped with SIGTERM while
+hosts hang, which must leave none of their processes running.
+
+The benchmark exits with status 1 if any of these checks fails.
+"""
+import os
+import sys
+import getopt
+import json
+import tempfile
+import shutil
+import time
+
+from copyNtpStatsStandIns import makeInventory, makeStandIn, runCollection, processesLeft, check
+
+usage = "usage: python3 benchCopyNtpStats.py [-n hosts] [-j jobs] [-d delaySeconds]"
+
+def checkLines(nodes, lines):
+    """ Whether every host has the one line it should have """
+    for node in nodes:
+        name = node["name"]
+        mine = [line for line in lines if line.startswith(name)]
+        if len(mine) != 1:
+            return False
+        if name.startswith("down"):
+            expected = "skipped"
+        elif name.startswith("hang"):
+            expected = "timed out"
+        elif name.startswith("fail"):
+            expected = "Connection refused"
+        else:
+            expected = "copied"
+        if expected not in mine[0]:
+            return False
+    return True
+
+def main(argv):
+    hosts = 40
+    jobs = 16
+    delay = 0.5
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:d:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            hosts = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-d":
+            delay = float(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCopyNtpStats")
+    failed = []
+    try:
+        nodes = makeInventory(hosts)
+        with open(os.path.join(directory, "inventory.json"), "w") as f:
+            json.dump(nodes, f)
+        makeStandIn(directory, delay)
+
+        for n in (1, jobs):
+            seconds, lines = runCollection(directory, n)
+            print("%3d jobs %8.2f s   log lines correct: %s" %
+                  (n, seconds, check(failed, "%d jobs log lines" % n, checkLines(nodes, lines))))
+
+        # stopped while the hosts that hang are running
+        seconds, lines = runCollection(directory, jobs, stopAfter=delay + 0.5)
+        time.sleep(0.5)
+        left = processesLeft()
+        print("stopped after %.2f s   cancellation logged: %s   processes left: %d" %
+              (seconds, check(failed, "cancellation logged", any(line.startswith("collection cancelled") for line in lines)),
+               len(left)))
+        check(failed, "processes left after cancellation", not left)
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print("failed: " + ", ".join(failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the daemon mode of copyntpstats.py, against a local stand-in
+for the copy script on a made up inventory of hosts that copy after a delay,
+fail or hang.
+
+usage: python3 benchmarks/benchCopyNtpStatsDaemon.py [-n hosts] [-j jobs] [-d delaySeconds] [-I intervalSeconds]
+
+copyntpstats.py runs as a daemon for a few intervals of intervalSeconds,
+and is stopped with SIGTERM. The hosts that copy must be copied from about
+once per interval, spread over it, those that fail or hang a lot less
+often, the inventory command must only run when its time to live is over,
+and the daemon must log that it stopped and leave nothing running.
+
+The benchmark exits with status 1 if any of these checks fails.
+"""
+import os
+import sys
+import getopt
+import json
+import tempfile
+import shutil
+import time
+
+from copyNtpStatsStandIns import makeInventory, makeStandIn, runCollection, countLines, processesLeft, check
+
+usage = "usage: python3 benchCopyNtpStatsDaemon.py [-n hosts] [-j jobs] [-d delaySeconds] [-I intervalSeconds]"
+
+# intervals the daemon runs for, and seconds the inventory it gets is kept
+daemonIntervals = 8
+inventoryIntervals = 3
+
+def runDaemon(directory, nodes, jobs, interval):
+    """
+    Runs copyntpstats.py --daemon for daemonIntervals intervals, returns the
+    copies per host, the start times of the copies, the runs of the
+    inventory command and the log lines
+    """
+    with open(os.path.join(directory, "inventory.json"), "w") as f:
+        json.dump(nodes, f)
+    runs = os.path.join(directory, "inventoryRuns")
+    starts = os.path.join(directory, "starts")
+    command = "echo run >> {}; cat {}".format(runs, os.path.join(directory, "inventory.json"))
+    options = ["--daemon", "-I", str(interval), "--inventory-ttl", str(interval * inventoryIntervals), "-c", command]
+    start = time.time()
+    seconds, lines = runCollection(directory, jobs, stopAfter=interval * daemonIntervals, options=options)
+    copies = {}
+    for line in lines:
+        name = line.split(":")[0]
+        copies[name] = copies.get(name, 0) + 1
+    with open(starts) as f:
+        startTimes = [float(line.split()[0]) - start for line in f.read().split("\n") if line]
+    return copies, startTimes, countLines(runs), lines
+
+def main(argv):
+    hosts = 40
+    jobs = 16
+    delay = 0.5
+    interval = 2.0
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:d:I:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            hosts = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-d":
+            delay = float(arg)
+        elif opt == "-I":
+            interval = float(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCopyNtpStatsDaemon")
+    failed = []
+    try:
+        nodes = makeInventory(hosts)
+        makeStandIn(directory, delay)
+
+        copies, startTimes, runs, lines = runDaemon(directory, nodes, jobs, interval)
+        time.sleep(0.5)
+        left = processesLeft()
+        average = {}
+        for prefix in ("plana", "fail", "hang"):
+            counts = [copies.get(node["name"], 0) for node in nodes if node["name"].startswith(prefix)]
+            average[prefix] = sum(counts) / float(len(counts))
+            print("daemon, %s hosts: %.1f copies each in %d intervals" % (prefix, average[prefix], daemonIntervals))
+        # the first copy of a host is up to an interval in, and the last may not be done
+        check(failed, "daemon copies per interval", daemonIntervals - 3 <= average["plana"] <= daemonIntervals + 1)
+        check(failed, "daemon backoff", average["fail"] < average["plana"] and average["hang"] < average["plana"])
+        # copies started in each tenth of the first interval
+        tenths = [0] * 10
+        for t in startTimes:
+            if t < interval:
+                tenths[int(t / interval * 10)] += 1
+        print("daemon, copies started per tenth of the first interval: %s" % " ".join(map(str, tenths)))
+        check(failed, "daemon copies spread", sum(1 for count in tenths if count) >= 5)
+        print("daemon, inventory runs: %d   stop logged: %s   processes left: %d" %
+              (runs, check(failed, "daemon stop logged", any(line.startswith("daemon stopped") for line in lines)),
+               len(left)))
+        check(failed, "daemon inventory runs", 1 <= runs <= -(-daemonIntervals // inventoryIntervals))
+        check(failed, "processes left after the daemon", not left)
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print("failed: " + ", ".join(failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
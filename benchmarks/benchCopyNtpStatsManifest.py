@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the sync manifest of copyntpstats.py, against a stand-in for
+the copy script that copies the files listed to it from a made up ntpstats
+folder through a stub ssh.
+
+usage: python3 benchmarks/benchCopyNtpStatsManifest.py [-n hosts] [-j jobs] [-k handshakeSeconds]
+
+Three collections in a row keep a manifest: the first must copy every file
+of every host, the second must skip every host, and the third only copy the
+file that was appended to. One of the files is in a subdirectory, which
+must be copied as the others are.
+
+The benchmark exits with status 1 if any of these checks fails.
+"""
+import os
+import sys
+import getopt
+import json
+import tempfile
+import shutil
+
+from copyNtpStatsStandIns import plainInventory, makeScript, makeSsh, runCollection, check
+
+usage = "usage: python3 benchCopyNtpStatsManifest.py [-n hosts] [-j jobs] [-k handshakeSeconds]"
+
+# copies the files of the list, or all of them, from the host through $NTPSTATS_SSH
+syncStandIn = """#!/bin/bash
+mkdir -p "$3/ntpstats"
+if [ -n "$4" ]; then files=$(cat "$4"); else files=$($NTPSTATS_SSH "$2" find "$1" -type f ! -name "'*gz'" -printf "'%P\\n'"); fi
+for f in $files; do
+  mkdir -p "$(dirname "$3/ntpstats/$f")"
+  $NTPSTATS_SSH "$2" cat "$1/$f" > "$3/ntpstats/$f" || exit 1
+  touch -r "$1/$f" "$3/ntpstats/$f"
+done
+echo "copied $(echo $files | wc -w) files from $2"
+"""
+
+# files of the made up ntpstats folder, and one more in a subdirectory
+statsFiles = 5
+
+def timeManifest(directory, hosts, jobs):
+    """
+    Times three collections in a row with a manifest, the last after a file
+    changed, returns their times, the hosts skipped and the files copied
+    """
+    stats = os.path.join(directory, "ntpstats")
+    os.mkdir(stats)
+    for i in range(statsFiles):
+        with open(os.path.join(stats, "loopstats.%d" % i), "w") as f:
+            f.write("57000 %d.000 0.000001 -20.5 0.000002 0.01 10\n" % i * 100)
+    with open(os.path.join(stats, "loopstats.0.gz"), "w") as f:
+        f.write("not copied")
+    os.mkdir(os.path.join(stats, "old"))
+    with open(os.path.join(stats, "old", "loopstats.2019"), "w") as f:
+        f.write("57000 0.000 0.000001 -20.5 0.000002 0.01 10\n")
+    options = ["--ssh", os.path.join(directory, "ssh") + " -oBatchMode=yes", "--control", os.path.join(directory, "control"),
+               "-p", "600", "-m", os.path.join(directory, "manifest.json"), "--path", stats]
+    results = []
+    for cycle in range(3):
+        if cycle == 2:
+            with open(os.path.join(stats, "loopstats.0"), "a") as f:
+                f.write("57001 0.000 0.000001 -20.5 0.000002 0.01 10\n")
+        seconds, lines = runCollection(directory, jobs, options=options, script="sync.sh")
+        skipped = sum(1 for line in lines if "unchanged" in line)
+        copied = sum(int(line.split("copied ")[1].split()[0]) for line in lines if "copied " in line)
+        results.append((seconds, skipped, copied))
+    runCollection(directory, jobs, options=options + ["--close"])
+    return results
+
+def main(argv):
+    hosts = 40
+    jobs = 16
+    handshake = 1.0
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:k:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            hosts = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-k":
+            handshake = float(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCopyNtpStatsManifest")
+    failed = []
+    try:
+        with open(os.path.join(directory, "inventory.json"), "w") as f:
+            json.dump(plainInventory(hosts), f)
+        makeScript(os.path.join(directory, "sync.sh"), syncStandIn)
+        makeSsh(directory, handshake)
+
+        expected = [(0, hosts * (statsFiles + 1)), (hosts, 0), (0, hosts)]
+        for cycle, (seconds, skipped, copied) in enumerate(timeManifest(directory, hosts, jobs)):
+            print("manifest, collection %d %8.2f s   hosts skipped: %d   files copied: %d   correct: %s" %
+                  (cycle + 1, seconds, skipped, copied,
+                   check(failed, "manifest collection %d" % (cycle + 1), (skipped, copied) == expected[cycle])))
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print("failed: " + ", ".join(failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
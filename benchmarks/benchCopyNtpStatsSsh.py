@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the master ssh connections of copyntpstats.py, through a stub
+ssh that takes handshakeSeconds to connect unless it has a master connection
+to the host (a file at its control path that has been used within the
+persist time).
+
+usage: python3 benchmarks/benchCopyNtpStatsSsh.py [-n hosts] [-j jobs] [-k handshakeSeconds]
+
+Two collections in a row are timed with master connections and without.
+With them, the second collection must not connect again, and --close must
+close them all.
+
+The benchmark exits with status 1 if any of these checks fails.
+"""
+import os
+import sys
+import getopt
+import json
+import tempfile
+import shutil
+
+from copyNtpStatsStandIns import plainInventory, makeScript, makeSsh, runCollection, countLines, check
+
+usage = "usage: python3 benchCopyNtpStatsSsh.py [-n hosts] [-j jobs] [-k handshakeSeconds]"
+
+# copies a file from the host through $NTPSTATS_SSH, as rsync does in copyfromssh.sh
+transportStandIn = """#!/bin/bash
+mkdir -p "$3"
+$NTPSTATS_SSH "$2" cat /etc/hostname > "$3/loopstats"
+"""
+
+def timeTransport(directory, hosts, jobs, persist):
+    """ Times two collections in a row through the stub ssh, returns their times and connections """
+    connections = os.path.join(directory, "connections")
+    control = os.path.join(directory, "control")
+    options = ["--ssh", os.path.join(directory, "ssh") + " -oBatchMode=yes", "--control", control,
+               "-p", str(persist)]
+    results = []
+    for cycle in range(2):
+        before = countLines(connections)
+        seconds, lines = runCollection(directory, jobs, options=options, script="transport.sh")
+        results.append((seconds, countLines(connections) - before))
+    return results, options
+
+def main(argv):
+    hosts = 40
+    jobs = 16
+    handshake = 1.0
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:k:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            hosts = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-k":
+            handshake = float(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCopyNtpStatsSsh")
+    failed = []
+    try:
+        with open(os.path.join(directory, "inventory.json"), "w") as f:
+            json.dump(plainInventory(hosts), f)
+        makeScript(os.path.join(directory, "transport.sh"), transportStandIn)
+        makeSsh(directory, handshake)
+
+        for persist in (0, 600):
+            results, options = timeTransport(directory, hosts, jobs, persist)
+            for cycle, (seconds, connections) in enumerate(results):
+                print("persist %3d s, collection %d %8.2f s   connections: %d" % (persist, cycle + 1, seconds, connections))
+                # only the second collection with master connections doesn't connect
+                check(failed, "persist %d collection %d connections" % (persist, cycle + 1),
+                      connections == (0 if persist and cycle else hosts))
+        runCollection(directory, jobs, options=options + ["--close"])
+        masters = len(os.listdir(os.path.join(directory, "control")))
+        print("master connections left after --close: %d" % masters)
+        check(failed, "master connections closed", masters == 0)
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print("failed: " + ", ".join(failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
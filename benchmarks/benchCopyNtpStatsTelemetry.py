@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the telemetry of copyntpstats.py, against a local stand-in for
+the copy script on a made up inventory of hosts that copy after a delay,
+fail or hang.
+
+usage: python3 benchmarks/benchCopyNtpStatsTelemetry.py [-n hosts] [-j jobs] [-d delaySeconds]
+
+Two collections in a row must each write a telemetry record per host that
+is up, saying how its copy ended and, for those that copied, the bytes the
+--stats of the stand-in say were received, which must be left out of the
+log. --summary must then sum up the copies of both.
+
+The benchmark exits with status 1 if any of these checks fails.
+"""
+import os
+import sys
+import getopt
+import json
+import subprocess
+import tempfile
+import shutil
+
+from copyNtpStatsStandIns import root, receivedBytes, makeInventory, makeStandIn, runCollection, check
+
+usage = "usage: python3 benchCopyNtpStatsTelemetry.py [-n hosts] [-j jobs] [-d delaySeconds]"
+
+def checkTelemetry(nodes, records):
+    """
+    Whether every host that is up has a record of a copy that ended as it
+    should, with the bytes received if it copied
+    """
+    expected = {}
+    for node in nodes:
+        if node["up"]:
+            name = node["name"]
+            expected[name] = (("timed out", None) if name.startswith("hang") else ("failed", None)
+                              if name.startswith("fail") else ("copied", receivedBytes))
+    return sorted((r["host"], (r["result"], r["bytes"])) for r in records) == sorted(expected.items())
+
+def main(argv):
+    hosts = 40
+    jobs = 16
+    delay = 0.5
+    try:
+        opts, args = getopt.getopt(argv, "hn:j:d:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            hosts = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-d":
+            delay = float(arg)
+
+    directory = tempfile.mkdtemp(prefix="benchCopyNtpStatsTelemetry")
+    failed = []
+    try:
+        nodes = makeInventory(hosts)
+        with open(os.path.join(directory, "inventory.json"), "w") as f:
+            json.dump(nodes, f)
+        makeStandIn(directory, delay)
+
+        telemetry = os.path.join(directory, "telemetry.jsonl")
+        for cycle in range(2):
+            seconds, lines = runCollection(directory, jobs)
+            with open(telemetry) as f:
+                records = [json.loads(line) for line in f][-len(nodes) + 1:]
+            print("collection %d %8.2f s   telemetry correct: %s   stats left out of the log: %s" %
+                  (cycle + 1, seconds, check(failed, "collection %d telemetry" % (cycle + 1),
+                                             checkTelemetry(nodes, records)),
+                   check(failed, "collection %d log" % (cycle + 1),
+                         not any("Total bytes" in line for line in lines))))
+        summary = subprocess.run([sys.executable, os.path.join(root, "copyntpstats.py"), "--summary", "--top", "3",
+                                  "--telemetry", telemetry], stdout=subprocess.PIPE).stdout.decode()
+        print("summary of both:\n" + summary.rstrip())
+        check(failed, "summary", summary.startswith("%d copies from %d hosts" % (2 * hosts, hosts)))
+    finally:
+        shutil.rmtree(directory)
+    if failed:
+        print("failed: " + ", ".join(failed))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
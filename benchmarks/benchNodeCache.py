@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the node cache of nodeCache.py: made up NodeResults are put
+into a cache and read back, and the time of each is printed in nodes per
+second.
+
+usage: python benchmarks/benchNodeCache.py [-n nodes] [-e valuesPerNode]
+
+Every node read back must be what was put. Then every few entries are cut
+short, as a process killed while writing or a full disk leaves them, or
+overwritten with bytes that aren't an .npz. Reading those must count as a
+miss rather than fail, and once they are put again they must be hits. The
+script exits with status 1 when a check fails.
+"""
+from __future__ import print_function
+import os, sys, getopt, shutil, tempfile, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import nodeCache, nodeStats
+
+usage = "usage: python benchNodeCache.py [-n nodes] [-e valuesPerNode]"
+
+# one entry in this many is damaged
+badEntryEvery = 5
+
+def makeResults(count, values):
+    rand = np.random.RandomState(42)
+    results = []
+    for n in range(count):
+        nodeValues = rand.normal(0, 15, values)
+        moments = nodeStats.Moments()
+        moments.count, moments.mean, moments.m2 = values, float(nodeValues.mean()), float(nodeValues.var() * values)
+        runs = np.array([[n, n + 1.0, 2, 100.0]])
+        results.append(nodeCache.NodeResult(n % 7 != 6, np.arange(values, dtype=np.float64), nodeValues, runs,
+                                            moments, rand.normal(0, 1, values)))
+    return results
+
+def same(a, b):
+    return (b is not None and a.valid == b.valid and np.array_equal(a.times, b.times) and
+            np.array_equal(a.values, b.values) and np.array_equal(a.runs, b.runs) and
+            np.array_equal(a.offsets, b.offsets) and
+            (a.moments.count, a.moments.mean, a.moments.m2) == (b.moments.count, b.moments.mean, b.moments.m2))
+
+def damage(name, n):
+    """ Cuts the entry in name short, or makes it something else than an .npz """
+    if n % 2:
+        with open(name, 'r+b') as f:
+            f.truncate(os.path.getsize(name) // 2)
+    else:
+        with open(name, 'wb') as f:
+            f.write(b"not an npz")
+
+def main(argv):
+    count = 2000
+    values = 1000
+    try:
+        opts, args = getopt.getopt(argv, "hn:e:")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            count = int(arg)
+        elif opt == "-e":
+            values = int(arg)
+
+    results = makeResults(count, values)
+    directory = tempfile.mkdtemp(prefix="benchNodeCache")
+    try:
+        cache = nodeCache.NodeCache(directory, ("timestamps", 100.0, None, None, None, 5.0))
+        keys = [cache.key(("node%d" % n).encode("utf-8")) for n in range(count)]
+
+        start = time.time()
+        for key, result in zip(keys, results):
+            cache.put(key, result)
+        seconds = time.time() - start
+        print("put   %8.2f s %10.0f nodes/s" % (seconds, count / seconds))
+
+        start = time.time()
+        readBack = [cache.get(key) for key in keys]
+        seconds = time.time() - start
+        identical = all(same(a, b) for a, b in zip(results, readBack))
+        print("get   %8.2f s %10.0f nodes/s   identical: %s" % (seconds, count / seconds, identical))
+
+        bad = range(0, count, badEntryEvery)
+        for n in bad:
+            damage(cache.path(keys[n]), n)
+        cache.hits = cache.misses = 0
+        readBack = [cache.get(key) for key in keys]
+        missed = cache.misses == len(bad) and all(readBack[n] is None for n in bad)
+        print("damaged %d entries   read as misses: %s" % (len(bad), missed))
+
+        for n in bad:
+            cache.put(keys[n], results[n])
+        cache.hits = cache.misses = 0
+        readBack = [cache.get(keys[n]) for n in bad]
+        rewritten = cache.hits == len(bad) and all(same(results[n], b) for n, b in zip(bad, readBack))
+        print("put again   hits: %s" % rewritten)
+    finally:
+        shutil.rmtree(directory)
+    if not (identical and missed and rewritten):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
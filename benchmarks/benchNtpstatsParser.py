@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of ntpstatsParser.py on a made up copy of the ntpstats of a lab,
+as copyntpstats.py leaves it: a folder per node with a day of loopstats and
+peerstats per rotated file, some of them gzipped, and the current files.
+
+usage: python benchmarks/benchNtpstatsParser.py [-n nodes] [-d days] [-j jobs] [-k]
+
+The last line of the current loopstats of every node is cut short, as if it
+was copied while ntpd was writing it, the current peerstats has a line that
+isn't one, and one rotated file of every node is there twice, plain and
+gzipped. The nodes are parsed with one job and with jobs jobs, and what both
+give must be what a line by line parse of the files gives. The throughput is
+printed in lines per second. With -k the made up folder is kept.
+"""
+from __future__ import print_function
+import os, sys, getopt, gzip, random, shutil, tempfile, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import ntpstatsParser
+
+usage = "usage: python benchNtpstatsParser.py [-n nodes] [-d days] [-j jobs] [-k]"
+
+firstDay = 57000
+# seconds between loopstats lines, and the peers of every node, the first being the system peer
+poll = 64
+peers = [("10.0.0.1", "9614"), ("10.0.0.2", "9414"), ("10.0.0.3", "9314")]
+
+def makeDays(rand, days):
+    """ loopstats and peerstats text of every day """
+    loop, peer = [], []
+    for day in range(firstDay, firstDay + days):
+        loopLines, peerLines = [], []
+        for i in range(86400 // poll):
+            seconds = i * poll + rand.random()
+            loopLines.append("%d %.3f %.9f %.3f %.9f %.6f %d\n" % (day, seconds, rand.gauss(0, 1e-4),
+                             rand.gauss(-20, 0.5), abs(rand.gauss(0, 1e-5)), abs(rand.gauss(0, 0.01)), 6))
+            address, status = peers[i % len(peers)]
+            peerLines.append("%d %.3f %s %s %.9f %.9f %.9f %.9f\n" % (day, seconds, address, status,
+                             rand.gauss(0, 1e-4), abs(rand.gauss(5e-4, 1e-4)), abs(rand.gauss(0, 1e-3)),
+                             abs(rand.gauss(0, 1e-5))))
+        loop.append("".join(loopLines))
+        peer.append("".join(peerLines))
+    return loop, peer
+
+def writeFile(name, text):
+    if name.endswith(".gz"):
+        with gzip.open(name, "wb") as f:
+            f.write(text.encode("ascii"))
+    else:
+        with open(name, "w") as f:
+            f.write(text)
+
+def makeLab(directory, nodes, days):
+    """ The made up folder, and the number of lines of each kind in it """
+    rand = random.Random(42)
+    loop, peer = makeDays(rand, days)
+    for n in range(nodes):
+        folder = os.path.join(directory, "plana%03d" % n, "ntpstats")
+        os.makedirs(folder)
+        for kind, texts in (("loopstats", loop), ("peerstats", peer)):
+            for day, text in enumerate(texts[:-1]):
+                suffix = ".gz" if day % 2 else ""
+                writeFile(os.path.join(folder, "%s.%d%s" % (kind, 20150101 + day, suffix)), text)
+            if len(texts) > 1:
+                writeFile(os.path.join(folder, "%s.%d.gz" % (kind, 20150100)), texts[0])
+        writeFile(os.path.join(folder, "loopstats"), loop[-1] + "%d 86399.5 0.0000" % (firstDay + days))
+        writeFile(os.path.join(folder, "peerstats"), peer[-1] + "garbage line\n")
+    lines = sum(text.count("\n") for text in loop + peer)
+    return lines * nodes
+
+def lineByLine(folder, kind):
+    """ What ntpstatsParser.parseNode should give, parsing a line at a time """
+    rows = set()
+    for fileName in ntpstatsParser.statsFiles(folder, kind):
+        opener = gzip.open if fileName.endswith(".gz") else open
+        with opener(fileName, "rb") as f:
+            for line in f.read().decode("ascii").splitlines():
+                fields = line.split()
+                if kind == "loopstats" and len(fields) == 7:
+                    rows.add(tuple(float(fields[i]) for i in range(5)))
+                elif kind == "peerstats" and len(fields) == 8 and (int(fields[3], 16) >> 8) & 7 in (6, 7):
+                    rows.add(tuple(float(fields[i]) for i in (0, 1, 4, 5, 6, 7)))
+    return sorted(rows)
+
+def sameColumns(columns, rows):
+    return len(rows) == len(columns[0]) and np.array_equal(np.column_stack(columns), np.array(rows).reshape(-1, len(columns)))
+
+def main(argv):
+    nodes = 20
+    days = 30
+    jobs = 4
+    keep = False
+    try:
+        opts, args = getopt.getopt(argv, "hn:d:j:k")
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print(usage)
+            sys.exit()
+        elif opt == "-n":
+            nodes = int(arg)
+        elif opt == "-d":
+            days = int(arg)
+        elif opt == "-j":
+            jobs = int(arg)
+        elif opt == "-k":
+            keep = True
+
+    directory = tempfile.mkdtemp(prefix="benchNtpstatsParser")
+    try:
+        lines = makeLab(directory, nodes, days)
+        print("%d nodes, %d days, %d lines" % (nodes, days, lines))
+        results = {}
+        for n in (1, jobs):
+            start = time.time()
+            results[n] = dict((kind, list(ntpstatsParser.parseNodes(directory, kind, jobs=n)))
+                              for kind in ("loopstats", "peerstats"))
+            seconds = time.time() - start
+            print("%3d jobs %8.2f s %12.0f lines/s" % (n, seconds, lines / seconds))
+        correct = True
+        for kind in ("loopstats", "peerstats"):
+            for (name, columns), (otherName, otherColumns) in zip(results[1][kind], results[jobs][kind]):
+                rows = lineByLine(os.path.join(directory, name, "ntpstats"), kind)
+                correct = (correct and name == otherName and sameColumns(columns, rows) and
+                           sameColumns(otherColumns, rows))
+        print("same as a line by line parse: %s" % correct)
+    finally:
+        if keep:
+            print("kept " + directory)
+        else:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
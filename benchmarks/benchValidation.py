@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the node validation of diagnostics.py: jsonschema.validate on
+every node against the compiled validator of nodeValidator.py, on generated
+freqOffset and timestamps nodes.
+
+usage: python benchmarks/benchValidation.py [-n nodes] [-e entriesPerNode]
+
+Every few nodes has an entry with a missing field or a field of the wrong
+type. Both validators must accept and reject the same nodes; their
+throughput is printed in entries per second.
+"""
+import os, sys, getopt, random, time
+
+import matplotlib
+matplotlib.use("Agg")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import diagnostics, nodeValidator
+from jsonschema import validate, ValidationError
+
+usage = "usage: python benchValidation.py [-n nodes] [-e entriesPerNode]"
+
+graphTypes = [("freqOffset", ['date', 'time', 'freqOffset']),
+              ("timestamps", ['date', 'time', 'originTS', 'receiveTS', 'transmitTS', 'destTS'])]
+# one node in this many gets a bad entry
+badNodeEvery = 10
+
+def makeNodes(col_heads, count, entries):
+    """ Nodes as simplejson decodes them from a cluster dump """
+    rand = random.Random(42)
+    nodes = []
+    for n in xrange(count):
+        nodeEntries = []
+        for i in xrange(entries):
+            entry = {"date": 57000 + i / 86400, "time": float(i % 86400)}
+            for col in col_heads[2:]:
+                entry[col] = rand.gauss(0, 15)
+            nodeEntries.append(entry)
+        if n % badNodeEvery == badNodeEvery - 1:
+            entry = nodeEntries[rand.randint(0, entries - 1)]
+            col = rand.choice(col_heads)
+            if rand.randint(0, 1):
+                del entry[col]
+            else:
+                entry[col] = str(entry[col])
+        nodes.append({"node": "plana%03d" % n, "entries": nodeEntries})
+    return nodes
+
+def timeValidation(nodes, validateNode):
+    start = time.time()
+    outcomes = []
+    for node in nodes:
+        try:
+            validateNode(node)
+            outcomes.append(True)
+        except ValidationError:
+            outcomes.append(False)
+    return time.time() - start, outcomes
+
+def main(argv):
+    count = 200
+    entries = 5000
+    try:
+        opts, args = getopt.getopt(argv, "hn:e:")
+    except getopt.GetoptError:
+        print usage
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == "-h":
+            print usage
+            sys.exit()
+        elif opt == "-n":
+            count = int(arg)
+        elif opt == "-e":
+            entries = int(arg)
+
+    identical = True
+    for graphType, col_heads in graphTypes:
+        nodes = makeNodes(col_heads, count, entries)
+        schema = diagnostics.makeNodeSchema(col_heads)
+        validator = nodeValidator.NodeValidator(schema)
+        results = [("jsonschema", timeValidation(nodes, lambda node: validate(node, schema))),
+                   ("compiled", timeValidation(nodes, validator.validate))]
+        print "%s: %d nodes of %d entries" % (graphType, count, entries)
+        for name, (seconds, outcomes) in results:
+            print "  %-10s %8.2f s %12.0f entries/s %5d rejected" % (
+                name, seconds, count * entries / seconds, outcomes.count(False))
+        identical = identical and results[0][1][1] == results[1][1][1]
+    print "Outcomes identical:", identical
+    if not identical:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,142 @@
+"""
+Stand-ins and helpers the benchmarks of copyntpstats.py share: copy scripts
+that work locally instead of running rsync over ssh, a stub ssh, a made up
+inventory, and running copyntpstats.py on them.
+"""
+import os
+import sys
+import signal
+import subprocess
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# seconds the hosts that hang get
+timeout = 2
+# one host in this many fails and one hangs
+failEvery = 7
+hangEvery = 11
+
+# stand-in for copyfromssh.sh: FILE_PATH SERVER_NAME OUT_FOLDER, which
+# copies after a delay, fails or hangs by the name of the host, and prints
+# the --stats of rsync, which received receivedBytes
+standIn = """#!/bin/bash
+case "$2" in
+  fail*) echo "ssh: connect to host $2 port 22: Connection refused" >&2; exit 255;;
+  hang*) exec sleep 3600;;
+esac
+echo "$(date +%s.%N) $2" >> "{starts}"
+sleep {delay}
+mkdir -p "$3"
+echo "copied $1 from $2"
+cat <<EOF
+
+Number of files: 3 (reg: 2, dir: 1)
+Number of regular files transferred: 2
+Total file size: 12,345 bytes
+Total transferred file size: 12,345 bytes
+Total bytes sent: 52
+Total bytes received: 1,234
+
+sent 52 bytes  received 1,234 bytes  2,468.00 bytes/sec
+total size is 12,345  speedup is 9.60
+EOF
+"""
+receivedBytes = 1234
+
+# ssh that pays for a handshake unless its control path is a recently used file
+stubSsh = """#!/bin/bash
+control=""; persist=0; operation=""
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -oControlPath=*) control="${{1#-oControlPath=}}";;
+    -oControlPersist=*) persist="${{1#-oControlPersist=}}";;
+    -O) operation="$2"; shift;;
+    -o*) ;;
+    *) break;;
+  esac
+  shift
+done
+host="$1"; shift
+control="${{control//%C/$host}}"
+if [ "$operation" = exit ]; then
+  [ -f "$control" ] && rm "$control"
+  exit
+fi
+if [ -z "$control" ] || ! [ -f "$control" ] || [ $(( $(date +%s) - $(stat -c %Y "$control") )) -ge "$persist" ]; then
+  sleep {handshake}
+  echo "$host" >> "{connections}"
+fi
+[ -n "$control" ] && touch "$control"
+# the command runs in a shell, as it does on the host
+exec bash -c "$*"
+"""
+
+def makeInventory(hosts):
+    """ hosts nodes that are up, some of which fail or hang, and one that is down """
+    nodes = []
+    for i in range(hosts):
+        if i % hangEvery == hangEvery - 1:
+            name = "hang%03d" % i
+        elif i % failEvery == failEvery - 1:
+            name = "fail%03d" % i
+        else:
+            name = "plana%03d" % i
+        nodes.append({"name": name, "up": True, "locked": True, "is_vm": False})
+    nodes.append({"name": "down000", "up": False, "locked": False, "is_vm": False})
+    return nodes
+
+def plainInventory(hosts):
+    """ hosts nodes that are up and copy """
+    return [{"name": "plana%03d" % i, "up": True, "locked": True, "is_vm": False} for i in range(hosts)]
+
+def makeScript(name, text):
+    with open(name, "w") as f:
+        f.write(text)
+    os.chmod(name, 0o755)
+
+def makeStandIn(directory, delay):
+    makeScript(os.path.join(directory, "standin.sh"), standIn.format(delay=delay, starts=os.path.join(directory, "starts")))
+
+def makeSsh(directory, handshake):
+    makeScript(os.path.join(directory, "ssh"), stubSsh.format(handshake=handshake,
+                                                               connections=os.path.join(directory, "connections")))
+
+def runCollection(directory, jobs, stopAfter=None, options=(), script="standin.sh"):
+    """
+    Runs copyntpstats.py on directory/inventory.json, with its telemetry in
+    directory/telemetry.jsonl, returns its wall time and log lines
+    """
+    logPath = os.path.join(directory, "copyntpstats.log")
+    if os.path.exists(logPath):
+        os.remove(logPath)
+    command = [sys.executable, os.path.join(root, "copyntpstats.py"), "-j", str(jobs), "-t", str(timeout),
+               "-o", os.path.join(directory, "out"), "-l", logPath, "-s", os.path.join(directory, script),
+               "-c", "cat " + os.path.join(directory, "inventory.json"), "-p", "0", "-m", "",
+               "--telemetry", os.path.join(directory, "telemetry.jsonl")] + list(options)
+    start = time.time()
+    proc = subprocess.Popen(command)
+    if stopAfter is not None:
+        time.sleep(stopAfter)
+        proc.send_signal(signal.SIGTERM)
+    proc.wait()
+    seconds = time.time() - start
+    with open(logPath) as f:
+        lines = [line.split(" \t ", 1)[1] for line in f.read().split("\n") if " \t " in line]
+    return seconds, lines
+
+def countLines(name):
+    if not os.path.exists(name):
+        return 0
+    with open(name) as f:
+        return len(f.read().split())
+
+def processesLeft():
+    """ The processes of the hosts that hang that are still running """
+    return subprocess.run(["pgrep", "-f", "sleep 3600"], stdout=subprocess.PIPE).stdout.split()
+
+def check(failed, name, ok):
+    """ Keeps the name of a check that failed, returns ok """
+    if not ok:
+        failed.append(name)
+    return ok
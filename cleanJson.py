@@ -4,7 +4,8 @@ Created on 10 March 2015
 
 @author: mattcook
 """
-import simplejson, os, re, sys, getopt
+import simplejson, os, re, sys, getopt, shutil, tempfile, multiprocessing, hashlib
+import columnStore, compressedFiles, nodeIndex
 
 # this is path to file
 # uncomment to direct to path of file
@@ -16,12 +17,474 @@ newFileName = ""
 
 invalidLinesFile = "badlines.txt"
 
-usage = "usage: python cleanJson.py -i inputFile.json -o outputFile.json [-f | -t]"
+usage = "usage: python cleanJson.py -i inputFile.json -o outputFile.json [-f | -t] [-j jobs] [-c storeDir] [-r] [-x]"
+
+# with -r the state of the last run is kept in outputFile.json + this
+checkpointSuffix = ".checkpoint"
+# number of bytes hashed at the start of the input and before the checkpoint
+fingerprintSize = 1 << 16
+
+# read and write in large blocks, the files we clean are several GB
+bufferSize = 1 << 20
+# runs of entry lines are checked in blocks of about this many bytes; a block
+# with a bad line in it is split in halves until it is at most minBlockLines
+# long, and then checked line by line
+blockSize = 1 << 18
+minBlockLines = 64
+
+# integers are parsed by the C scanner rather than a python callback
+decoder = simplejson.JSONDecoder(parse_int=int)
+
+# A well formed entry line is a flat object of numbers followed by a comma, e.g.
+#   {"date": 57023, "time": 3.5, "freqOffset": -12.25},
+# Lines matching this are accepted without handing them to the JSON parser.
+# Anything else goes through wrappedLineIsValid, so the regular expression only
+# has to accept a subset of what simplejson accepts.
+_ws = r'[ \t\n\r]*'
+_number = r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?'
+_member = r'"[ !#-\[\]-~]*"' + _ws + ':' + _ws + _number
+entryLine = re.compile(_ws + r'\{' + _ws + '(?:' + _member + _ws + ',' + _ws + ')*' +
+                       _member + _ws + r'\}' + _ws + ',' + _ws + r'\Z')
+
+def wrappedLineIsValid(line, fillerLine):
+    """
+    Original check: wrap the line into a small JSON document that is only
+    valid if the line holds complete, comma terminated JSON values.
+    """
+    try:
+        decoder.decode("[" + line + "\n" + fillerLine)
+        return True
+    except Exception as e:
+        return False
+
+def makeLineChecker(fillerLine):
+    """ Returns a function telling whether a line holds valid entries """
+    matchEntry = entryLine.match
+    def isValidLine(line):
+        return matchEntry(line) is not None or wrappedLineIsValid(line, fillerLine)
+    return isValidLine
+
+def decodeBlock(block, fillerLine):
+    """
+    Returns the entries of block, a run of newline terminated lines without
+    node markers, if every line would pass wrappedLineIsValid, else None.
+
+    The whole block is parsed at once. That alone would also accept values
+    spread over several lines, so every line must in addition start with "{"
+    and end with ",", and the block must not contain arrays. Inside an object
+    a comma is followed by a key, so a "{" after a line break then always
+    starts a new value. If the block parses to one value per line, each line
+    holds exactly one complete object. Blocks formatted any other way are
+    reported as invalid and get checked line by line.
+    """
+    lines = block.count("\n")
+    if (block[:1] != "{" or not block.endswith(",\n") or "[" in block
+            or block.count(",\n{") != lines - 1):
+        return None
+    try:
+        entries = decoder.decode("[" + block + fillerLine)
+    except Exception as e:
+        return None
+    if len(entries) != lines + 1:
+        return None
+    # drop the filler
+    entries.pop()
+    return entries
+
+def decodeLine(line, fillerLine):
+    """ Entries of a line that passed wrappedLineIsValid """
+    return decoder.decode("[" + line + "\n" + fillerLine)[:-1]
+
+nodeName = re.compile(r'"node"[ \t\r]*:[ \t\r]*("(?:[^"\\]|\\.)*")')
+
+def decodeNodeName(line):
+    """ Name of the node started by line, None if it has none """
+    match = nodeName.search(line)
+    if match is None:
+        return None
+    try:
+        return decoder.decode(match.group(1))
+    except Exception as e:
+        return None
+
+class JsonCleaner(object):
+    """
+    Writes the cleaned version of a cluster data file to newJsonData and its
+    invalid lines to badlines, and the entries that are kept to store, a
+    columnStore.StoreWriter, if one is given. lineCounter and firstNode carry
+    the state between calls, so a file can be cleaned in several pieces.
+    """
+
+    def __init__(self, fillerLine, newJsonData, badlines, isValidLine=None, store=None):
+        self.fillerLine = fillerLine
+        self.fillerEndLine = fillerLine + "}]\n"
+        self.fillerMidLine = fillerLine + "},\n"
+        self.newJsonData = newJsonData
+        self.badlines = badlines
+        if isValidLine is None:
+            isValidLine = makeLineChecker(fillerLine)
+        self.isValidLine = isValidLine
+        self.store = store
+        self.lineCounter = 0
+        self.firstNode = True
+
+    def cleanLine(self, line):
+        """ Checks a single line and writes it or its replacement """
+        write = self.newJsonData.write
+        self.lineCounter += 1
+        # check for the final line in JSON file
+        if ("}]}]" in line):
+            entries = line.replace("}]}]", "},")
+            if (self.isValidLine(entries)):
+                write(line)
+                self.storeLine(entries)
+            else:
+                self.reportError(line)
+                write(self.fillerEndLine)
+        # check for the end of one node
+        elif ("}]}," in line):
+            line = line.replace("}]}", "}")
+            if (self.isValidLine(line)):
+                write(line)
+                self.storeLine(line)
+            else:
+                self.reportError(line)
+                write(self.fillerMidLine)
+        # check for first line in node data
+        elif ("\"node\"" in line):
+            # make sure we don't put an invalid line for the very first one
+            if (self.firstNode):
+                self.firstNode = False
+            else:
+                write(self.fillerMidLine)
+            if self.store is not None:
+                self.store.startNode(decodeNodeName(line))
+            line = re.sub(r'"entries":\[.+', r'"entries":[', line)
+            write(line)
+        # check if this line is valid
+        elif (self.isValidLine(line)):
+            write(line)
+            self.storeLine(line)
+        # if not, throw away this line
+        else:
+            #print "Error in line", self.lineCounter
+            #print line
+            self.badlines.write(line)
+            self.badlines.write("\n")
+
+    def storeLine(self, line):
+        """ Adds the entries of a valid line to the store """
+        if self.store is not None:
+            self.store.addEntries(decodeLine(line, self.fillerLine))
+
+    def reportError(self, line):
+        print "Error in line", self.lineCounter
+        print line
+
+    def cleanLines(self, lines):
+        """ Original line by line loop """
+        for line in lines:
+            self.cleanLine(line)
+
+    def cleanBlock(self, block):
+        """ Cleans a run of entry lines, each ending with a newline """
+        entries = decodeBlock(block, self.fillerLine)
+        if entries is not None:
+            self.newJsonData.write(block)
+            if self.store is not None:
+                self.store.addEntries(entries)
+            self.lineCounter += block.count("\n")
+        elif block.count("\n") <= minBlockLines:
+            self.cleanLines([line + "\n" for line in block.split("\n")[:-1]])
+        else:
+            middle = block.index("\n", len(block) // 2) + 1
+            if middle == len(block):
+                middle = block.rindex("\n", 0, len(block) - 1) + 1
+            self.cleanBlock(block[:middle])
+            self.cleanBlock(block[middle:])
+
+    def cleanText(self, text):
+        """
+        Cleans text made of whole lines. Lines with node markers go through
+        cleanLine, the runs of entry lines between them through cleanBlock.
+        """
+        pos = 0
+        end = len(text)
+        while pos < end:
+            nodeAt = text.find("\"node\"", pos)
+            closeAt = text.find("}]}", pos)
+            if nodeAt < 0:
+                marker = closeAt
+            elif closeAt < 0:
+                marker = nodeAt
+            else:
+                marker = min(nodeAt, closeAt)
+            if marker < 0:
+                lineStart = lineEnd = end
+            else:
+                lineStart = max(pos, text.rfind("\n", pos, marker) + 1)
+                lineEnd = text.find("\n", marker) + 1
+                if lineEnd == 0:
+                    lineEnd = end
+            while pos < lineStart:
+                blockEnd = text.find("\n", min(pos + blockSize, lineStart) - 1) + 1
+                self.cleanBlock(text[pos:blockEnd])
+                pos = blockEnd
+            if lineStart < end:
+                self.cleanLine(text[lineStart:lineEnd])
+            pos = lineEnd
+
+    def cleanStream(self, json_data, length=None):
+        """
+        Cleans everything that can be read from json_data, or only the next
+        length bytes of it
+        """
+        rest = []
+        while length != 0:
+            if length is None:
+                chunk = json_data.read(bufferSize)
+            else:
+                chunk = json_data.read(min(bufferSize, length))
+                length -= len(chunk)
+            if not chunk:
+                break
+            cut = chunk.rfind("\n") + 1
+            if cut == 0:
+                # still in the middle of a (very long) line
+                rest.append(chunk)
+                continue
+            rest.append(chunk[:cut])
+            self.cleanText("".join(rest))
+            rest = [chunk[cut:]]
+        # last line without a newline
+        rest = "".join(rest)
+        if rest:
+            self.cleanLine(rest)
+
+class ChunkCleaner(JsonCleaner):
+    """ Keeps the reported errors instead of printing them """
+
+    def __init__(self, *args):
+        JsonCleaner.__init__(self, *args)
+        self.errors = []
+
+    def reportError(self, line):
+        self.errors.append((self.lineCounter, line))
+
+def isNodeLine(line):
+    """ True for the lines JsonCleaner.cleanLine treats as the start of a node """
+    return "\"node\"" in line and "}]}]" not in line and "}]}," not in line
+
+def findChunks(fileName, count, start, end, firstNode):
+    """
+    Splits the byte range [start, end) of fileName into at most count
+    ranges. Every range but the first starts with a node line that comes
+    after the first node line of the range (or firstNode is False already),
+    so all of them start with firstNode being False.
+    """
+    starts = [start]
+    with open(fileName, 'r', bufferSize) as json_data:
+        json_data.seek(start)
+        # nothing can be split off before the first node has been seen
+        if firstNode:
+            line = json_data.readline()
+            while line and json_data.tell() <= end and not isNodeLine(line):
+                line = json_data.readline()
+        firstNodeEnd = json_data.tell()
+        for i in range(1, count):
+            target = max(start + (end - start) * i // count, firstNodeEnd, starts[-1] + 1)
+            if target >= end:
+                break
+            json_data.seek(target - 1)
+            # skip the rest of the line the target falls into
+            json_data.readline()
+            offset = json_data.tell()
+            line = json_data.readline()
+            while line and not isNodeLine(line):
+                offset = json_data.tell()
+                line = json_data.readline()
+            if not line or offset >= end:
+                break
+            if offset > starts[-1]:
+                starts.append(offset)
+    return zip(starts, starts[1:] + [end])
+
+def cleanChunk(args):
+    """
+    Cleans the given byte range of fileName into temporary files, for use in
+    a process pool. Returns the names of those files, the number of lines in
+    the range, the errors found and the firstNode state at the end.
+    """
+    fileName, start, end, firstNode, fillerLine, directory, columns = args
+    outFd, outName = tempfile.mkstemp(dir=directory)
+    badFd, badName = tempfile.mkstemp(dir=directory)
+    store = storeName = None
+    if columns is not None:
+        storeName = tempfile.mkdtemp(dir=directory)
+        store = columnStore.StoreWriter(storeName, columns)
+        # the range may start in the middle of a node
+        store.continueNode()
+    with open(fileName, 'r', bufferSize) as json_data:
+        with os.fdopen(outFd, 'w', bufferSize) as newJsonData:
+            with os.fdopen(badFd, 'w') as badlines:
+                cleaner = ChunkCleaner(fillerLine, newJsonData, badlines, None, store)
+                cleaner.firstNode = firstNode
+                json_data.seek(start)
+                cleaner.cleanStream(json_data, end - start)
+    if store is not None:
+        store.close()
+    return outName, badName, storeName, cleaner.lineCounter, cleaner.errors, cleaner.firstNode
+
+def cleanParallel(fileName, newJsonData, badlines, fillerLine, jobs, store, start, end,
+                  lineCounter, firstNode):
+    """
+    Cleans the byte range [start, end) of fileName in a pool of jobs
+    processes. The range is split at node lines into a few pieces per
+    process, and the cleaned pieces are appended to newJsonData, badlines and
+    store (if not None) in order, giving the same result as cleaning the
+    whole range at once. Returns the lineCounter and firstNode state after
+    the range.
+    """
+    directory = os.path.dirname(os.path.abspath(newJsonData.name))
+    chunks = findChunks(fileName, jobs * 4, start, end, firstNode)
+    pool = multiprocessing.Pool(jobs)
+    try:
+        columns = None if store is None else store.columns
+        results = pool.imap(cleanChunk,
+            [(fileName, chunkStart, chunkEnd, firstNode and chunkStart == start, fillerLine,
+              directory, columns) for chunkStart, chunkEnd in chunks])
+        for outName, badName, storeName, lines, errors, chunkFirstNode in results:
+            for lineNumber, line in errors:
+                print "Error in line", lineCounter + lineNumber
+                print line
+            lineCounter += lines
+            firstNode = firstNode and chunkFirstNode
+            for name, out in ((outName, newJsonData), (badName, badlines)):
+                with open(name, 'r', bufferSize) as part:
+                    shutil.copyfileobj(part, out, bufferSize)
+                os.remove(name)
+            if storeName is not None:
+                store.append(storeName)
+                shutil.rmtree(storeName)
+    finally:
+        pool.terminate()
+    return lineCounter, firstNode
+
+def cleanRange(fileName, newJsonData, badlines, fillerLine, jobs, store, start, end,
+               lineCounter=0, firstNode=True):
+    """
+    Cleans the byte range [start, end) of fileName, starting from the given
+    lineCounter and firstNode state, and returns the state after it. A
+    compressed fileName can only be cleaned whole, with start 0 and end None.
+    """
+    if jobs > 1:
+        return cleanParallel(fileName, newJsonData, badlines, fillerLine, jobs, store,
+                             start, end, lineCounter, firstNode)
+    cleaner = JsonCleaner(fillerLine, newJsonData, badlines, None, store)
+    cleaner.lineCounter = lineCounter
+    cleaner.firstNode = firstNode
+    with compressedFiles.openRead(fileName, bufferSize) as json_data:
+        if start:
+            json_data.seek(start)
+        cleaner.cleanStream(json_data, None if end is None else end - start)
+    return cleaner.lineCounter, cleaner.firstNode
+
+def fingerprint(fileName, offset):
+    """
+    Hash of the start of fileName and of the bytes just before offset, used
+    to notice a file that was rewritten rather than appended to
+    """
+    digest = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        digest.update(f.read(min(offset, fingerprintSize)))
+        f.seek(max(0, offset - fingerprintSize))
+        digest.update(f.read(offset - f.tell()))
+    return digest.hexdigest()
+
+def completeLinesEnd(fileName, size):
+    """ Offset just past the last newline of fileName, 0 if it has none """
+    with open(fileName, 'rb') as f:
+        end = size
+        while end > 0:
+            start = max(0, end - bufferSize)
+            f.seek(start)
+            block = f.read(end - start)
+            newline = block.rfind("\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+def loadCheckpoint(fileName, newFileName, storeName, fillerLine):
+    """
+    Reads the checkpoint of newFileName. Returns None if there is none, or
+    if it can't be resumed from: it was made from another input or with
+    other options, the input was truncated or rewritten since, or the outputs
+    were changed.
+    """
+    checkpointName = newFileName + checkpointSuffix
+    if not os.path.isfile(checkpointName):
+        return None
+    try:
+        with open(checkpointName, 'r') as f:
+            checkpoint = simplejson.load(f)
+    except Exception as e:
+        print "Unreadable checkpoint " + checkpointName
+        return None
+    if (checkpoint["input"] != os.path.abspath(fileName) or checkpoint["fillerLine"] != fillerLine
+            or checkpoint["badlines"] != os.path.abspath(invalidLinesFile)
+            or checkpoint["store"] != (os.path.abspath(storeName) if storeName else "")):
+        print "Checkpoint was made with other files or options"
+        return None
+    offset = checkpoint["offset"]
+    if os.path.getsize(fileName) < offset:
+        print "Input was truncated since the last run"
+        return None
+    if fingerprint(fileName, offset) != checkpoint["fingerprint"]:
+        print "Input was rewritten since the last run"
+        return None
+    if (not os.path.isfile(newFileName) or os.path.getsize(newFileName) < checkpoint["outputSize"]
+            or not os.path.isfile(invalidLinesFile)
+            or os.path.getsize(invalidLinesFile) < checkpoint["badlinesSize"]
+            or (storeName and not columnStore.isStore(storeName))
+            or (storeName and columnStore.openStore(storeName).length < checkpoint["storeState"]["length"])):
+        print "Outputs were changed since the last run"
+        return None
+    return checkpoint
+
+def saveCheckpoint(fileName, newFileName, storeName, fillerLine, offset, lineCounter, firstNode,
+                   outputSize, badlinesSize, storeState):
+    checkpoint = {"input": os.path.abspath(fileName), "fillerLine": fillerLine,
+                  "badlines": os.path.abspath(invalidLinesFile),
+                  "store": os.path.abspath(storeName) if storeName else "",
+                  "offset": offset, "fingerprint": fingerprint(fileName, offset),
+                  "lineCounter": lineCounter, "firstNode": firstNode,
+                  "outputSize": outputSize, "badlinesSize": badlinesSize, "storeState": storeState}
+    checkpointName = newFileName + checkpointSuffix
+    with open(checkpointName + ".tmp", 'w') as f:
+        simplejson.dump(checkpoint, f)
+    os.rename(checkpointName + ".tmp", checkpointName)
+
+def openOutput(name, size):
+    """
+    Opens name for writing, keeping only its first size bytes. Compressed
+    outputs are always written from the start.
+    """
+    if size is None:
+        return compressedFiles.openWrite(name, bufferSize)
+    output = open(name, 'r+', bufferSize)
+    output.truncate(size)
+    output.seek(size)
+    return output
 
 def main(argv):
     fillerLine = ""
+    jobs = 1
+    storeName = ""
+    resume = False
+    index = False
     try:
-      opts, args = getopt.getopt(argv,"hi:o:tf",["ifile=","ofile=","--help", "--freqOffset", "--timestamps"])
+      opts, args = getopt.getopt(argv,"hi:o:tfj:c:rx",["ifile=","ofile=","--help", "--freqOffset", "--timestamps", "jobs=", "columns=", "resume", "index"])
     except getopt.GetoptError:
       print usage
       sys.exit(2)
@@ -35,68 +498,72 @@ def main(argv):
         newFileName = arg
       elif opt in ("-f", "--freqOffset"):
         fillerLine = "{\"date\": -1, \"time\": 0.0, \"freqOffset\": 0.0}]"
+        columns = columnStore.freqOffsetColumns
       elif opt in ("-t", "--timestamps"):
         fillerLine = "{\"date\": -1, \"time\": 0.0, \"originTS\": 0.0, \"receiveTS\": 0.0, \"transmitTS\": 0.0, \"destTS\": 0.0}]"
+        columns = columnStore.timestampsColumns
+      elif opt in ("-j", "--jobs"):
+        jobs = int(arg)
+      elif opt in ("-c", "--columns"):
+        storeName = arg
+      elif opt in ("-r", "--resume"):
+        resume = True
+      elif opt in ("-x", "--index"):
+        index = True
 
     if fillerLine == "" or fileName == "" or newFileName == "":
         print usage
         sys.exit(0)
 
-    fillerEndLine = fillerLine + "}]\n"
-    fillerMidLine = fillerLine + "},\n"
-
-    def checkForError(f):
-        try:
-            simplejson.loads(f)
-            return True
-        except Exception as e:
-            return False
-
-    def makeJsonLines(line):
-        return "[" + line + "\n" + fillerLine
-    # loop through checking for errors   
-    lineCounter = 0
-    firstNode = True
-    with open(fileName, 'r') as json_data:
-        with open(newFileName, 'w') as newJsonData:
-            with (open(invalidLinesFile, 'w')) as badlines:
-                for line in json_data:
-                    lineCounter += 1
-                    # check for the final line in JSON file
-                    if ("}]}]" in line):
-                        if (checkForError(makeJsonLines(line.replace("}]}]", "},")))):
-                            newJsonData.write(line)
-                        else:
-                            print "Error in line", lineCounter
-                            print line
-                            newJsonData.write(fillerEndLine)
-                    # check for the end of one node
-                    elif ("}]}," in line):
-                        line = line.replace("}]}", "}")
-                        if (checkForError(makeJsonLines(line))):
-                            newJsonData.write(line)
-                        else:
-                            print "Error in line", lineCounter
-                            print line
-                            newJsonData.write(fillerMidLine)
-                    # check for first line in node data
-                    elif ("\"node\"" in line):
-                        # make sure we don't put an invalid line for the very first one
-                        if (firstNode):
-                            firstNode = False
-                        else:
-                            newJsonData.write(fillerMidLine)
-                        line = re.sub(r'"entries":\[.+', r'"entries":[', line)
-                        newJsonData.write(line)
-                    # check if this line is valid
-                    elif (checkForError(makeJsonLines(line))):
-                        newJsonData.write(line)
-                    # if not, throw away this line
-                    else:
-                        #print "Error in line", lineCounter
-                        #print line
-                        badlines.write(line)
-                        badlines.write("\n")
+    compressedInput = compressedFiles.compressionOf(fileName) is not None
+    if compressedInput and jobs > 1:
+        print "A compressed input can't be split, cleaning it with one process"
+        jobs = 1
+    if resume and (compressedInput or compressedFiles.compressionOf(newFileName) is not None):
+        print "Can't resume with compressed files, cleaning from the start"
+        resume = False
+
+    size = None if compressedInput else os.path.getsize(fileName)
+    checkpoint = None
+    if resume:
+        checkpoint = loadCheckpoint(fileName, newFileName, storeName, fillerLine)
+    if checkpoint is None:
+        if resume:
+            print "Cleaning from the start"
+        start, lineCounter, firstNode = 0, 0, True
+        outputSize = badlinesSize = storeState = None
+    else:
+        start, lineCounter, firstNode = checkpoint["offset"], checkpoint["lineCounter"], checkpoint["firstNode"]
+        outputSize, badlinesSize, storeState = (checkpoint["outputSize"], checkpoint["badlinesSize"],
+                                                checkpoint["storeState"])
+        print "Resuming after line", lineCounter
+
+    store = None
+    if storeName != "":
+        store = columnStore.StoreWriter(storeName, columns, storeState)
+    with openOutput(newFileName, outputSize) as newJsonData:
+        with openOutput(invalidLinesFile, badlinesSize) as badlines:
+            # a line that is still being written is cleaned, but gets cleaned
+            # again by the next resumed run
+            end = completeLinesEnd(fileName, size) if resume else size
+            lineCounter, firstNode = cleanRange(fileName, newJsonData, badlines, fillerLine, jobs,
+                                                store, start, end, lineCounter, firstNode)
+            if resume:
+                newJsonData.flush()
+                badlines.flush()
+                checkpointState = (end, lineCounter, firstNode, newJsonData.tell(), badlines.tell(),
+                                   None if store is None else store.state())
+                cleanRange(fileName, newJsonData, badlines, fillerLine, 1, store, end, size,
+                           lineCounter, firstNode)
+    if store is not None:
+        store.close()
+    if resume:
+        saveCheckpoint(fileName, newFileName, storeName, fillerLine, *checkpointState)
+    if index:
+        if compressedFiles.compressionOf(newFileName) is not None:
+            print "Can't index a compressed output"
+        elif not nodeIndex.saveIndex(newFileName, nodeIndex.buildIndex(newFileName, simplejson.JSONDecoder())):
+            print "Can't write " + nodeIndex.indexName(newFileName)
     print "Done Checking!"
 
 if __name__ =='__main__':
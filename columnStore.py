@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar store of cluster data, written by cleanJson.py and read by
+diagnostics.py.
+
+A store is a directory holding one raw little endian array per field
+(<field>.bin, int64 for date and float64 for everything else) and meta.json,
+which lists the fields, the number of entries and a table of nodes. Each node
+has the range [start, stop) of its entries in the arrays, and whether all of
+its entries had the fields required for the data set, with the types
+diagnostics.py checks for. The entries of a node that is not valid are
+dropped, its range is empty. The filler entries cleanJson.py writes in place
+of bad lines are left out, diagnostics.py drops them anyway. The arrays can be
+memory mapped, so opening a store does not read any of the data.
+"""
+import os, json, operator
+import numpy as np
+
+metaFile = "meta.json"
+
+# fields of the entries for each type of data
+freqOffsetColumns = ["date", "time", "freqOffset"]
+timestampsColumns = ["date", "time", "originTS", "receiveTS", "transmitTS", "destTS"]
+
+try:
+    _integerTypes = (int, long)
+    _stringTypes = (str, unicode)
+except NameError:
+    _integerTypes = (int,)
+    _stringTypes = (str,)
+_numberTypes = _integerTypes + (float,)
+
+def columnType(name):
+    """ Data type of the array of the given field """
+    if name == "date":
+        return np.dtype("<i8")
+    return np.dtype("<f8")
+
+def columnPath(path, name):
+    return os.path.join(path, name + ".bin")
+
+class StoreWriter(object):
+    """
+    Builds a store in directory path. Entries are added as decoded JSON
+    objects, in order, after the startNode call of the node they belong to.
+
+    Given a state returned by state(), the existing store at path is cut
+    back to what it was at that point and then added to.
+    """
+
+    def __init__(self, path, columns, state=None):
+        self.path = path
+        self.columns = list(columns)
+        self.types = [columnType(name) for name in self.columns]
+        self.allowed = [_integerTypes if name == "date" else _numberTypes for name in self.columns]
+        self.getter = operator.itemgetter(*self.columns)
+        if state is None:
+            self.length = 0
+            self.nodes = []
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self.files = [open(columnPath(path, name), 'wb') for name in self.columns]
+        else:
+            store = openStore(path)
+            if store.columns != self.columns or store.length < state["length"]:
+                raise ValueError("store " + path + " does not match the saved state")
+            self.length = state["length"]
+            self.nodes = store.nodes[:state["nodes"]]
+            if state["lastNode"] is not None:
+                self.nodes[-1] = state["lastNode"]
+            self.files = []
+            for name, dtype in zip(self.columns, self.types):
+                out = open(columnPath(path, name), 'r+b')
+                out.truncate(self.length * dtype.itemsize)
+                out.seek(self.length * dtype.itemsize)
+                self.files.append(out)
+
+    def state(self):
+        """ What is needed to carry on with this store in a later run """
+        return {"length": self.length, "nodes": len(self.nodes),
+                "lastNode": dict(self.nodes[-1]) if self.nodes else None}
+
+    def startNode(self, name):
+        # nodes without a usable name can't pass validation
+        self.nodes.append({"node": name, "start": self.length, "stop": self.length,
+                           "valid": isinstance(name, _stringTypes)})
+
+    def addEntries(self, entries):
+        """ Appends a list of entries to the current node """
+        if not self.nodes or not entries or not self.nodes[-1]["valid"]:
+            return
+        node = self.nodes[-1]
+        try:
+            rows = [self.getter(entry) for entry in entries]
+        except (KeyError, TypeError, IndexError):
+            # an entry without the required fields, or one that is no object
+            self.dropNode()
+            return
+        if len(self.columns) == 1:
+            rows = [(row,) for row in rows]
+        columns = list(zip(*rows))
+        for column, allowed in zip(columns, self.allowed):
+            # bool is a subclass of int, but not a JSON number
+            if any(t not in allowed for t in set(map(type, column))):
+                self.dropNode()
+                return
+        try:
+            arrays = [np.array(column, dtype=dtype) for column, dtype in zip(columns, self.types)]
+        except OverflowError:
+            # a date that does not fit the array
+            self.dropNode()
+            return
+        for array, out in zip(arrays, self.files):
+            array.tofile(out)
+        self.length += len(entries)
+        node["stop"] = self.length
+
+    def addColumns(self, arrays):
+        """
+        Appends entries to the current node given as an array per field, in
+        the order of the columns, whose values are not checked
+        """
+        if not self.nodes or not self.nodes[-1]["valid"] or len(arrays[0]) == 0:
+            return
+        for array, dtype, out in zip(arrays, self.types, self.files):
+            np.asarray(array, dtype=dtype).tofile(out)
+        self.length += len(arrays[0])
+        self.nodes[-1]["stop"] = self.length
+
+    def dropNode(self):
+        """ Marks the current node as not valid and removes its entries """
+        node = self.nodes[-1]
+        node["valid"] = False
+        self.length = node["start"]
+        node["stop"] = self.length
+        for out, dtype in zip(self.files, self.types):
+            out.seek(self.length * dtype.itemsize)
+            out.truncate()
+
+    def continueNode(self):
+        """
+        Starts a placeholder for entries that carry on the last node of the
+        store they will be appended to, see append
+        """
+        self.nodes.append({"node": None, "start": self.length, "stop": self.length,
+                           "valid": True, "continued": True})
+
+    def append(self, path):
+        """
+        Appends the nodes and entries of the store at path. The entries of a
+        leading continueNode placeholder go to the current node.
+        """
+        other = openStore(path)
+        nodes = other.nodes
+        continued = None
+        skip = 0
+        if nodes and nodes[0].get("continued"):
+            continued, nodes = nodes[0], nodes[1:]
+            if not self.nodes or not self.nodes[-1]["valid"]:
+                # entries of a node that is dropped anyway
+                skip = continued["stop"]
+            elif not continued["valid"]:
+                self.dropNode()
+        base = self.length - skip
+        for name, dtype, out in zip(self.columns, self.types, self.files):
+            with open(columnPath(path, name), 'rb') as part:
+                part.seek(skip * dtype.itemsize)
+                while True:
+                    block = part.read(1 << 20)
+                    if not block:
+                        break
+                    out.write(block)
+        if continued is not None and self.nodes and self.nodes[-1]["valid"]:
+            self.nodes[-1]["stop"] = base + continued["stop"]
+        for node in nodes:
+            node = dict(node)
+            node["start"] += base
+            node["stop"] += base
+            self.nodes.append(node)
+        self.length = base + other.length
+
+    def close(self):
+        for out in self.files:
+            out.close()
+        meta = {"columns": self.columns, "length": self.length, "nodes": self.nodes}
+        with open(os.path.join(self.path, metaFile), 'w') as out:
+            json.dump(meta, out)
+
+class Store(object):
+    """ A store opened for reading, see openStore """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, metaFile)) as f:
+            meta = json.load(f)
+        self.columns = meta["columns"]
+        self.length = meta["length"]
+        self.nodes = meta["nodes"]
+        self._arrays = {}
+
+    def column(self, name):
+        """ Memory mapped array of one field over all nodes """
+        if name not in self._arrays:
+            if self.length == 0:
+                self._arrays[name] = np.zeros(0, dtype=columnType(name))
+            else:
+                self._arrays[name] = np.memmap(columnPath(self.path, name), dtype=columnType(name),
+                                               mode='r', shape=(self.length,))
+        return self._arrays[name]
+
+    def nodeColumns(self, node, names):
+        """ Arrays of the given fields for one entry of the node table """
+        return [self.column(name)[node["start"]:node["stop"]] for name in names]
+
+def openStore(path):
+    return Store(path)
+
+def isStore(path):
+    return os.path.isfile(os.path.join(path, metaFile))
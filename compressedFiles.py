@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of gzip and zstd compressed files, for cleanJson.py and
+diagnostics.py.
+
+The compression is chosen by the file extension: .gz is gzip, .zst is zstd
+(which needs the zstandard module) and anything else is a plain file.
+Compressed files are decompressed, or compressed, in a background thread that
+runs ahead of the reader by a few chunks, so that the work on the data
+overlaps with the file I/O. zlib and zstd release the interpreter lock while
+they work, so the two threads do run at the same time. Data is read and
+written as bytes (str in Python 2).
+"""
+import gzip, threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# size of the decompressed chunks handed between the threads
+chunkSize = 1 << 20
+# number of chunks the background thread may be ahead
+queueDepth = 4
+
+gzipLevel = 6
+zstdLevel = 3
+
+def compressionOf(name):
+    """ "gzip", "zstd" or None, by the extension of name """
+    if name.endswith(".gz"):
+        return "gzip"
+    if name.endswith(".zst"):
+        return "zstd"
+    return None
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("the zstandard module is needed for .zst files")
+    return zstandard
+
+class ThreadedReader(object):
+    """ Reads the file object raw in a background thread """
+
+    def __init__(self, raw, name, closables=()):
+        self.raw = raw
+        self.name = name
+        self.closables = closables
+        self.queue = queue.Queue(queueDepth)
+        self.pending = b""
+        self.eof = False
+        self.closed = False
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while not self.closed:
+                chunk = self.raw.read(chunkSize)
+                self.queue.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            # handed over to the reading thread
+            self.queue.put(e)
+
+    def _next(self):
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            self.eof = True
+            raise item
+        return item
+
+    def read(self, size=-1):
+        chunks = [self.pending]
+        have = len(self.pending)
+        while (size < 0 or have < size) and not self.eof:
+            chunk = self._next()
+            if not chunk:
+                self.eof = True
+                break
+            chunks.append(chunk)
+            have += len(chunk)
+        data = b"".join(chunks)
+        if size < 0:
+            self.pending = b""
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.eof:
+            # the background thread has handed over its last item and is done
+            self.thread.join()
+        # unblock the background thread if it is waiting for room
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for f in (self.raw,) + tuple(self.closables):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class ThreadedWriter(object):
+    """ Writes to the file object raw in a background thread """
+
+    def __init__(self, raw, name, closables=()):
+        self.raw = raw
+        self.name = name
+        self.closables = closables
+        self.queue = queue.Queue(queueDepth)
+        self.pending = []
+        self.pendingSize = 0
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            if self.error is None:
+                try:
+                    self.raw.write(chunk)
+                except Exception as e:
+                    # raised in the writing thread by the next write or close
+                    self.error = e
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, data):
+        self._check()
+        self.pending.append(data)
+        self.pendingSize += len(data)
+        if self.pendingSize >= chunkSize:
+            self.queue.put(b"".join(self.pending))
+            self.pending = []
+            self.pendingSize = 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.pending:
+            self.queue.put(b"".join(self.pending))
+            self.pending = []
+        self.queue.put(None)
+        self.thread.join()
+        for f in (self.raw,) + tuple(self.closables):
+            f.close()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def openRead(name, buffering=-1):
+    """ Opens name for reading, decompressing it if its extension says so """
+    compression = compressionOf(name)
+    if compression == "gzip":
+        return ThreadedReader(gzip.open(name, 'rb'), name)
+    if compression == "zstd":
+        decompressor = _zstandard().ZstdDecompressor()
+        f = open(name, 'rb')
+        return ThreadedReader(decompressor.stream_reader(f), name, (f,))
+    return open(name, 'rb', buffering)
+
+def openWrite(name, buffering=-1):
+    """ Opens name for writing, compressing it if its extension says so """
+    compression = compressionOf(name)
+    if compression == "gzip":
+        return ThreadedWriter(gzip.open(name, 'wb', gzipLevel), name)
+    if compression == "zstd":
+        compressor = _zstandard().ZstdCompressor(level=zstdLevel)
+        f = open(name, 'wb')
+        return ThreadedWriter(compressor.stream_writer(f), name, (f,))
+    return open(name, 'wb', buffering)
@@ -1,44 +1,738 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import subprocess
 import json
 import time
+import getopt
+import signal
+import shlex
+import asyncio
+import tempfile
+import random
+import math
 
 rootPath = "/home/ubuntu"
 copyScript = rootPath + "/hmcclinic/copyfromssh.sh"
 filePath = "/var/log/ntpstats"
 outFolder = rootPath + "/hmcclinic/ntpdata"
 logFile = "/hmcclinic/copyntpstats.log"
+inventoryCommand = "teuthology-lock --list --all"
+# ssh command rsync runs in the copy script
+sshCommand = "ssh -oBatchMode=yes"
+# sockets of the master ssh connections, one per host
+controlFolder = rootPath + "/hmcclinic/ssh-control"
+# sizes and mtimes of the files copied from each host, "" to copy without looking
+manifestPath = rootPath + "/hmcclinic/ntpmanifest.json"
+# JSON line per copy from a host, "" for none
+telemetryPath = rootPath + "/hmcclinic/copyntpstats.jsonl"
 
+# hosts copied from at the same time
+defaultJobs = 16
+# seconds a host has before its copy is stopped
+defaultTimeout = 600
+# seconds a master connection stays open after its last use, 0 for a new connection every copy
+defaultPersist = 1800
+# with --daemon, seconds between the copies from a host, give or take a jitter of this part of them
+defaultInterval = 3600
+defaultJitter = 0.1
+# seconds the daemon goes on with the nodes the inventory command listed before running it again
+defaultInventoryTTL = 900
+# seconds the inventory command has before it is stopped, and the nodes it listed last kept
+defaultInventoryTimeout = 120
+# most seconds the daemon waits before copying from a host whose copies failed again
+defaultMaxBackoff = 86400
+# log lines are written out at least this often, in seconds
+logFlushSeconds = 10
+# hosts --summary lists
+defaultTop = 20
 
-def main():
-    serverInfoBlob = subprocess.check_output("teuthology-lock --list --all", shell=True)
+usage = "usage: copyntpstats.py [--summary [--top hosts]] [--telemetry telemetryPath] [--daemon [-I intervalSeconds] [--inventory-ttl seconds] [--max-backoff seconds]] [-j jobs] [-t timeoutSeconds] [-p persistSeconds] [--close] [-m manifestPath] [--full] [-o outFolder] [-l logPath] [-s copyScript] [-c inventoryCommand] [--ssh sshCommand] [--control controlFolder] [--path filePath]"
 
-    serverInfo = json.loads(bytes.decode(serverInfoBlob))
 
-    # bound = 0
-    for node in serverInfo:
-        if (not node["up"] or node["is_vm"]):
-            log("{} skipped -- up: {}, locked: {}, is_vm: {}".format(node["name"], node["up"], node["locked"], node["is_vm"]))
-        else:
-            # bound +=1
-            # if (bound > 10): break
-            serverName = node["name"]
-            sp = subprocess.Popen([copyScript, filePath, serverName, outFolder +"/"+ serverName], 
-               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            output, err = sp.communicate()
-            output = output + err
-            log("{}: {}".format(serverName, bytes.decode(output)))
+def inventory(command=inventoryCommand):
+    """ The nodes teuthology-lock lists, as decoded from its JSON """
+    serverInfoBlob = subprocess.check_output(command, shell=True)
+    return json.loads(bytes.decode(serverInfoBlob))
 
-def log(msg):
-    t = time.strftime("%d %b %Y %H:%M:%S", time.gmtime())
-    formatted = "{} \t {}\n".format(t, msg)
+def multiplexedSsh(ssh, control, persist):
+    """
+    ssh command that opens a master connection to a host the first time and
+    goes through it afterwards, ssh closing it once it has been idle for
+    persist seconds. With persist 0 it is ssh itself.
+    """
+    if persist <= 0:
+        return ssh
+    return "{} -oControlMaster=auto -oControlPath={}/%C -oControlPersist={}".format(ssh, control, int(persist))
 
-    with open(rootPath + logFile, "a") as log:
-        log.write(formatted)
+def closeConnections(ssh, control):
+    """ Asks the master connection of every socket in control to exit """
+    if not os.path.isdir(control):
+        return 0
+    closed = 0
+    for name in os.listdir(control):
+        result = subprocess.run(shlex.split(ssh) + ["-oControlPath=" + os.path.join(control, name), "-O", "exit", name],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        closed += result.returncode == 0
+    return closed
 
+def skippedLine(node):
+    return "{} skipped -- up: {}, locked: {}, is_vm: {}".format(node["name"], node["up"], node["locked"], node["is_vm"])
 
+def stopProcess(proc):
+    """ Kills the copy script and what it started, rsync and ssh """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def runStopping(args, timeout, env):
+    """
+    Runs args, returns its exit status and output, or None and no output if
+    it was stopped for taking more than timeout seconds
+    """
+    # in its own process group, so what it starts is stopped along with it
+    proc = await asyncio.create_subprocess_exec(*args,
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        start_new_session=True)
+    try:
+        output, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        stopProcess(proc)
+        await proc.wait()
+        return None, ""
+    except asyncio.CancelledError:
+        stopProcess(proc)
+        raise
+    return proc.returncode, bytes.decode(output + err)
+
+def listingCommand(path):
+    """
+    Remote command that lists the files rsync copies from path, those in its
+    subdirectories too, a line of name (relative to path), size and mtime each
+    """
+    return ["find", path, "-type", "f", "!", "-name", "'*gz'", "-printf", "'%P\\t%s\\t%T@\\n'"]
+
+def transferStats(output):
+    """
+    Bytes rsync received, as its --stats tell, and the output without the
+    stats, or None and the output as it is if it has none
+    """
+    received = None
+    lines = []
+    inStats = False
+    for line in output.splitlines():
+        if line.startswith("Number of files:"):
+            inStats = True
+        if not inStats:
+            lines.append(line)
+            continue
+        if line.startswith("Total bytes received:"):
+            received = (received or 0) + int(line.split(":", 1)[1].replace(",", "").split()[0])
+        elif line.startswith("total size is"):
+            inStats = False
+    if received is None:
+        return None, output
+    return received, "\n".join(lines).strip()
+
+def parseListing(output):
+    """ name: [size, mtime] of the files of a listing """
+    files = {}
+    for line in output.splitlines():
+        fields = line.split("\t")
+        if len(fields) == 3:
+            files[fields[0]] = [int(fields[1]), fields[2]]
+    return files
+
+class Log(object):
+    """
+    The log file, kept open rather than opened for every line. Lines are
+    buffered and written out on flush and close, and as they come in once
+    flushSeconds have gone by since the last time.
+    """
+
+    def __init__(self, path, flushSeconds=logFlushSeconds):
+        self.file = open(path, "a")
+        self.flushSeconds = flushSeconds
+        self.flushed = time.time()
+
+    def write(self, msg):
+        t = time.strftime("%d %b %Y %H:%M:%S", time.gmtime())
+        self.writeLine("{} \t {}".format(t, msg))
+
+    def writeLine(self, line):
+        self.file.write(line + "\n")
+        if time.time() - self.flushed >= self.flushSeconds:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.flushed = time.time()
+
+    def close(self):
+        self.file.close()
+
+class Telemetry(Log):
+    """
+    JSON lines file with a record of every copy from a host, buffered as the
+    log is. A record has the host, the time the copy ended, the run of
+    copyntpstats.py it is from (the time that run started) and its cycle,
+    the copy of the host in that run, its result ("copied", "unchanged",
+    "failed" or "timed out"), exit status (null if it was stopped), wall time
+    in seconds, the files copied (null without a manifest to tell), the bytes
+    rsync received (null if the copy script doesn't print its --stats), and
+    how many copies of the host had failed in a row before it.
+    """
+
+    def write(self, record):
+        self.writeLine(json.dumps(record, sort_keys=True))
+
+def readTelemetry(path):
+    """ The records of a telemetry file, leaving out lines that are not whole """
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+def percentile(values, p):
+    """ Nearest rank pth percentile of values """
+    ordered = sorted(values)
+    return ordered[max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)]
+
+def summarize(records, top=defaultTop):
+    """
+    Lines of a summary of telemetry records: the copies and how they ended,
+    the p50 and p99 wall time of the copies, and the top hosts with the
+    slowest median wall time
+    """
+    if not records:
+        return ["no copies"]
+    hosts = {}
+    for record in records:
+        hosts.setdefault(record["host"], []).append(record)
+    results = {}
+    for record in records:
+        results[record["result"]] = results.get(record["result"], 0) + 1
+    seconds = [record["seconds"] for record in records]
+    lines = ["{} copies from {} hosts in {} runs: {}".format(len(records), len(hosts),
+             len(set(record["run"] for record in records)),
+             ", ".join("{} {}".format(count, result) for result, count in sorted(results.items()))),
+             "wall time p50 {:.2f} s, p99 {:.2f} s, max {:.2f} s".format(percentile(seconds, 50),
+                                                                       percentile(seconds, 99), max(seconds)),
+             "slowest hosts by median wall time:",
+             "{:<24} {:>7} {:>7} {:>9} {:>9} {:>7} {:>12}".format("host", "copies", "failed", "p50 s", "max s",
+                                                                 "files", "bytes")]
+    rows = []
+    for name, hostRecords in hosts.items():
+        hostSeconds = [record["seconds"] for record in hostRecords]
+        rows.append((percentile(hostSeconds, 50), max(hostSeconds), name, hostRecords))
+    for median, slowest, name, hostRecords in sorted(rows, reverse=True)[:top]:
+        failed = sum(1 for record in hostRecords if record["result"] in ("failed", "timed out"))
+        files = sum(record["files"] or 0 for record in hostRecords)
+        copied = sum(record["bytes"] or 0 for record in hostRecords)
+        lines.append("{:<24} {:>7} {:>7} {:>9.2f} {:>9.2f} {:>7} {:>12}".format(name, len(hostRecords), failed,
+                                                                              median, slowest, files, copied))
+    return lines
+
+class InventoryCache(object):
+    """
+    The nodes the inventory command lists, which are kept for ttl seconds
+    before it is run again. If it fails, or takes more than timeout seconds,
+    the nodes it listed last are kept.
+    """
+
+    def __init__(self, command, ttl, log, timeout=defaultInventoryTimeout):
+        self.command = command
+        self.ttl = ttl
+        self.log = log
+        self.timeout = timeout
+        self.cached = None
+        self.expires = 0
+
+    async def nodes(self, now):
+        if self.cached is None or now >= self.expires:
+            # in its own process group, so what it starts is stopped along with it
+            proc = await asyncio.create_subprocess_shell(self.command, stdin=subprocess.DEVNULL,
+                                                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                         start_new_session=True)
+            try:
+                output, err = await asyncio.wait_for(proc.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                stopProcess(proc)
+                await proc.wait()
+                self.log.write("inventory failed, timed out after {} s".format(self.timeout))
+                self.expires = now + self.ttl
+                return self.cached or []
+            except asyncio.CancelledError:
+                stopProcess(proc)
+                raise
+            try:
+                if proc.returncode != 0:
+                    raise ValueError("exit status {}: {}".format(proc.returncode, bytes.decode(err).strip()))
+                self.cached = json.loads(bytes.decode(output))
+            except ValueError as e:
+                self.log.write("inventory failed, {}".format(e))
+            self.expires = now + self.ttl
+        return self.cached or []
+
+class Scheduler(object):
+    """
+    When each host is next due for a copy. A host that is new gets a random
+    time within the interval, so that the hosts are spread evenly over it,
+    and once copied from it is due again an interval later, give or take
+    jitter times the interval. A host whose copy failed waits twice as long
+    for every failure in a row, up to maxBackoff seconds.
+    """
+
+    def __init__(self, interval=defaultInterval, jitter=defaultJitter, maxBackoff=defaultMaxBackoff, rand=None):
+        self.interval = interval
+        self.jitter = jitter
+        self.maxBackoff = max(maxBackoff, interval)
+        self.rand = random.Random() if rand is None else rand
+        # name: [time it is due, failures in a row]
+        self.hosts = {}
+
+    def update(self, names, now):
+        """ Schedules the hosts of names that are new, and drops those that are not in it """
+        names = set(names)
+        for name in list(self.hosts):
+            if name not in names:
+                del self.hosts[name]
+        for name in sorted(names):
+            if name not in self.hosts:
+                self.hosts[name] = [now + self.rand.uniform(0, self.interval), 0]
+
+    def due(self, now):
+        """ The hosts due by now, which are not due again until they are done """
+        names = sorted(name for name, (due, failures) in self.hosts.items() if due <= now)
+        for name in names:
+            self.hosts[name][0] = float("inf")
+        return names
+
+    def done(self, name, ok, now):
+        if name not in self.hosts:
+            return
+        host = self.hosts[name]
+        host[1] = 0 if ok else host[1] + 1
+        delay = min(self.interval * 2 ** host[1], self.maxBackoff)
+        host[0] = now + delay * (1 + self.rand.uniform(-self.jitter, self.jitter))
+
+    def failures(self, name):
+        return self.hosts[name][1] if name in self.hosts else 0
+
+    def nextDue(self):
+        return min([due for due, failures in self.hosts.values()] + [float("inf")])
+
+    def failing(self):
+        return sum(1 for due, failures in self.hosts.values() if failures)
+
+class Manifest(object):
+    """
+    Size and mtime of the files of each host as of its last successful sync,
+    when that was, and totals of what was copied from it, kept as JSON
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hosts = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.hosts = json.load(f)
+
+    def host(self, serverName):
+        return self.hosts.setdefault(serverName, {"files": {}, "lastSync": None, "lastCheck": None, "syncs": 0,
+                                                  "skips": 0, "filesCopied": 0, "bytesCopied": 0, "seconds": 0.0,
+                                                  "last": None})
+
+    def changedFiles(self, serverName, listing, local):
+        """
+        Names of the files of listing whose size or mtime differ from the last
+        sync of the host, or that are missing from local
+        """
+        files = self.hosts.get(serverName, {}).get("files", {})
+        changed = []
+        for name, entry in sorted(listing.items()):
+            copy = os.path.join(local, name)
+            if files.get(name) != entry or not os.path.isfile(copy) or os.path.getsize(copy) != entry[0]:
+                changed.append(name)
+        return changed
+
+    def skipped(self, serverName):
+        host = self.host(serverName)
+        host["skips"] += 1
+        host["lastCheck"] = time.time()
+
+    def synced(self, serverName, listing, changed, received, seconds):
+        """
+        Records a successful copy of the changed files of listing, for which
+        rsync received received bytes, or None if it didn't tell
+        """
+        host = self.host(serverName)
+        host["files"] = listing
+        host["lastSync"] = host["lastCheck"] = time.time()
+        host["syncs"] += 1
+        host["filesCopied"] += len(changed)
+        host["bytesCopied"] += received or 0
+        host["seconds"] += seconds
+        host["last"] = {"files": len(changed), "bytes": received, "seconds": round(seconds, 3)}
+
+    def save(self):
+        """ Replaces the file at once, so an interrupted save leaves the last one """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".manifest")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.hosts, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+class Collector(object):
+    """
+    Copies the ntpstats of hosts with the copy script, jobs hosts at a time.
+    With a manifest, the files of a host are listed first and only those that
+    changed since its last sync are copied, none if nothing did.
+    """
+
+    def __init__(self, jobs=defaultJobs, timeout=defaultTimeout, script=copyScript, out=outFolder,
+                 log=None, ssh=sshCommand, manifest=None, path=filePath, full=False, telemetry=None):
+        self.jobs = jobs
+        self.timeout = timeout
+        self.script = script
+        self.out = out
+        self.log = Log(rootPath + logFile) if log is None else log
+        self.telemetry = telemetry
+        # telemetry records tell the runs apart by when they started
+        self.run = round(time.time(), 3)
+        self.ssh = ssh
+        self.manifest = manifest
+        self.path = path
+        # copy and checksum every file, recording them in the manifest
+        self.full = full
+        # the copy script passes this to rsync as its remote shell
+        self.env = dict(os.environ, NTPSTATS_SSH=ssh)
+
+    async def listHost(self, serverName, timeout):
+        """ name: [size, mtime] of the files of the host, or None if it couldn't be listed """
+        status, output = await runStopping(shlex.split(self.ssh) + [serverName] + listingCommand(self.path),
+                                           timeout, self.env)
+        if status != 0:
+            return None
+        return parseListing(output)
+
+    async def copyHost(self, serverName, timeout, files=None):
+        """
+        Runs the copy script for one host, for only files if given, returns
+        its exit status and output
+        """
+        args = [self.script, self.path, serverName, self.out + "/" + serverName]
+        if files is None:
+            return await runStopping(args, timeout, self.env)
+        with tempfile.NamedTemporaryFile("w", prefix="ntpstats", suffix=".files") as fileList:
+            fileList.write("".join(name + "\n" for name in files))
+            fileList.flush()
+            return await runStopping(args + [fileList.name], timeout, self.env)
+
+    async def syncHost(self, serverName, semaphore):
+        """
+        Copies what changed on one host once semaphore lets it, returns
+        whether it succeeded, the output of the copy, or why there was none,
+        and its record for the telemetry. The listing and the copy have
+        timeout seconds between them.
+        """
+        async with semaphore:
+            start = time.time()
+            record = {"host": serverName, "status": None, "files": None, "bytes": None}
+
+            def finish(result, output):
+                record["result"] = result
+                record["seconds"] = round(time.time() - start, 3)
+                if result == "timed out":
+                    output = "timed out after {} s".format(self.timeout)
+                return result in ("copied", "unchanged"), output, record
+
+            if self.manifest is None:
+                status, output = await self.copyHost(serverName, self.timeout)
+                record["status"] = status
+                record["bytes"], output = transferStats(output)
+                return finish("timed out" if status is None else "copied" if status == 0 else "failed", output)
+            listing = await self.listHost(serverName, self.timeout)
+            left = self.timeout - (time.time() - start)
+            if left <= 0:
+                return finish("timed out", "")
+            changed = None
+            if listing is not None and self.full:
+                changed = sorted(listing)
+            elif listing is not None:
+                changed = self.manifest.changedFiles(serverName, listing,
+                                                     os.path.join(self.out, serverName, os.path.basename(self.path)))
+                if not changed:
+                    self.manifest.skipped(serverName)
+                    record["files"] = record["bytes"] = 0
+                    return finish("unchanged", "unchanged, {} files".format(len(listing)))
+            # a host that can't be listed is copied from as before, which logs why
+            status, output = await self.copyHost(serverName, left, None if self.full else changed)
+            record["status"] = status
+            record["bytes"], output = transferStats(output)
+            if status is None:
+                return finish("timed out", output)
+            if status != 0:
+                return finish("failed", output)
+            if listing is not None:
+                self.manifest.synced(serverName, listing, changed, record["bytes"], time.time() - start)
+                record["files"] = len(changed)
+            return finish("copied", output)
+
+    def syncFailed(self, serverName, start, error):
+        """ What syncHost returns for a copy that raised error instead """
+        record = {"host": serverName, "status": None, "files": None, "bytes": None, "result": "failed",
+                  "seconds": round(time.time() - start, 3)}
+        return False, "failed, {}: {}".format(type(error).__name__, error), record
+
+    def report(self, record, cycle=1, retries=0):
+        """ Writes the telemetry record of a copy """
+        if self.telemetry is not None:
+            record.update(time=round(time.time(), 3), run=self.run, cycle=cycle, retries=retries)
+            self.telemetry.write(record)
+
+    async def collect(self, nodes):
+        """
+        Copies the ntpstats of the nodes that are up and not VMs, logging the
+        output of each as it finishes. SIGTERM stops the copies that are
+        running and cancels the rest. The manifest is saved either way.
+        """
+        semaphore = asyncio.Semaphore(self.jobs)
+
+        async def copyAndLog(serverName):
+            start = time.time()
+            try:
+                ok, output, record = await self.syncHost(serverName, semaphore)
+            except Exception as error:
+                # the host failed, not the collection
+                ok, output, record = self.syncFailed(serverName, start, error)
+            self.log.write("{}: {}".format(serverName, output))
+            self.report(record)
+
+        copies = []
+        for node in nodes:
+            if (not node["up"] or node["is_vm"]):
+                self.log.write(skippedLine(node))
+            else:
+                copies.append(asyncio.ensure_future(copyAndLog(node["name"])))
+        if not copies:
+            return
+        allCopies = asyncio.gather(*copies)
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGTERM, allCopies.cancel)
+        try:
+            await allCopies
+        except asyncio.CancelledError:
+            self.log.write("collection cancelled, {} of {} hosts done".format(sum(1 for c in copies if c.done() and not c.cancelled()), len(copies)))
+            raise
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+            if self.manifest is not None:
+                self.manifest.save()
+
+    async def daemon(self, inventory, scheduler):
+        """
+        Copies from every host that is up and not a VM whenever scheduler
+        has it due, until SIGTERM, taking the nodes from inventory. A node
+        that is skipped is logged when it starts being skipped, not every
+        time. The log is flushed and the manifest saved as copies finish.
+        """
+        semaphore = asyncio.Semaphore(self.jobs)
+        running = {}
+        skipped = {}
+        finished = []
+        cycles = {}
+
+        async def syncAndLog(serverName):
+            cycles[serverName] = cycles.get(serverName, 0) + 1
+            retries = scheduler.failures(serverName)
+            start = time.time()
+            ok = False
+            try:
+                try:
+                    ok, output, record = await self.syncHost(serverName, semaphore)
+                except Exception as error:
+                    ok, output, record = self.syncFailed(serverName, start, error)
+                self.log.write("{}: {}".format(serverName, output))
+                self.report(record, cycles[serverName], retries)
+            finally:
+                # a host whose copy raised backs off and is retried like any other failure
+                scheduler.done(serverName, ok, time.time())
+                finished.append(serverName)
+
+        loop = asyncio.get_event_loop()
+        loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        self.log.write("daemon started, interval {} s".format(scheduler.interval))
+        try:
+            while True:
+                now = time.time()
+                hosts = []
+                wasSkipped, skipped = skipped, {}
+                for node in await inventory.nodes(now):
+                    if (not node["up"] or node["is_vm"]):
+                        skipped[node["name"]] = line = skippedLine(node)
+                        if wasSkipped.get(node["name"]) != line:
+                            self.log.write(line)
+                    else:
+                        hosts.append(node["name"])
+                scheduler.update(hosts, now)
+                for name in scheduler.due(now):
+                    if name in running:
+                        # dropped from the inventory and back while its copy
+                        # runs, which reschedules it when it is done
+                        continue
+                    task = running[name] = asyncio.ensure_future(syncAndLog(name))
+                    task.add_done_callback(lambda task, name=name: running.get(name) is task and running.pop(name))
+                if finished:
+                    del finished[:]
+                    if self.manifest is not None:
+                        self.manifest.save()
+                self.log.flush()
+                if self.telemetry is not None:
+                    self.telemetry.flush()
+                wake = min(scheduler.nextDue(), inventory.expires, time.time() + logFlushSeconds)
+                await asyncio.sleep(max(wake - time.time(), 0.01))
+        except asyncio.CancelledError:
+            # before the cancelled copies count as failures
+            failing = scheduler.failing()
+            tasks = list(running.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.log.write("daemon stopped, {} copies cancelled, {} hosts failing".format(len(tasks), failing))
+            raise
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+            if self.manifest is not None:
+                self.manifest.save()
+            self.log.flush()
+            if self.telemetry is not None:
+                self.telemetry.flush()
+
+def main(argv):
+    jobs = defaultJobs
+    timeout = defaultTimeout
+    persist = defaultPersist
+    close = False
+    out = outFolder
+    logPath = rootPath + logFile
+    script = copyScript
+    command = inventoryCommand
+    ssh = sshCommand
+    control = controlFolder
+    manifest = manifestPath
+    full = False
+    path = filePath
+    daemon = False
+    interval = defaultInterval
+    inventoryTTL = defaultInventoryTTL
+    maxBackoff = defaultMaxBackoff
+    telemetry = telemetryPath
+    summary = False
+    top = defaultTop
+    try:
+        opts, args = getopt.getopt(argv, "hj:t:p:m:o:l:s:c:I:", ["help", "jobs=", "timeout=", "persist=", "close", "manifest=",
+                                                                "full", "out=", "log=", "script=", "inventory=", "ssh=",
+                                                                "control=", "path=", "daemon", "interval=",
+                                                                "inventory-ttl=", "max-backoff=", "telemetry=", "summary", "top="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt in ("-t", "--timeout"):
+            timeout = float(arg)
+        elif opt in ("-p", "--persist"):
+            persist = float(arg)
+        elif opt == "--close":
+            close = True
+        elif opt in ("-m", "--manifest"):
+            manifest = arg
+        elif opt == "--full":
+            full = True
+        elif opt in ("-o", "--out"):
+            out = arg
+        elif opt in ("-l", "--log"):
+            logPath = arg
+        elif opt in ("-s", "--script"):
+            script = arg
+        elif opt in ("-c", "--inventory"):
+            command = arg
+        elif opt == "--ssh":
+            ssh = arg
+        elif opt == "--control":
+            control = arg
+        elif opt == "--path":
+            path = arg
+        elif opt == "--daemon":
+            daemon = True
+        elif opt in ("-I", "--interval"):
+            interval = float(arg)
+        elif opt == "--inventory-ttl":
+            inventoryTTL = float(arg)
+        elif opt == "--max-backoff":
+            maxBackoff = float(arg)
+        elif opt == "--telemetry":
+            telemetry = arg
+        elif opt == "--summary":
+            summary = True
+        elif opt == "--top":
+            top = int(arg)
+    if jobs < 1:
+        print("Error: jobs has to be at least 1")
+        print(usage)
+        sys.exit(2)
+    if daemon and interval <= 0:
+        print("Error: interval has to be more than 0")
+        print(usage)
+        sys.exit(2)
+
+    if summary:
+        if not telemetry or not os.path.exists(telemetry):
+            print("Error: no telemetry to summarize")
+            sys.exit(2)
+        print("\n".join(summarize(readTelemetry(telemetry), top)))
+        return
+
+    log = Log(logPath)
+    telemetry = Telemetry(telemetry) if telemetry else None
+    try:
+        if close:
+            log.write("closed {} master connections".format(closeConnections(ssh, control)))
+            return
+        if persist > 0:
+            # only the user may connect through the sockets
+            os.makedirs(control, mode=0o700, exist_ok=True)
+        manifest = Manifest(manifest) if manifest else None
+        collector = Collector(jobs, timeout, script, out, log, multiplexedSsh(ssh, control, persist), manifest, path, full,
+                              telemetry)
+        if daemon:
+            try:
+                asyncio.run(collector.daemon(InventoryCache(command, inventoryTTL, log),
+                                             Scheduler(interval, maxBackoff=maxBackoff)))
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                # how the daemon is stopped
+                pass
+            return
+        serverInfo = inventory(command)
+        try:
+            asyncio.run(collector.collect(serverInfo))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            sys.exit(1)
+    finally:
+        log.close()
+        if telemetry is not None:
+            telemetry.close()
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
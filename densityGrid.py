@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Two dimensional histograms of (time, value) points, used by diagnostics.py
+to draw the scatterplots of a whole cluster as one image.
+
+A DensityGrid has a fixed number of bins along each axis, so its memory use
+and the time it takes to draw it don't depend on the number of points. As
+points come in outside of the range it covers, the bins are widened. Bin
+widths are powers of two and bins start at multiples of their width, so
+widening merges pairs of bins exactly, and grids built from different data
+can be merged.
+"""
+import copy, math
+import numpy as np
+
+# bins along the time and the value axis
+defaultBins = (800, 400)
+
+def initialWidth(vmin, vmax, n):
+    """ Power of two bin width that fits [vmin, vmax] into n bins """
+    span = vmax - vmin
+    if span > 0:
+        return math.ldexp(1.0, int(math.ceil(math.log(span / (n - 2), 2))))
+    if vmax != 0:
+        # a single value, give it some room around it
+        return math.ldexp(1.0, math.frexp(abs(vmax))[1] - 10)
+    return 1.0
+
+class DensityGrid(object):
+    """ Counts of points in a grid of bins """
+
+    def __init__(self, bins=defaultBins):
+        self.bins = tuple(bins)
+        # bin counts, None until points are added
+        self.counts = None
+        self.widths = [None, None]
+        # index of the first bin along each axis, bin k covering
+        # [k * width, (k + 1) * width)
+        self.lows = [0, 0]
+        # first and last index along each axis that points fell into
+        self.used = [None, None]
+
+    def _axisView(self, axis):
+        return self.counts if axis == 0 else self.counts.T
+
+    def _coarsen(self, axis):
+        """ Doubles the bin width along axis """
+        n = self.bins[axis]
+        old = self._axisView(axis)
+        low = self.lows[axis] // 2
+        new = np.zeros_like(old)
+        np.add.at(new, (self.lows[axis] + np.arange(n)) // 2 - low, old)
+        self.counts = new if axis == 0 else new.T.copy()
+        self.widths[axis] *= 2
+        self.lows[axis] = low
+        self.used[axis] = [self.used[axis][0] // 2, self.used[axis][1] // 2]
+
+    def _shift(self, axis, low):
+        """ Moves the first bin along axis to index low, which must not drop any points """
+        n = self.bins[axis]
+        delta = low - self.lows[axis]
+        old = self._axisView(axis)
+        new = np.zeros_like(old)
+        if delta >= 0:
+            new[:n - delta] = old[delta:]
+        else:
+            new[-delta:] = old[:n + delta]
+        self.counts = new if axis == 0 else new.T.copy()
+        self.lows[axis] = low
+
+    def _cover(self, axis, vmin, vmax):
+        """ Widens and moves the bins along axis until they cover [vmin, vmax] """
+        n = self.bins[axis]
+        while True:
+            width = self.widths[axis]
+            lo = int(math.floor(vmin / width))
+            hi = int(math.floor(vmax / width))
+            if self.used[axis] is not None:
+                lo = min(lo, self.used[axis][0])
+                hi = max(hi, self.used[axis][1])
+            if hi - lo < n:
+                break
+            self._coarsen(axis)
+        if lo < self.lows[axis]:
+            self._shift(axis, lo)
+        elif hi >= self.lows[axis] + n:
+            self._shift(axis, hi - n + 1)
+        self.used[axis] = [lo, hi]
+
+    def _start(self, ranges):
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        for axis, (vmin, vmax) in enumerate(ranges):
+            self.widths[axis] = initialWidth(vmin, vmax, self.bins[axis])
+            self.lows[axis] = int(math.floor(vmin / self.widths[axis]))
+
+    def add(self, x, y):
+        """ Adds the points (x[i], y[i]), leaving out those that are not finite """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        finite = np.isfinite(x) & np.isfinite(y)
+        x = x[finite]
+        y = y[finite]
+        if len(x) == 0:
+            return
+        ranges = [(x.min(), x.max()), (y.min(), y.max())]
+        if self.counts is None:
+            self._start(ranges)
+        for axis, (vmin, vmax) in enumerate(ranges):
+            self._cover(axis, vmin, vmax)
+        ix = np.floor(x / self.widths[0]).astype(np.int64) - self.lows[0]
+        iy = np.floor(y / self.widths[1]).astype(np.int64) - self.lows[1]
+        nx, ny = self.bins
+        self.counts += np.bincount(ix * ny + iy, minlength=nx * ny).reshape(self.bins)
+
+    def merge(self, other):
+        """ Adds the points of another DensityGrid with the same number of bins """
+        if other.counts is None:
+            return
+        if self.counts is None:
+            self.__dict__.update(copy.deepcopy(other.__dict__))
+            return
+        other = copy.deepcopy(other)
+        for axis in range(2):
+            while self.widths[axis] < other.widths[axis]:
+                self._coarsen(axis)
+            while other.widths[axis] < self.widths[axis]:
+                other._coarsen(axis)
+            width = self.widths[axis]
+            self._cover(axis, other.used[axis][0] * width, other.used[axis][1] * width)
+            # covering both may have needed wider bins
+            while other.widths[axis] < self.widths[axis]:
+                other._coarsen(axis)
+        (x0, x1), (y0, y1) = other.used
+        part = other.counts[x0 - other.lows[0]:x1 - other.lows[0] + 1,
+                            y0 - other.lows[1]:y1 - other.lows[1] + 1]
+        self.counts[x0 - self.lows[0]:x1 - self.lows[0] + 1,
+                    y0 - self.lows[1]:y1 - self.lows[1] + 1] += part
+
+    def extent(self):
+        """ (left, right, bottom, top) of the bins points fell into """
+        (x0, x1), (y0, y1) = self.used
+        return (x0 * self.widths[0], (x1 + 1) * self.widths[0],
+                y0 * self.widths[1], (y1 + 1) * self.widths[1])
+
+    def draw(self, axes, cmap="viridis"):
+        """
+        Draws the counts on matplotlib axes as an image, on a log color scale.
+        Returns the image, or None if there are no points.
+        """
+        if self.counts is None:
+            return None
+        from matplotlib.colors import LogNorm
+        (x0, x1), (y0, y1) = self.used
+        counts = self.counts[x0 - self.lows[0]:x1 - self.lows[0] + 1,
+                             y0 - self.lows[1]:y1 - self.lows[1] + 1]
+        return axes.imshow(np.ma.masked_equal(counts.T, 0), origin="lower", aspect="auto",
+                           extent=self.extent(), interpolation="nearest", norm=LogNorm(), cmap=cmap)
@@ -4,11 +4,10 @@ Created on Sun April 5 2015
 
 @author: mattcook
 """
-import matplotlib.pyplot as plt
-import simplejson, os, itertools, re, sys, traceback, math, getopt
-from scipy.stats import norm
-from jsonschema import validate, ValidationError
+# matplotlib is imported in main, only when plotting
+import simplejson, os, re, sys, traceback, math, getopt, copy, csv, collections, fnmatch, glob, multiprocessing, StringIO
 import numpy as np
+import columnStore, compressedFiles, nodeValidator, nodeStream, densityGrid, nodeStats, nodeIndex, nodeCache, nodeSpikes
 
 # edit this to change path
 #os.chdir(r'/Users/username/path')
@@ -19,14 +18,20 @@ nodeNames = ["burnupi", "mira", "plana"]
 # max and min value. Any value above and below this will be removed. This is to remove faulty
 # incorrectly logged values
 threshold = 900.0
+# number of values in the window of the rolling median, values further than spikeMADs median
+# absolute deviations from it being spikes too, None to only remove values above the threshold
+spikeWindow = None
+spikeMADs = nodeSpikes.defaultMADs
 # range for histogram plot
 histogramRange = None
+# range for the histograms of the clock offsets with -t
+offsetHistogramRange = None
 # reasonable freqOffset range
 #histogramRange = (-40, 40)
 # reasonable latency range
 #histogramRange = (0, 5)
 
-usage = 'usage: diagnostics.py -i <inputfile> [-f | -t]'
+usage = 'usage: diagnostics.py -i <inputfile | storeDir | pattern>... [-f | -t] [-j jobs] [-d] [--node pattern]... [--since time] [--until time] [--cache dir] [--spike-window n] [--spike-report file] [--stats-only [--stats-format json|csv] [-o statsFile]]'
 
 nodeSchema = {
   "$schema": "http://json-schema.org/draft-04/schema#",
@@ -62,12 +67,449 @@ nodeSchema = {
   ]
 }
 
+def makeNodeSchema(col_heads):
+  """
+  nodeSchema with the fields of col_heads required in every entry, the
+  ones other than date and time being numbers
+  """
+  schema = copy.deepcopy(nodeSchema)
+  items = schema["properties"]["entries"]["items"]
+  for col in col_heads:
+    if col not in items["properties"]:
+      items["properties"][col] = {
+        "id": col,
+        "type": "number"
+      }
+  items["required"] = list(col_heads)
+  return schema
+
+def nodeDtype(col_heads):
+  """
+  Structured array type of the entries of a node. Dates are kept as floats
+  too, the times computed from them are floats anyway.
+  """
+  return np.dtype([(col, np.float64) for col in col_heads])
+
+def entryReader(col_heads):
+  """
+  Function returning a structured array of the fields of col_heads of the
+  entries of a decoded JSON node, or None if the node fails validation
+  """
+  f = lambda c: tuple([c[col] for col in col_heads])
+  dtype = nodeDtype(col_heads)
+  validator = nodeValidator.NodeValidator(makeNodeSchema(col_heads))
+  def read(node):
+    if not validator.isValid(node):
+      return None
+    return np.array([f(data_point) for data_point in node['entries']], dtype=dtype)
+  return read
+
+def jsonNodes(data, col_heads):
+  """
+  Yields the name and a structured array of the fields of col_heads for
+  each node of the JSON data, or the name and None for nodes that fail
+  validation
+  """
+  read = entryReader(col_heads)
+  for node in data:
+    yield node['node'], read(node)
+
+def textNodes(texts, col_heads, withRaw):
+  """
+  Yields (name, raw, load) for the (name, JSON text) of each node of texts,
+  load() decoding the text into what jsonNodes gives for the node. raw is
+  the text with withRaw, otherwise None.
+  """
+  read = entryReader(col_heads)
+  decoder = simplejson.JSONDecoder()
+  for name, text in texts:
+    yield name, text if withRaw else None, lambda text=text: read(decoder.decode(text))
+
+def storeNodes(store, col_heads, selectNode=None):
+  """
+  Same as jsonNodes, for a columnar store written by cleanJson.py, leaving
+  out the nodes selectNode(name) is false for
+  """
+  dtype = nodeDtype(col_heads)
+  for node in store.nodes:
+    if selectNode is not None and not selectNode(node['node']):
+      continue
+    if not node['valid']:
+      yield node['node'], None
+    else:
+      entries = np.empty(node['stop'] - node['start'], dtype=dtype)
+      for col, column in zip(col_heads, store.nodeColumns(node, col_heads)):
+        entries[col] = column
+      yield node['node'], entries
+
+def loadedNodes(nodes, withRaw):
+  """ (name, raw, load) for the (name, entries) of nodes, raw being the bytes of the entries """
+  for name, entries in nodes:
+    raw = entries.tobytes() if withRaw and entries is not None else None
+    yield name, raw, lambda entries=entries: entries
+
+def nodeTimesAndValues(graphType, entries):
+  """ Arrays of the time in seconds and the value to plot of every entry """
+  times = entries['date'] * 86400 + entries['time']
+  if graphType == "latency":
+    entireRoundTrip = entries['destTS'] - entries['originTS']
+    timeAtServer = entries['transmitTS'] - entries['receiveTS']
+    # round trip time in milliseconds
+    values = (entireRoundTrip - timeAtServer) * 1000.0
+  else:
+    values = entries[graphType]
+  return times, values
+
+def nodeOffsets(entries):
+  """ Clock offset in milliseconds of every entry of timestamps, theta = ((T2 - T1) + (T3 - T4)) / 2 """
+  return ((entries['receiveTS'] - entries['originTS']) + (entries['transmitTS'] - entries['destTS'])) * 500.0
+
+def offsetFigure(figure):
+  """ Number of the figure of the offsets that goes with the figure of the latencies """
+  return figure + len(nodeNames)*2 + 1
+
+class InputError(Exception):
+  """ An input that can't be read, with the reason """
+
+def expandInputs(patterns):
+  """ The inputs named by the -i arguments, shell patterns expanded in sorted order """
+  inputs = []
+  for pattern in patterns:
+    matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+    # a pattern that matches nothing is left for opening it to fail
+    inputs.extend(matches if matches else [pattern])
+  return inputs
+
+def nodeSelector(nodePatterns):
+  """ Function telling whether a node name matches one of nodePatterns, None without patterns """
+  if not nodePatterns:
+    return None
+  return lambda name: any(fnmatch.fnmatchcase(unicode(name), p) for p in nodePatterns)
+
+def openNodes(fileName, col_heads, nodePatterns, since, until, messages, withRaw=False):
+  """
+  The nodes of a JSON file or store, as (name, raw, load) with load()
+  returning what jsonNodes gives for the node, and the file to close once
+  they are read (or None). With withRaw, raw is the JSON text of the node,
+  or its entries in a store, that nodeCache keys are made of, otherwise
+  None. A node found in the cache then doesn't have to be decoded, if the
+  file has an index already.
+  """
+  selectNode = nodeSelector(nodePatterns)
+  if os.path.isdir(fileName):
+    store = columnStore.openStore(fileName)
+    missing = [col for col in col_heads if col not in store.columns]
+    if missing:
+      raise InputError("store " + fileName + " has no " + ", ".join(missing) + " data.")
+    return loadedNodes(storeNodes(store, col_heads, selectNode), withRaw), None
+  windowed = since is not None or until is not None
+  index = None
+  if compressedFiles.compressionOf(fileName) is None:
+    if selectNode is not None or windowed:
+      # the sidecar index tells where the selected nodes and times are in the file
+      index, built = nodeIndex.openIndex(fileName, simplejson.JSONDecoder())
+      if built:
+        print >>messages, "Built index " + nodeIndex.indexName(fileName)
+    elif withRaw:
+      # nodes found in the cache aren't decoded with an index, but one isn't
+      # written just for that
+      index = nodeIndex.loadIndex(fileName)
+  if index is not None:
+    key = None
+    if windowed:
+      # whether a node is valid is told from all of its entries, not the window
+      schema = makeNodeSchema(col_heads)
+      key = nodeIndex.schemaKey(schema)
+      validator = nodeValidator.NodeValidator(schema)
+      if nodeIndex.checkNodes(fileName, index, key, validator.isValid, selectNode, simplejson.JSONDecoder()):
+        nodeIndex.saveIndex(fileName, index)
+    texts = nodeIndex.readNodeTexts(fileName, index, selectNode, since, until, key)
+    return textNodes(texts, col_heads, withRaw), None
+  json_data = compressedFiles.openRead(fileName)
+  # nodes are decoded one at a time, only the values that are kept stay in memory
+  data = ((node, text) for start, end, text, node in nodeStream.iterNodeTexts(json_data, simplejson.JSONDecoder()))
+  if selectNode is not None:
+    data = ((node, text) for node, text in data if selectNode(node['node']))
+  # nodes are limited to those of interest with --node, which selectNode matches
+  read = entryReader(col_heads)
+  nodes = ((node['node'], text if withRaw else None, lambda node=node: read(node)) for node, text in data)
+  return nodes, json_data
+
+def nodeResult(graphType, entries, since, until, window):
+  """
+  The nodeCache.NodeResult of the entries of a node, as jsonNodes gives
+  them: the values plotted and their times, and the runs of spikes left out,
+  found with a rolling median of window values if it is not None. With
+  timestamps, also the clock offsets of the entries kept.
+  """
+  if entries is None:
+    return nodeCache.NodeResult(False)
+  times, values = nodeTimesAndValues(graphType, entries)
+  # incorrect or padded entries
+  inRange = ~((times < 0) | (times > 4929100000.0))
+  if since is not None:
+    inRange &= times >= since
+  if until is not None:
+    inRange &= times <= until
+  offsets = nodeOffsets(entries)[inRange] if graphType == "latency" else None
+  times = times[inRange]
+  values = values[inRange]
+  spikes, deviation = nodeSpikes.detect(values, threshold, window, spikeMADs)
+  runs = nodeSpikes.spikeRuns(times, values, spikes, deviation)
+  # keep track of non-faulty values
+  keep = ~spikes
+  moments = nodeStats.Moments()
+  moments.add(values[keep])
+  if offsets is not None:
+    offsets = offsets[keep]
+  return nodeCache.NodeResult(True, times[keep], values[keep], runs, moments, offsets)
+
+class Summary(object):
+  """
+  What is kept of the inputs read: a nodeStats.ClassStats of the values of
+  each type of node, the nodeSpikes.SpikeReport, with density a
+  densityGrid.DensityGrid of the points of each type, and with offsets the
+  nodeStats.OffsetStats of each type and, with density, their points
+  """
+
+  def __init__(self, density, offsets):
+    # statistics of the values of each cluster
+    self.classStats = [nodeStats.ClassStats(histogramRange) for x in xrange(len(nodeNames))]
+    self.spikeReport = nodeSpikes.SpikeReport()
+    # with -d, the points of each scatterplot
+    self.densityGrids = [densityGrid.DensityGrid() for x in xrange(len(nodeNames))] if density else None
+    self.offsetStats = None
+    self.offsetGrids = None
+    if offsets:
+      self.offsetStats = [nodeStats.OffsetStats(offsetHistogramRange) for x in xrange(len(nodeNames))]
+      if density:
+        self.offsetGrids = [densityGrid.DensityGrid() for x in xrange(len(nodeNames))]
+
+  def merge(self, other):
+    for mine, others in ((self.classStats, other.classStats), (self.densityGrids, other.densityGrids),
+                         (self.offsetStats, other.offsetStats), (self.offsetGrids, other.offsetGrids)):
+      if mine is not None:
+        for item, otherItem in zip(mine, others):
+          item.merge(otherItem)
+    self.spikeReport.merge(other.spikeReport)
+
+def summarizeFile(fileName, graphType, col_heads, nodePatterns, since, until, density, cacheDir,
+                  window, messages, scatter=None):
+  """
+  Reads one input into a Summary, printing what is wrong with the data
+  besides spikes to messages. scatter(figure, times, values) is called with
+  the values kept of each node, and their offsets, to plot them as points.
+  With a cacheDir, the results of the nodes are kept in a nodeCache there.
+  """
+  summary = Summary(density, graphType == "latency")
+  cache = None
+  if cacheDir is not None:
+    cache = nodeCache.NodeCache(cacheDir, (graphType, threshold, since, until, window, spikeMADs))
+  nodes, json_data = openNodes(fileName, col_heads, nodePatterns, since, until, messages, cache is not None)
+  try:
+    for name, raw, load in nodes:
+      key = None
+      result = None
+      if raw is not None:
+        key = cache.key(raw)
+        result = cache.get(key)
+      if result is None:
+        result = nodeResult(graphType, load(), since, until, window)
+        if key is not None:
+          cache.put(key, result)
+      if not result.valid:
+        print >>messages, "Error on node: " + str(name)
+        continue
+      if (since is not None or until is not None) and len(result.times) == 0 and len(result.runs) == 0:
+        # no entries in the window, as the index leaves the node out
+        continue
+      summary.spikeReport.add(name, result.runs)
+      times = result.times
+      values = result.values
+      offsets = result.offsets
+      # check which cluster this data belongs to, plot to respective graph
+      figure = 1
+      for nodeNum in range(len(nodeNames)):
+        if nodeNames[nodeNum] in name:
+          figure = nodeNum+1
+          sigmaNode = summary.classStats[nodeNum].addNode(name, values, result.moments)
+          if len(values) > 0 and math.isnan(sigmaNode):
+            print >>messages, "NaN values on node: " + name
+          # uncomment to print stats of each node
+          #print "node: " + name + " has stdDev: " + str(sigmaNode)
+          if summary.offsetStats is not None:
+            summary.offsetStats[nodeNum].addNode(name, values, offsets)
+
+      if density:
+        summary.densityGrids[figure-1].add(times, values)
+        if summary.offsetGrids is not None:
+          summary.offsetGrids[figure-1].add(times, offsets)
+      elif scatter is not None:
+        scatter(figure, times, values)
+        if summary.offsetStats is not None:
+          scatter(offsetFigure(figure), times, offsets)
+  finally:
+    if json_data is not None:
+      json_data.close()
+  if cache is not None:
+    print >>messages, "%s: %d nodes from the cache, %d computed" % (fileName, cache.hits, cache.misses)
+  return summary
+
+def summarizeTask(task):
+  """ summarizeFile in a pool process, returning the messages as text """
+  messages = StringIO.StringIO()
+  summary = summarizeFile(*(task + (messages,)))
+  return summary, messages.getvalue()
+
+def summarizeInputs(tasks, jobs, messages, scatter=None):
+  """
+  The Summary of the inputs of tasks, the arguments of summarizeFile before
+  messages, read in a pool of jobs processes when there are several. The
+  summaries and messages are put together in the order of the tasks,
+  whichever input is read first.
+  """
+  total = None
+  if jobs > 1 and len(tasks) > 1:
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+      for summary, text in pool.imap(summarizeTask, tasks):
+        messages.write(text)
+        if total is None:
+          total = summary
+        else:
+          total.merge(summary)
+    finally:
+      pool.terminate()
+  else:
+    for task in tasks:
+      summary = summarizeFile(*(task + (messages, scatter)))
+      if total is None:
+        total = summary
+      else:
+        total.merge(summary)
+  return total
+
+# fields of the statistics written by --stats-only, one row per type of node and
+# one for all nodes
+statsColumns = ["class", "nodes", "values", "mu", "sigma", "median", "p99", "averageStdDev"]
+# and with -t, of the clock offsets, in milliseconds
+offsetColumns = ["offsetMu", "offsetSigma", "offsetMedian", "offsetP99", "averageJitter",
+                 "offsetDelayCorrelation"]
+
+def statsRow(className, stats, offsetStats=None):
+  """
+  Row of statsColumns for a nodeStats.ClassStats, and of offsetColumns for a
+  nodeStats.OffsetStats if there is one, None where there are no values
+  """
+  columns = statsColumns + (offsetColumns if offsetStats is not None else [])
+  row = collections.OrderedDict((col, None) for col in columns)
+  row.update({"class": className, "nodes": stats.numNodes(), "values": stats.values.moments.count})
+  if stats.values.moments.count > 0:
+    row.update({"mu": float(stats.values.mean()), "sigma": float(stats.values.std()),
+                "median": stats.values.median(), "p99": stats.values.p99()})
+  stdDevs = stats.stdDevs()
+  if len(stdDevs) > 0:
+    row["averageStdDev"] = float(sum(stdDevs)/float(len(stdDevs)))
+  if offsetStats is not None and offsetStats.offsets.values.moments.count > 0:
+    offsets = offsetStats.offsets.values
+    row.update({"offsetMu": float(offsets.mean()), "offsetSigma": float(offsets.std()),
+                "offsetMedian": offsets.median(), "offsetP99": offsets.p99()})
+    if offsetStats.jitters():
+      row["averageJitter"] = offsetStats.jitter()
+    if not math.isnan(offsetStats.correlation()):
+      row["offsetDelayCorrelation"] = offsetStats.correlation()
+  return row
+
+def writeStats(out, statsFormat, inputs, graphType, rows):
+  if statsFormat == "csv":
+    writer = csv.writer(out)
+    columns = list(rows[0].keys())
+    writer.writerow(columns)
+    for row in rows:
+      writer.writerow(["" if row[col] is None else row[col] for col in columns])
+  else:
+    stats = collections.OrderedDict([("input", inputs), ("graphType", graphType), ("classes", rows)])
+    simplejson.dump(stats, out, indent=2)
+    out.write("\n")
+
+def plotClasses(plt, firstFigure, graphType, graphLabel, classStats, overall, densityGrids=None):
+  """
+  Saves the scatterplot and histogram of each type of node and the
+  histogram of all nodes, printing their statistics. The scatterplots have
+  been drawn from firstFigure on, unless there are densityGrids to draw.
+  """
+  # label all plots
+  for i in range(len(nodeNames)):
+    plt.figure(firstFigure+i)
+    if densityGrids is not None:
+      image = densityGrids[i].draw(plt.gca())
+      if image is not None:
+        plt.colorbar(image, label='Packet Count')
+    plt.xlabel('Time (s)')
+    plt.ylabel(graphLabel)
+    plt.title('Time vs %s Across %d %s Nodes' % (graphType, classStats[i].numNodes(), nodeNames[i]))
+    # name of scatterplot graph is here
+    plt.savefig(graphType + "scatter" + str(i))
+
+  # make next three histogram plots based on data on each cluster
+  for i in range(len(nodeNames)):
+    # need to offset by the figures for previous scatterplots
+    plt.figure(firstFigure+i+len(nodeNames))
+    stats = classStats[i]
+    # skip if no data for given node type
+    stdDevs = stats.stdDevs()
+    if len(stdDevs) == 0:
+      continue
+    print nodeNames[i] + " average standard deviation: " + str(sum(stdDevs)/float(len(stdDevs)))
+
+    stats.values.histogram.draw(plt.gca(), facecolor = 'green')
+    plt.xlabel(graphLabel)
+    plt.ylabel('Packet Count')
+    plt.title("Histogram of %s across %d %s nodes" % (graphLabel, stats.numNodes(), nodeNames[i]))
+    print "Histogram of %s for %s nodes: mu=%.3f, sigma=%.3f, median=%.3f, p99=%.3f" %(graphType, nodeNames[i],
+      stats.values.mean(), stats.values.std(), stats.values.median(), stats.values.p99())
+    # name of histogram graph is here
+    plt.savefig(graphType + "histogram" + str(i))
+
+  stdDevs = overall.stdDevs()
+  if len(stdDevs) > 0:
+    print "Overall Standard Dev across " + str(len(stdDevs)) + " nodes is " + str(sum(stdDevs)/float(len(stdDevs)))
+  plt.figure(firstFigure+len(nodeNames)*2)
+  plt.xlabel(graphLabel)
+  plt.ylabel('Packet Count')
+  overall.values.histogram.draw(plt.gca(), facecolor = 'green')
+  plt.title("Histogram of %s across %d nodes" % (graphLabel, overall.numNodes()))
+  print "Histogram of %s across %d nodes: mu=%.3f, sigma=%.3f, median=%.3f, p99=%.3f" %(graphType, overall.numNodes(),
+    overall.values.mean(), overall.values.std(), overall.values.median(), overall.values.p99())
+  plt.savefig(graphType + "histogramtotal")
+
 def main(argv):
   graphType = ""
+  filePatterns = []
+  # processes reading the inputs
+  jobs = 1
   col_heads = []
   graphLabel = ""
+  # draw the scatterplots as 2D histograms
+  density = False
+  # only write out the statistics, without plotting
+  statsOnly = False
+  statsFormat = "json"
+  statsFile = ""
+  # only the nodes matching one of these patterns, and the entries in [since, until]
+  nodePatterns = []
+  since = None
+  until = None
+  # directory of the nodeCache
+  cacheDir = None
+  window = spikeWindow
+  # where the spike runs are written, by default next to the plots
+  spikeFile = None
   try:
-    opts, args = getopt.getopt(argv,"hi:o:tf",["ifile=", "--help", "--freqOffset", "--timestamps"])
+    opts, args = getopt.getopt(argv,"hi:o:tfdj:",["ifile=", "--help", "--freqOffset", "--timestamps", "density", "jobs=",
+                                              "stats-only", "stats-format=", "ofile=",
+                                              "node=", "since=", "until=", "cache=",
+                                              "spike-window=", "spike-report="])
   except getopt.GetoptError:
     print usage
     sys.exit(2)
@@ -76,172 +518,134 @@ def main(argv):
        print usage
        sys.exit()
     elif opt in ("-i", "--ifile"):
-       fileName = arg
+       filePatterns.append(arg)
     elif opt in ("-f", "--freqOffset"):
       graphType = "freqOffset"
       graphLabel = "Frequency Offset (PPM)"
       col_heads =['date', 'time', 'freqOffset']
-      # update schema with properties and make them required
-      nodeSchema["properties"]["entries"]["items"]["properties"].update( {
-        "freqOffset": {
-          "id": "freqOffset",
-          "type": "number"
-        }})
-      nodeSchema["properties"]["entries"]["items"].update(
-        {"required" : ["date", "time", "freqOffset"]})
     elif opt in ("-t", "--timestamps"):
       graphType = "latency"
       graphLabel = "Latency (ms)"
       col_heads = ['date', 'time', 'originTS', 'receiveTS', 'transmitTS', 'destTS']
-      nodeSchema["properties"]["entries"]["items"]["properties"].update( {
-        "originTS": {
-          "id": "originTS",
-          "type": "number"
-        },
-        "receiveTS": {
-          "id": "receiveTS",
-          "type": "number"
-        },
-        "transmitTS": {
-          "id": "transmitTS",
-          "type": "number"
-        },
-        "destTS": {
-          "id": "destTS",
-          "type": "number"
-        }})
-      nodeSchema["properties"]["entries"]["items"].update({"required" : 
-        ["date", "time", "originTS", "receiveTS", "transmitTS", "destTS"]})
+    elif opt in ("-d", "--density"):
+      density = True
+    elif opt in ("-j", "--jobs"):
+      jobs = int(arg)
+    elif opt == "--stats-only":
+      statsOnly = True
+    elif opt == "--stats-format":
+      statsFormat = arg
+    elif opt in ("-o", "--ofile"):
+      statsFile = arg
+    elif opt == "--cache":
+      cacheDir = arg
+    elif opt == "--spike-window":
+      window = int(arg)
+    elif opt == "--spike-report":
+      spikeFile = arg
+    elif opt == "--node":
+      nodePatterns.append(arg)
+    elif opt in ("--since", "--until"):
+      try:
+        when = nodeIndex.parseTime(arg)
+      except ValueError as e:
+        print "Error: " + str(e)
+        print usage
+        sys.exit(2)
+      if opt == "--since":
+        since = when
+      else:
+        until = when
 
   # make sure graph type is specified
-  if graphType == "" or fileName == "":
+  if graphType == "" or not filePatterns:
     print "Error: Arguments not complete."
     print usage
     sys.exit(0)
+  if window is not None and window < 1:
+    print "Error: the spike window has to be at least 1"
+    print usage
+    sys.exit(2)
+  if statsFormat not in ("json", "csv"):
+    print "Error: unknown statistics format " + statsFormat
+    print usage
+    sys.exit(2)
 
-  json_data = open(fileName)
-  data = simplejson.load(json_data)
+  if statsOnly:
+    # stdout may carry the statistics, messages about the data go to stderr
+    messages = sys.stderr
+  else:
+    messages = sys.stdout
+    import matplotlib.pyplot as plt
 
-  figure_num = 1
-  axes = plt.gca()
-  numNodes = [0 for x in xrange(len(nodeNames))]
-  # list of lists for each cluster
-  dataSet = [{} for x in xrange(len(nodeNames))]
-  f = lambda c: [c[col] for col in col_heads]
-  # can change data to limit which nodes to plot, i.e. data[:55] will get first 55 nodes
-  for node in data:
-    try:
-      validate(node, nodeSchema)
-      row_wise = [col_heads[:]]
-      row_wise.extend([f(data_point) for data_point in node['entries']])
-      col_wise = zip(*row_wise)
-      plt.figure(figure_num)
-      newDate = [x * 86400 for x in col_wise[0][1:]]
-      values = []
-      if graphType == "latency":
-        entireRoundTrip = [a - b for a, b in zip(col_wise[5][1:], col_wise[2][1:])]
-        timeAtServer = [a - b for a, b in zip(col_wise[4][1:], col_wise[3][1:])]
-        # round trip time in milliseconds
-        values = [(a - b) * 1000.0 for a, b in zip(entireRoundTrip, timeAtServer)]
-      elif graphType == "freqOffset":
-        values = list(col_wise[2][1:])
-
-      times = [sum(x) for x in zip(newDate, col_wise[1][1:])]
-      # keep track of non-faulty values        
-      truetimes = []
-      truevalues = []
-      for time, value in itertools.izip(times,values):
-        if time < 0 or time > 4929100000.0:
-          # deleting incorrect or padded entry
-          continue
-        elif value > abs(threshold):
-          # deleting bad values
-          print "data spike: " + str(value) + " on node: " + node['node']
-        else:
-          truetimes.append(time)
-          truevalues.append(value)
-      times = truetimes
-      values = truevalues
-      # check which cluster this data belongs to, plot to respective graph
-      for nodeNum in range(len(nodeNames)):
-        if nodeNames[nodeNum] in node['node']:
-          plt.figure(nodeNum+1)
-          numNodes[nodeNum] += 1
-          dataSet[nodeNum][node['node']] = values
+  inputs = expandInputs(filePatterns)
+  if len(inputs) > 1 and not density and not statsOnly:
+    # the points of all inputs can't be kept for plotting them
+    print >>messages, "Drawing the scatterplots of %d inputs as density images" % len(inputs)
+    density = True
 
-      plt.scatter(times, values)
-    except ValidationError as e:
-      print "Error on node: " + str(node['node'])
+  if not statsOnly:
+    axes = plt.gca()
+  def scatter(figure, times, values):
+    plt.figure(figure)
+    plt.scatter(times, values)
+  tasks = [(name, graphType, col_heads, nodePatterns, since, until, density and not statsOnly, cacheDir, window)
+           for name in inputs]
+  try:
+    summary = summarizeInputs(tasks, jobs, messages, None if statsOnly else scatter)
+  except InputError as e:
+    print "Error: " + str(e)
+    sys.exit(1)
 
-  # label all plots
-  for i in range(len(nodeNames)):
-    # figures start from 1
-    plt.figure(i+1)
-    plt.xlabel('Time (s)')
-    plt.ylabel(graphLabel)
-    plt.title('Time vs %s Across %d %s Nodes' % (graphType, numNodes[i], nodeNames[i]))
-    # name of scatterplot graph is here
-    plt.savefig(graphType + "scatter" + str(i))
+  spikeReport = summary.spikeReport
+  # the default report is only written when there are spikes to report
+  if spikeFile is None and not statsOnly and len(spikeReport.runs) > 0:
+    spikeFile = graphType + "spikes.csv"
+  if len(spikeReport.runs) > 0:
+    print >>messages, "%d data spikes in %d runs" % (spikeReport.spikes(), len(spikeReport.runs)) + \
+      ("" if spikeFile is None else ", written to " + spikeFile)
+  if spikeFile is not None:
+    with open(spikeFile, 'wb') as out:
+      spikeReport.write(out)
 
-  overallValues = []
-  overallStdDevs = []
-  # make next three histogram plots based on data on each cluster
-  for i in range(len(nodeNames)):
-    # need to offset by the figures for previous scatterplots
-    plt.figure(i+1+len(nodeNames))
-    # skip if no data for given node type
-    if len(dataSet[i].items()) == 0:
-      continue
-    flattened = []
-    stdDevs = []
-    for (key, values) in dataSet[i].items():
-      # if we have a node with empty data, skip
-      if len(values) == 0:
-        continue
-      (muNode, sigmaNode) = norm.fit(values)
-      if math.isnan(sigmaNode):
-        print values
-      stdDevs.append(sigmaNode)
-      # uncomment to print stats of each node
-      #print "node: " + key + " has mean: " + str(muNode) + " and stdDev: " + str(sigmaNode)
-      flattened += values
-    overallValues += flattened
-
-    # best fit of data
-    (mu, sigma) = norm.fit(flattened)
-    median = np.median(flattened)
-    print nodeNames[i] + " average standard deviation: " + str(sum(stdDevs)/float(len(stdDevs)))
-    overallStdDevs += stdDevs
+  classStats = summary.classStats
+  overall = nodeStats.ClassStats(histogramRange)
+  for stats in classStats:
+    overall.merge(stats)
+  offsetStats = summary.offsetStats
+  if offsetStats is not None:
+    overallOffsets = nodeStats.OffsetStats(offsetHistogramRange)
+    for stats in offsetStats:
+      overallOffsets.merge(stats)
 
-    if histogramRange != None:
-      entries, bin_edges, patches = plt.hist(flattened, bins = 100, facecolor = 'green', range = histogramRange)
+  if statsOnly:
+    if offsetStats is None:
+      rows = [statsRow(nodeNames[i], classStats[i]) for i in range(len(nodeNames))]
+      rows.append(statsRow("all", overall))
     else:
-      entries, bin_edges, patches = plt.hist(flattened, bins = 100, facecolor = 'green')
-    axes = plt.gca()
-    plt.xlabel(graphLabel)
-    plt.ylabel('Packet Count')
-    plt.title("Histogram of %s across %d %s nodes" % (graphLabel, numNodes[i], nodeNames[i]))
-    print "Histogram of %s for %s nodes: mu=%.3f, sigma=%.3f, median=%.3f" %(graphType, nodeNames[i], mu, sigma, median)
-    # name of histogram graph is here
-    plt.savefig(graphType + "histogram" + str(i))
+      rows = [statsRow(nodeNames[i], classStats[i], offsetStats[i]) for i in range(len(nodeNames))]
+      rows.append(statsRow("all", overall, overallOffsets))
+    statsInput = inputs[0] if len(inputs) == 1 else inputs
+    if statsFile != "":
+      with open(statsFile, 'w') as out:
+        writeStats(out, statsFormat, statsInput, graphType, rows)
+    else:
+      writeStats(sys.stdout, statsFormat, statsInput, graphType, rows)
+    return
 
-  print "Overall Standard Dev across " + str(len(overallStdDevs)) + " nodes is " + str(sum(overallStdDevs)/float(len(overallStdDevs)))
-  plt.figure((len(nodeNames)*2)+1)
-  plt.xlabel(graphLabel)
-  plt.ylabel('Packet Count')
-  if histogramRange != None:
-    entries, bin_edges, patches = plt.hist(overallValues, bins = 100, facecolor = 'green', range = histogramRange)
-  else:
-    entries, bin_edges, patches = plt.hist(flattened, bins = 100, facecolor = 'green')
-  totalNumNodes = sum(numNodes)
-  (mu, sigma) = norm.fit(overallValues)
-  median = np.median(overallValues)
-  plt.title("Histogram of %s across %d nodes" % (graphLabel, totalNumNodes))
-  print "Histogram of %s across %d nodes: mu=%.3f, sigma=%.3f, median=%.3f" %(graphType, totalNumNodes, mu, sigma, median)
-  plt.savefig(graphType + "histogramtotal")
+  plotClasses(plt, 1, graphType, graphLabel, classStats, overall, summary.densityGrids)
+  if offsetStats is not None:
+    plotClasses(plt, offsetFigure(1), "offset", "Offset (ms)", [stats.offsets for stats in offsetStats],
+                overallOffsets.offsets, summary.offsetGrids)
+    for i in range(len(nodeNames)):
+      if offsetStats[i].jitters():
+        print "%s average jitter: %.3f ms, offset/delay correlation: %.3f" % (nodeNames[i],
+          offsetStats[i].jitter(), offsetStats[i].correlation())
+    if overallOffsets.jitters():
+      print "Average jitter across %d nodes: %.3f ms, offset/delay correlation: %.3f" % (
+        len(overallOffsets.jitters()), overallOffsets.jitter(), overallOffsets.correlation())
 
   plt.show()
-  json_data.close()
 
 if __name__ =='__main__':
     main(sys.argv[1:])
\ No newline at end of file
@@ -1,10 +1,35 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import getopt
 import ipaddress
 import subprocess
 import datetime
 import math
+import shutil
+import tempfile
+import hashlib
+import io
+import re
+import itertools
+import concurrent.futures
+
+usage = "usage: cephntp.py [-a] [-r] [-j jobs]"
+
+# Number of simulations multiRunConfig runs at the same time. None runs one
+# per CPU.
+sweepJobs = None
+
+# Directory multiRunConfig keeps the result of every simulation in, under a
+# hash of what the simulation was run with, so that a sweep that is run again,
+# or one that overlaps with an earlier one, doesn't simulate the same thing
+# twice. None simulates everything.
+sweepCache = "./tmp/cache"
+# Changes whenever what makes up a cached result does
+cacheVersion = 1
+# File of a cached result with the output of its script
+outputFile = "output.txt"
 
 
 # generalConfig creates a configuration file for a clknetsim run and runs the
@@ -88,12 +113,157 @@ def realLatencyConfig(nodecount, freqexpr, latencyValuesDir = "../latencydata"):
     subprocess.check_call("./{}".format(scriptname), 
         shell=True)
 
-# multiRunConfig varies different parameters and runs a simulation for each
-# configuration. The parameters that are varied are the standard deviation in
-# the clock drift, and two parameters in the gamma distribution modeling 
-# packet latency (the mean and the alpha parameter).
-def multiRunConfig():
+# sweepConf creates the text of the configuration file for one simulation of
+# multiRunConfig, with the given standard deviation in the clock drift and
+# the given alpha and mean of the gamma distribution of packet latency.
+def sweepConf(nodecount, driftStdDev, alpha, mean):
     """ Generate client configs """
+    # Here, we use the driftStdDev when setting the frequency of
+    # the node.
+    freqexpr = "(sum (* {} (normal)))".format(driftStdDev)
+
+    # The text of the configuration file.
+    conf = ""
+
+    # We need the theta value to generate our gamma distribution.
+    theta = mean/alpha
+    for i in range(2, nodecount + 1):
+        conf += "node{}_offset = {}\n".format(i, i - 1)
+
+        conf += "node{}_freq = {}\n".format(i, freqexpr)
+
+        conf += "node{}_delay1 = (gamma {} {})\n".format(i, alpha, theta)
+        conf += "node1_delay{} = (gamma {} {})\n".format(i, alpha, theta)
+
+    # Set the reference clock (the really good clock) for the NTP server
+    conf += "node1_refclock = (* 0 0)\n" # A perfect clock is (* 0 0)
+    return conf
+
+# binaryDigest is a hash of the clknetsim server and the library the clients
+# run with, whose results can change with them.
+def binaryDigest(clknetsimPath):
+    digest = hashlib.sha1()
+    for name in ["clknetsim", "clknetsim.so"]:
+        path = os.path.join(clknetsimPath, name)
+        digest.update(name.encode())
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+# resultKey is the key of the cached result of a simulation: a hash of its
+# config file, its script (how the clients are configured and started, and
+# timeLimit), without the paths that change from one run to the next, and
+# clknetsim itself (see binaryDigest).
+def resultKey(nodecount, conf, binary):
+    script = scriptText(nodecount, "OUTPUT/", "CLKNETSIM")
+    return hashlib.sha1("\0".join([str(cacheVersion), conf, script, binary]).encode()).hexdigest()
+
+# linkResult puts the log files of a result into directoryPath, which is
+# created if needed, as hard links, or as copies where that can't be done.
+# Files that are there already are left alone.
+def linkResult(resultPath, directoryPath):
+    if (not os.path.isdir(directoryPath)):
+        os.mkdir(directoryPath)
+    for name in os.listdir(resultPath):
+        target = os.path.join(directoryPath, name)
+        if name == outputFile or os.path.exists(target):
+            continue
+        try:
+            os.link(os.path.join(resultPath, name), target)
+        except OSError:
+            shutil.copy2(os.path.join(resultPath, name), target)
+
+# runIsolated runs one simulation in a working directory of its own, so that
+# several can run at the same time. clknetsim.bash keeps its config, socket,
+# stats and client logs in ./tmp, so each simulation gets a fresh directory
+# with a tmp directory in it, holding its config and its script, which is
+# removed once it is done. The log files are written there too, and only go
+# to directoryPath once the simulation is complete, so a simulation that
+# fails leaves no directoryPath behind. With a cache, a simulation whose key
+# (see resultKey) is in it isn't run, its result is linked to directoryPath,
+# and a simulation that is run goes into the cache. Returns the output of the
+# script and whether it came from the cache.
+def runIsolated(nodecount, conf, directoryPath, clknetsimPath, cachePath = None, key = None):
+    if cachePath is not None:
+        resultPath = os.path.join(cachePath, key)
+        if os.path.isdir(resultPath):
+            linkResult(resultPath, directoryPath)
+            with open(os.path.join(resultPath, outputFile)) as f:
+                return f.read(), True
+
+    workPath = os.path.abspath(tempfile.mkdtemp(prefix="cephntp.", dir="./tmp"))
+    try:
+        os.mkdir(os.path.join(workPath, "tmp"))
+        with open(os.path.join(workPath, "tmp", "conf"), 'w') as confFile:
+            confFile.write(conf)
+
+        # a result only goes into the cache or directoryPath whole, so one
+        # that was cut short is simulated again
+        outputPath = os.path.join(workPath, "result")
+        os.mkdir(outputPath)
+
+        scriptname = os.path.join(workPath, "cephntp.dynamic.test")
+        createScript(nodecount, scriptname, os.path.abspath(outputPath) + "/", clknetsimPath)
+
+        # The simulation runs in the working directory, so everything it
+        # refers to is given with an absolute path
+        result = subprocess.run(scriptname, cwd=workPath, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, scriptname, result.stdout)
+        output = result.stdout.decode()
+
+        if cachePath is None:
+            resultPath = outputPath
+        else:
+            with open(os.path.join(outputPath, outputFile), 'w') as f:
+                f.write(output)
+            try:
+                os.rename(outputPath, resultPath)
+            except OSError:
+                # Unless an overlapping sweep cached it first, the cache can't
+                # take it (another device, permissions), and the result is
+                # copied to directoryPath without being cached
+                if not os.path.isdir(resultPath):
+                    resultPath = outputPath
+        linkResult(resultPath, directoryPath)
+        return output, False
+    finally:
+        shutil.rmtree(workPath)
+
+# sweepDirectory is the name of the directory under ./tmp a sweep writes its
+# output to. The current date and time is used to create a unique directory
+# for the output. This way, the user can run the simulations multiple times
+# without worrying that previous output has been overwritten. With resume, it
+# is the directory of the latest sweep instead.
+def sweepDirectory(resume):
+    time = str(datetime.datetime.now()).replace(" ", "_")
+
+    # We create the directories if it hasn't already been made.
+    if (not os.path.isdir("./tmp")):
+        os.mkdir("./tmp")
+    sweeps = sorted(name for name in os.listdir("./tmp") if re.match(r"\d{4}-\d\d-\d\d_", name))
+    if resume and sweeps:
+        time = sweeps[-1]
+        print("Resuming sweep {}".format(time))
+    else:
+        os.mkdir("./tmp/{}".format(time))
+    return time
+
+# pointPath is the output directory of the simulation of a point of a sweep,
+# named with its parameters as examples/3dPlot.py expects.
+def pointPath(time, driftStdDev, alpha, mean):
+    return "./tmp/{}/{:.2e}_{:.2e}_{:.2e}/".format(time, driftStdDev, alpha, mean)
+
+# runPoints runs a simulation for each (driftStdDev, alpha, mean) in points,
+# writing to the point's directory of the sweep in time. The simulations run
+# in a pool of jobs processes (sweepJobs by default), each in a working
+# directory of its own (see runIsolated). A simulation that fails is
+# reported and the others go on, and its point gets no directory, so that
+# examples/3dPlot.py only reads complete ones. Simulations that are in
+# sweepCache are not run again. Returns the points whose simulation failed.
+def runPoints(time, points, jobs = None):
     # The number of nodes in our simulation. We only run this with two nodes (a
     # server and a client) because a) a node's behavior isn't dependent on the 
     # other nodes in the cluster and, therefore, we don't need other nodes to
@@ -101,74 +271,197 @@ def multiRunConfig():
     # takes long enough as is.
     nodecount = 2
 
-    # The current date and time is used to create a unique directory for the
-    # output. This way, the user can run the simulations multiple times without
-    # worrying that previous output has been overwritten.
-    time = str(datetime.datetime.now()).replace(" ", "_")
-
-    # We create the directories if it hasn't already been made.
-    if (not os.path.isdir("./tmp")):
-        os.mkdir("./tmp")
-    os.mkdir("./tmp/{}".format(time))
+    cachePath = None
+    if sweepCache is not None:
+        cachePath = os.path.abspath(sweepCache)
+        if (not os.path.isdir(cachePath)):
+            os.mkdir(cachePath)
+
+    # The scripts run in their own working directories, so clknetsim is
+    # found from here
+    clknetsimPath = os.path.abspath("..")
+    binary = binaryDigest(clknetsimPath)
+
+    if jobs is None:
+        jobs = sweepJobs if sweepJobs is not None else os.cpu_count()
+    failed = set()
+    cached = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {}
+        for point in points:
+            conf = sweepConf(nodecount, *point)
+            future = executor.submit(runIsolated, nodecount, conf, pointPath(time, *point), clknetsimPath,
+                                     cachePath, resultKey(nodecount, conf, binary))
+            futures[future] = point
+
+        # Progress Output, as each test finishes
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            driftStdDev, alpha, mean = futures[future]
+            print("Finished Test:")
+            print("\tDrift Std Deviation: {:.2e}".format(driftStdDev))
+            print("\tAlpha: {:.2e}".format(alpha))
+            print("\tMean: {:.2e}".format(mean))
+            print("\tPercent Completion: {:.1f}%".format(100.0 * done / len(points)))
+            try:
+                output, fromCache = future.result()
+                if fromCache:
+                    cached += 1
+                    print("\tFrom the cache")
+                print(output)
+            except subprocess.CalledProcessError as e:
+                failed.add(futures[future])
+                print("\tFailed with exit status {}:".format(e.returncode))
+                print(e.output.decode())
+    if cached:
+        print("{} of {} tests were in the cache".format(cached, len(points)))
+    if failed:
+        print("{} of {} tests failed".format(len(failed), len(points)))
+    return failed
+
+# sweepParameters fills in the values multiRunConfig and adaptiveRunConfig
+# vary that aren't given.
+def sweepParameters(driftStdDevs, alphas, latencyMeanTimes):
+    # Clock drift standard deviations and latency alpha values
+    if driftStdDevs is None:
+        driftStdDevs = [1e-8*float(x) for x in range(1,11)]
+    if alphas is None:
+        alphas = [float(x) for x in range(1,11)]
 
     # This is the latency mean times we are generating for our simulations. 
     # We generate them on a log scale, since lower mean values are more typical
     # for a cluster and, therefore, we'd like more definition in that area. 
     # Currently, we generate values from 0.01ms to 10ms
-    latencyMeanTimes = [10**((float(x)/10.0) - 5) for x in range(31)]
-
-    # Clock Drift Std Deviation Loop
-    for driftStdDev in [1e-8*float(x) for x in range(1,11)]:
-        # Latency Alpha Value Loop
-        for alpha in [float(x) for x in range(1,11)]:
-            # Mean Latency Value Loop
-            for mean in latencyMeanTimes:
-
-                # Progress Output
-                print("Running Test:")
-                print("\tDrift Std Deviation: {:.2e}".format(driftStdDev))
-                print("\tAlpha: {:.2e}".format(alpha))
-                print("\tMean: {:.2e}".format(mean))
-                percentCompletion = (((driftStdDev *1e8) - 1) * 10) + (alpha - 1)
-                print("\tPercent Completion: {:.2}%".format(percentCompletion))
-
-                # We create a directory path for the output from each simulation
-                # run.
-                directoryPath = "./tmp/{}/{:.2e}_{:.2e}_{:.2e}/".format(time, driftStdDev, alpha, mean)
-                if (not os.path.isdir(directoryPath)):
-                    os.mkdir(directoryPath)
+    if latencyMeanTimes is None:
+        latencyMeanTimes = [10**((float(x)/10.0) - 5) for x in range(31)]
+    return driftStdDevs, alphas, latencyMeanTimes
 
-                # Here, we use the driftStdDev when setting the frequency of
-                # the node.
-                freqexpr = "(sum (* {} (normal)))".format(driftStdDev)
-
-                # The text of the configuration file.
-                conf = ""
-
-                # We need the theta value to generate our gamma distribution.
-                theta = mean/alpha
-                for i in range(2, nodecount + 1):
-                    conf += "node{}_offset = {}\n".format(i, i - 1)
-
-                    conf += "node{}_freq = {}\n".format(i, freqexpr)
-
-                    conf += "node{}_delay1 = (gamma {} {})\n".format(i, alpha, theta)
-                    conf += "node1_delay{} = (gamma {} {})\n".format(i, alpha, theta)
-
-                # Set the reference clock (the really good clock) for the NTP server
-                conf += "node1_refclock = (* 0 0)\n" # A perfect clock is (* 0 0)
-
-                # Open and write the config file
-                confFile = open("./tmp/conf", 'w')
-                confFile.write(conf)
-                confFile.close()
-
-                scriptname = "cephntp.dynamic.test"
-                createScript(nodecount, scriptname, directoryPath)
-
-                # Start everything running
-                subprocess.check_call("./{}".format(scriptname), 
-                    shell=True)
+# multiRunConfig varies different parameters and runs a simulation for each
+# configuration. The parameters that are varied are the standard deviation in
+# the clock drift, and two parameters in the gamma distribution modeling 
+# packet latency (the mean and the alpha parameter). The simulations are run
+# by runPoints. With resume, the output goes to the directory of the latest
+# sweep rather than a new one, so a sweep that was interrupted carries on
+# where it stopped, only running what isn't in the cache yet.
+def multiRunConfig(driftStdDevs = None, alphas = None, latencyMeanTimes = None, jobs = None, resume = False):
+    """ Generate client configs """
+    time = sweepDirectory(resume)
+    driftStdDevs, alphas, latencyMeanTimes = sweepParameters(driftStdDevs, alphas, latencyMeanTimes)
+    points = [(driftStdDev, alpha, mean) for driftStdDev in driftStdDevs
+              for alpha in alphas for mean in latencyMeanTimes]
+    runPoints(time, points, jobs)
+
+# Rows at the beginning of the log files that are thrown out, while NTP is
+# still synchronizing the nodes, as examples/3dPlot.py does
+firstRowsOfJunk = 1500
+
+# logColumn reads the client's column (the second) of a clknetsim log file,
+# without the first firstRowsOfJunk rows.
+def logColumn(fileName):
+    with open(fileName) as f:
+        return [float(line.split()[1]) for line in itertools.islice(f, firstRowsOfJunk, None) if line.strip()]
+
+# safetyBuffer is the mean and the min of the safety buffer, in ms, of the
+# output in directoryPath, computed as examples/3dPlot.py does: the error
+# NTP reports less how far its offset is from the real one. It is None when
+# the output can't be read.
+def safetyBuffer(directoryPath):
+    try:
+        errors = logColumn(os.path.join(directoryPath, "log.ntp_maxerror"))
+        ntpOffsets = logColumn(os.path.join(directoryPath, "log.ntp_offset"))
+        realOffsets = logColumn(os.path.join(directoryPath, "log.timeoffset"))
+    except (OSError, ValueError, IndexError):
+        return None
+    buffers = [error / 1000.0 - abs(abs(ntp) * 1000 - abs(real) * 1000)
+               for error, ntp, real in zip(errors, ntpOffsets, realOffsets)]
+    if not buffers:
+        return None
+    return sum(buffers) / len(buffers), min(buffers)
+
+# gridTicks are the indices along an axis of n values that are simulated with
+# a stride of step: every step-th one and the last.
+def gridTicks(n, step):
+    return sorted(set(range(0, n, step)) | {n - 1})
+
+# gridSpans are the (low, high) spans between neighbouring ticks of an axis,
+# or the one tick of an axis that has a single value.
+def gridSpans(ticks):
+    return list(zip(ticks, ticks[1:])) or [(ticks[0], ticks[0])]
+
+# needsRefining tells whether a cell of the grid, with the safety buffers of
+# its corners, is worth simulating more finely: a corner failed, the min
+# safety buffer goes near or below zero within it (the cell holds part of
+# the safe operating boundary), or the mean safety buffer changes by more
+# than sharpSpread across it. Cells that are well clear of zero on either
+# side, and flat, are left alone.
+def needsRefining(buffers, nearZero, sharpSpread):
+    if None in buffers:
+        return True
+    means = [mean for mean, least in buffers]
+    mins = [least for mean, least in buffers]
+    if min(mins) <= nearZero and max(mins) >= -nearZero:
+        return True
+    return max(means) - min(means) > sharpSpread
+
+# adaptiveRunConfig simulates the same grid as multiRunConfig, but coarse to
+# fine rather than all of it. It first simulates every coarseStep-th value
+# along each axis (and the last), then halves the step in the cells that
+# needsRefining picks, until the step is one. Cells are refined near the
+# boundary, where the min safety buffer is within nearZero (ms) of zero, and
+# where the mean safety buffer changes by more than sharpChange of how much
+# it changes over the whole coarse grid. The output goes to the same
+# per-point directories, so examples/3dPlot.py plots whatever was simulated,
+# with the finest detail around the safe operating boundary. coarseStep must
+# be a power of two.
+def adaptiveRunConfig(driftStdDevs = None, alphas = None, latencyMeanTimes = None, jobs = None, resume = False,
+                      coarseStep = 8, nearZero = 0.1, sharpChange = 0.25):
+    """ Generate client configs """
+    # halving any other step skips grid points
+    if coarseStep < 1 or coarseStep & (coarseStep - 1) != 0:
+        raise ValueError("coarseStep must be a power of two, not {}".format(coarseStep))
+    time = sweepDirectory(resume)
+    axes = sweepParameters(driftStdDevs, alphas, latencyMeanTimes)
+    sizes = [len(values) for values in axes]
+
+    def point(index):
+        return tuple(values[i] for values, i in zip(axes, index))
+
+    # The cells to look at once the points at step have been simulated
+    step = coarseStep
+    cells = list(itertools.product(*[gridSpans(gridTicks(n, step)) for n in sizes]))
+    pending = set(itertools.product(*[gridTicks(n, step) for n in sizes]))
+    simulated = set()
+    buffers = {}
+    while True:
+        if pending:
+            print("Simulating {} points with a step of {}".format(len(pending), step))
+            points = sorted(pending)
+            failed = runPoints(time, [point(index) for index in points], jobs)
+            for index in points:
+                buffers[index] = None if point(index) in failed else safetyBuffer(pointPath(time, *point(index)))
+            simulated |= pending
+        if step == 1 or not cells:
+            break
+        if step == coarseStep:
+            means = [buffer[0] for buffer in buffers.values() if buffer is not None]
+            sharpSpread = sharpChange * (max(means) - min(means)) if means else 0.0
+
+        # Each cell that is refined is split into the cells of the next step,
+        # whose corners are simulated next
+        step //= 2
+        refined = []
+        pending = set()
+        for cell in cells:
+            corners = set(itertools.product(*cell))
+            if not needsRefining([buffers[corner] for corner in corners], nearZero, sharpSpread):
+                continue
+            ticks = [[i for i in gridTicks(n, step) if low <= i <= high] for n, (low, high) in zip(sizes, cell)]
+            pending |= set(itertools.product(*ticks)) - simulated
+            refined += itertools.product(*[gridSpans(axis) for axis in ticks])
+        cells = refined
+
+    total = sizes[0] * sizes[1] * sizes[2]
+    print("Simulated {} of the {} points of the grid ({:.1f}%)".format(len(simulated), total,
+                                                                      100.0 * len(simulated) / total))
 
 
 
@@ -202,30 +495,43 @@ def configPerfectClocks(nodecount):
 
 
 # (FIXME: You wrote this; could you comment it?)
-def createScript(nodecount, scriptname, directoryPath = "./tmp/"):
+def createScript(nodecount, scriptname, directoryPath = "./tmp/", clknetsimPath = ".."):
     """
     Put together other parts of the scripts and kick things off.
 
     nodecount:      How many nodes in the simulation
     scriptname:     What to call the script
-    directoryPath:  Where to put the script
+    directoryPath:  Where to put the output files
+    clknetsimPath:  Where clknetsim and clknetsim.bash are
     """
+    print(directoryPath + "log.packetdelays")
+
+    # Open the script file for writing
+    script = open(os.path.join(".", scriptname), 'w')
+    script.write(scriptText(nodecount, directoryPath, clknetsimPath))
+    script.close()
+
+    # Make sure all of the permissions are set up appropriately
+    subprocess.check_call(["chmod", "+x", os.path.join(".", scriptname)])
 
+
+# scriptText is the text of the script createScript writes. It has everything
+# about a simulation that is not in the config file: how the clients are
+# started and how long the simulation runs.
+def scriptText(nodecount, directoryPath, clknetsimPath):
     # Where to stick output files
     timeOffsetFilePath = directoryPath + "log.timeoffset" 
     ntpOffsetFilePath = directoryPath + "log.ntp_maxerror"
     ntpMaxErrorFilePath = directoryPath + "log.ntp_offset"
     packetDelaysFilePath = directoryPath + "log.packetdelays"
-    print(packetDelaysFilePath)
 
-    # Open the script file for writing
-    script = open("./{}".format(scriptname), 'w')
+    script = io.StringIO()
 
     # Fill out some header stuff
     script.write("#!/bin/bash\n\n")
 
-    script.write("CLKNETSIM_PATH=..\n")
-    script.write(". ../clknetsim.bash\n")
+    script.write("CLKNETSIM_PATH={}\n".format(clknetsimPath))
+    script.write(". {}/clknetsim.bash\n".format(clknetsimPath))
 
 
     """ 
@@ -267,16 +573,32 @@ def createScript(nodecount, scriptname, directoryPath = "./tmp/"):
     script.write("get_stat 'RMS offset'\n")
     script.write("get_stat 'RMS frequency'\n")
 
-    script.close()
-
-    # Make sure all of the permissions are set up appropriately
-    subprocess.check_call("chmod +x ./{}".format(scriptname), 
-        shell=True)
-
-
-
-
-def main():
+    return script.getvalue()
+
+
+
+
+# With -a the sweep is adaptiveRunConfig rather than multiRunConfig, with -r
+# it resumes the latest sweep, and -j sets how many simulations run at once.
+def main(argv):
+    adaptive = False
+    resume = False
+    jobs = None
+    try:
+        opts, args = getopt.getopt(argv, "harj:", ["help", "adaptive", "resume", "jobs="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-a", "--adaptive"):
+            adaptive = True
+        elif opt in ("-r", "--resume"):
+            resume = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
 
     if (not os.path.isdir("./tmp")):
         os.mkdir("./tmp")
@@ -299,8 +621,11 @@ def main():
 
 
     # configPerfectClocks(10)
-    multiRunConfig()
+    if adaptive:
+        adaptiveRunConfig(jobs = jobs, resume = resume)
+    else:
+        multiRunConfig(jobs = jobs, resume = resume)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -3,10 +3,21 @@
 FILE_PATH=$1
 SERVER_NAME=$2
 OUT_FOLDER=$3
+# optional file with the paths, relative to FILE_PATH, of the files to copy, one per line
+FILE_LIST=$4
 
 if [ ! -d "$OUT_FOLDER" ]; then
     mkdir "$OUT_FOLDER"
 fi
 
-# Exits with status of this rsync, so missing file errors
-rsync -caz --exclude '*gz' -e "ssh -oBatchMode=yes" "$SERVER_NAME:$FILE_PATH" "$OUT_FOLDER"
+# ssh for rsync, copyntpstats.py sets it to go through a master connection per host
+SSH_COMMAND=${NTPSTATS_SSH:-"ssh -oBatchMode=yes"}
+
+# Exits with status of this rsync, so missing file errors. copyntpstats.py
+# reads the bytes it received from its --stats
+if [ -n "$FILE_LIST" ]; then
+    # copyntpstats.py listed what changed by size and mtime, so no checksums
+    rsync -az --stats --files-from="$FILE_LIST" -e "$SSH_COMMAND" "$SERVER_NAME:$FILE_PATH/" "$OUT_FOLDER/$(basename "$FILE_PATH")"
+else
+    rsync -caz --stats --exclude '*gz' -e "$SSH_COMMAND" "$SERVER_NAME:$FILE_PATH" "$OUT_FOLDER"
+fi
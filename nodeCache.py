@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of what diagnostics.py computes for each node, so that runs
+with other plot settings, or on dumps that mostly hold the same nodes, only
+compute the nodes that changed.
+
+For each node the cache keeps the times and values that are plotted, the
+runs of spikes that were left out, the moments of the values and, for
+timestamps, the clock offsets, or that the node failed validation. A node is
+looked up by the SHA-1 of its raw data (its JSON text, or its columns in a
+store) together with the settings that change these results: the graph
+type, threshold, time window and spike detection. Settings that only change
+the plots, such as histogramRange and nodeNames, are not part of the key.
+
+Each node is an .npz file under the cache directory, written to a temporary
+file and renamed into place, so several processes can share a cache. An
+entry that can't be read is treated as missing and written again.
+"""
+import os, hashlib, tempfile, zipfile
+import numpy as np
+
+import nodeStats
+
+cacheVersion = 3
+
+class NodeResult(object):
+    """
+    What is kept of a node: plotted times and values, spike runs as
+    nodeSpikes.spikeRuns gives them, moments of the values and the clock
+    offsets of the entries, if there are any
+    """
+
+    def __init__(self, valid, times=None, values=None, runs=None, moments=None, offsets=None):
+        self.valid = valid
+        empty = np.zeros(0, dtype=np.float64)
+        self.times = empty if times is None else times
+        self.values = empty if values is None else values
+        self.runs = np.zeros((0, 4)) if runs is None else runs
+        self.moments = nodeStats.Moments() if moments is None else moments
+        self.offsets = offsets
+
+class NodeCache(object):
+    """ NodeResults of the nodes read with one set of settings """
+
+    def __init__(self, directory, settings):
+        """ settings is a tuple of the settings the results depend on """
+        self.directory = directory
+        self.settings = repr((cacheVersion,) + tuple(settings)).encode("utf-8")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, raw):
+        return hashlib.sha1(self.settings + raw).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def get(self, key):
+        """
+        The NodeResult stored under key, or None. An entry that can't be read,
+        such as one cut short, is a miss, and put overwrites it.
+        """
+        try:
+            with np.load(self.path(key)) as data:
+                count, mean, m2 = data["moments"].tolist()
+                moments = nodeStats.Moments()
+                moments.count, moments.mean, moments.m2 = int(count), mean, m2
+                offsets = data["offsets"] if "offsets" in data.files else None
+                result = NodeResult(bool(data["valid"]), data["times"], data["values"],
+                                    data["runs"], moments, offsets)
+        except (IOError, OSError, KeyError, ValueError, EOFError, zipfile.BadZipfile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        name = self.path(key)
+        directory = os.path.dirname(name)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError:
+            # made by another process in the meantime
+            if not os.path.isdir(directory):
+                raise
+        fd, tmpName = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        moments = result.moments
+        moments = np.array([moments.count, moments.mean, moments.m2], dtype=np.float64)
+        arrays = {"valid": result.valid, "times": result.times, "values": result.values,
+                  "runs": result.runs, "moments": moments}
+        if result.offsets is not None:
+            arrays["offsets"] = result.offsets
+        with os.fdopen(fd, 'wb') as out:
+            np.savez(out, **arrays)
+        os.rename(tmpName, name)
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Sidecar index of a cluster data dump, so that diagnostics.py can read only
+some of the nodes, or only some time window, without decoding the whole
+file.
+
+The index of file.json is kept in file.json.idx, a JSON object with the size
+and modification time of the file it was built from, and for every node its
+name, the byte range [start, stop) of its object in the file and its number
+of entries. The entries of a node are split into blocks of blockEntries
+entries, and for each block the index has its byte range and the smallest
+and largest time of its entries (date * 86400 + time, in seconds since the
+MJD epoch). A block is [start, stop, minTime, maxTime], stop being the start
+of the next block, with null times if none of its entries has a numeric date
+and time. Nodes whose entries can't be located have no blocks and are always
+read whole.
+
+A window of a node is only the entries in some blocks, so whether the node
+is valid can't be told from it. The first time nodes are read windowed with
+a schema, checkNodes reads each of them whole and keeps whether it is valid
+in its "valid" object, under the key of the schema. Nodes that are not are
+then read whole, to be rejected as they are without a window.
+
+Compressed files can't be seeked into and are not indexed.
+"""
+import os, re, json, hashlib, datetime
+import numpy as np
+
+import nodeStream
+
+indexSuffix = ".idx"
+indexVersion = 1
+blockEntries = 2048
+
+# start of the entries array of a node object
+_entriesKey = re.compile(r'"entries"\s*:\s*\[')
+_mjdEpoch = datetime.datetime(1858, 11, 17)
+
+def indexName(fileName):
+    return fileName + indexSuffix
+
+def _fileState(fileName):
+    stat = os.stat(fileName)
+    return stat.st_size, stat.st_mtime
+
+def entryTimes(entries):
+    """ Time in seconds of every entry, NaN where it has no numeric date and time """
+    times = np.empty(len(entries), dtype=np.float64)
+    for i, entry in enumerate(entries):
+        try:
+            times[i] = float(entry["date"]) * 86400 + float(entry["time"])
+        except (KeyError, TypeError, ValueError, OverflowError):
+            times[i] = np.nan
+    return times
+
+def _walkEntries(text, pos, count, decoder):
+    """ Start offsets of count entries of the array starting at pos, by decoding them """
+    starts = []
+    for i in range(count):
+        pos = nodeStream._whitespace.match(text, pos).end()
+        if text[pos:pos + 1] == ",":
+            pos = nodeStream._whitespace.match(text, pos + 1).end()
+        starts.append(pos)
+        pos = decoder.raw_decode(text, pos)[1]
+    return starts
+
+def entryOffsets(text, entries, decoder):
+    """
+    Start offsets in text, the JSON of a node, of each of its entries and the
+    end offset of the last one, or None if the entries array can't be found
+    """
+    match = _entriesKey.search(text)
+    if match is None:
+        return None
+    begin = match.end()
+    if len(entries) == 0:
+        return [], begin
+    try:
+        # entries that are objects without braces inside are found by their
+        # opening braces, the others by decoding them one by one
+        if all(type(entry) is dict for entry in entries) and text.count("{", begin) == len(entries):
+            data = np.frombuffer(text, dtype=np.uint8, offset=begin)
+            starts = (np.flatnonzero(data == ord("{")) + begin).tolist()
+        else:
+            starts = _walkEntries(text, begin, len(entries), decoder)
+        return starts, decoder.raw_decode(text, starts[-1])[1]
+    except ValueError:
+        return None
+
+def buildIndex(fileName, decoder=None):
+    """ Builds the index of the JSON dump fileName """
+    if decoder is None:
+        decoder = json.JSONDecoder()
+    size, mtime = _fileState(fileName)
+    nodes = []
+    # nodeStream reads ahead in f, the text of the nodes is read from raw
+    with open(fileName, 'rb') as f, open(fileName, 'rb') as raw:
+        for start, stop, node in nodeStream.iterNodes(f, decoder):
+            entries = node.get("entries") if isinstance(node, dict) else None
+            item = {"node": node.get("node") if isinstance(node, dict) else None,
+                    "start": start, "stop": stop,
+                    "entries": len(entries) if isinstance(entries, list) else 0, "blocks": None}
+            nodes.append(item)
+            if not isinstance(entries, list):
+                continue
+            raw.seek(start)
+            text = raw.read(stop - start)
+            offsets = entryOffsets(text, entries, decoder)
+            if offsets is None:
+                continue
+            starts, end = offsets
+            times = entryTimes(entries)
+            blocks = []
+            for first in range(0, len(entries), blockEntries):
+                last = min(first + blockEntries, len(entries)) - 1
+                blockTimes = times[first:last + 1]
+                blockTimes = blockTimes[~np.isnan(blockTimes)]
+                if len(blockTimes):
+                    minTime, maxTime = float(blockTimes.min()), float(blockTimes.max())
+                else:
+                    minTime = maxTime = None
+                stopOffset = starts[last + 1] if last + 1 < len(entries) else end
+                blocks.append([start + starts[first], start + stopOffset, minTime, maxTime])
+            item["blocks"] = blocks
+    return {"version": indexVersion, "size": size, "mtime": mtime,
+            "blockEntries": blockEntries, "nodes": nodes}
+
+def saveIndex(fileName, index):
+    """ Writes the index next to fileName, returns False if that is not possible """
+    name = indexName(fileName)
+    try:
+        with open(name + ".tmp", 'w') as out:
+            json.dump(index, out)
+        os.rename(name + ".tmp", name)
+    except (IOError, OSError):
+        return False
+    return True
+
+def loadIndex(fileName):
+    """ The index of fileName, or None if there is none or it is out of date """
+    name = indexName(fileName)
+    if not os.path.isfile(name):
+        return None
+    try:
+        with open(name, 'r') as f:
+            index = json.load(f)
+    except ValueError:
+        return None
+    size, mtime = _fileState(fileName)
+    if index.get("version") != indexVersion or index.get("size") != size or index.get("mtime") != mtime:
+        return None
+    return index
+
+def openIndex(fileName, decoder=None):
+    """
+    The index of fileName, built and saved if it is missing or out of date.
+    Returns the index and whether it had to be built.
+    """
+    index = loadIndex(fileName)
+    if index is not None:
+        return index, False
+    index = buildIndex(fileName, decoder)
+    saveIndex(fileName, index)
+    return index, True
+
+def schemaKey(schema):
+    """ Key of the validity of the nodes against schema in the index """
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def checkNodes(fileName, index, key, isValid, selectNode=None, decoder=None):
+    """
+    Keeps in index whether each node selectNode(name) is true for is valid,
+    isValid(node) being whether the decoded node is valid against the schema
+    of key, for the nodes for which it isn't known yet. Returns whether the
+    index changed.
+    """
+    if decoder is None:
+        decoder = json.JSONDecoder()
+    changed = False
+    with open(fileName, 'rb') as f:
+        for item in index["nodes"]:
+            if selectNode is not None and not selectNode(item["node"]):
+                continue
+            valid = item.setdefault("valid", {})
+            if key in valid:
+                continue
+            f.seek(item["start"])
+            valid[key] = bool(isValid(decoder.decode(f.read(item["stop"] - item["start"]))))
+            changed = True
+    return changed
+
+def overlaps(minTime, maxTime, since, until):
+    if minTime is None:
+        return False
+    return (since is None or maxTime >= since) and (until is None or minTime <= until)
+
+def readNodeTexts(fileName, index, selectNode=None, since=None, until=None, key=None):
+    """
+    Yields the name and the JSON text of the nodes of fileName that
+    selectNode(name) is true for (all if it is None). With since or until,
+    the text is that of an object with the name of the node and only the
+    blocks of its entries that have times in [since, until], so entries
+    outside of the window can still be among them, and nodes without such
+    blocks are left out. With the key of a schema the nodes were checked
+    against (see checkNodes), the nodes that are not valid are read whole.
+    """
+    with open(fileName, 'rb') as f:
+        for item in index["nodes"]:
+            if selectNode is not None and not selectNode(item["node"]):
+                continue
+            whole = key is not None and not item.get("valid", {}).get(key, True)
+            if item["blocks"] is None or (since is None and until is None) or whole:
+                f.seek(item["start"])
+                yield item["node"], f.read(item["stop"] - item["start"])
+                continue
+            # runs of contiguous blocks in the window, read at once
+            runs = []
+            for i, (start, stop, minTime, maxTime) in enumerate(item["blocks"]):
+                if not overlaps(minTime, maxTime, since, until):
+                    continue
+                if runs and runs[-1][2] == i - 1:
+                    runs[-1][1:] = [stop, i]
+                else:
+                    runs.append([start, stop, i])
+            if not runs:
+                continue
+            parts = []
+            for start, stop, last in runs:
+                f.seek(start)
+                # blocks end with the separator before the next entry
+                parts.append(f.read(stop - start).rstrip(b" \t\r\n,"))
+            yield item["node"], ('{"node": %s, "entries": [' % json.dumps(item["node"])).encode("utf-8") \
+                + b",".join(parts) + b"]}"
+
+def readNodes(fileName, index, selectNode=None, since=None, until=None, decoder=None, key=None):
+    """ Same as readNodeTexts, yielding the decoded nodes """
+    if decoder is None:
+        decoder = json.JSONDecoder()
+    for name, text in readNodeTexts(fileName, index, selectNode, since, until, key):
+        yield decoder.decode(text)
+
+def parseTime(text):
+    """
+    Time in seconds since the MJD epoch, the scale of the times diagnostics.py
+    plots, from a number of seconds or a UTC date as YYYY-MM-DD, optionally
+    followed by THH:MM or THH:MM:SS
+    """
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    for form in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            when = datetime.datetime.strptime(text, form)
+        except ValueError:
+            continue
+        delta = when - _mjdEpoch
+        return delta.days * 86400.0 + delta.seconds
+    raise ValueError("not a time: " + text)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Spike detection for diagnostics.py, over the series of values of one node
+at a time.
+
+A value is a spike when it is above the fixed threshold diagnostics.py
+has for faulty values, or, with a window, when it is further from the
+median of the window of values around it than a number of times their
+median absolute deviation (MAD) scaled to a standard deviation. Both are
+robust to the spikes themselves, unlike a mean and standard deviation.
+
+The rolling median and MAD are computed on a strided view of the series,
+a block of windows at a time, so memory use is bounded by the block and not
+by the number of values. Spikes next to each other in the series are put
+together into runs, which are what the spike report lists.
+"""
+import csv
+import numpy as np
+
+# median absolute deviations from the rolling median that make a spike
+defaultMADs = 5.0
+# the MAD of normally distributed values times this is their standard deviation
+madScale = 1.4826
+# windows whose median is computed at once
+blockWindows = 1 << 14
+
+# fields of a spike run, the start and end being times of the first and last spike
+reportColumns = ["node", "start", "end", "count", "peak"]
+
+def rollingMedian(values, window):
+    """
+    Median and median absolute deviation of the window values centered on
+    each value. The first and last values, which have no full window around
+    them, get those of the first and last full window.
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= window:
+        median = np.median(values) if n else np.nan
+        mad = np.median(np.abs(values - median)) if n else np.nan
+        return np.full(n, median), np.full(n, mad)
+    count = n - window + 1
+    windows = np.lib.stride_tricks.as_strided(values, shape=(count, window),
+                                              strides=(values.strides[0], values.strides[0]))
+    medians = np.empty(count)
+    mads = np.empty(count)
+    for first in range(0, count, blockWindows):
+        block = windows[first:first + blockWindows]
+        blockMedians = np.median(block, axis=1)
+        medians[first:first + len(block)] = blockMedians
+        mads[first:first + len(block)] = np.median(np.abs(block - blockMedians[:, None]), axis=1)
+    # window i is centered on value i + window // 2
+    centers = np.clip(np.arange(n) - window // 2, 0, count - 1)
+    return medians[centers], mads[centers]
+
+def detect(values, threshold, window=None, mads=defaultMADs):
+    """
+    Boolean array of the spikes among values, and the deviation of each
+    value from what is expected of it: its rolling median with a window, or
+    zero without one
+    """
+    values = np.asarray(values, dtype=np.float64)
+    spikes = values > abs(threshold)
+    if window is None:
+        return spikes, values
+    # values over the threshold are left out of the windows of the others
+    rest = np.flatnonzero(~spikes)
+    median, mad = rollingMedian(values[rest], window)
+    deviation = values.copy()
+    deviation[rest] = values[rest] - median
+    # with a MAD of 0 (mostly equal values) nothing can be told apart
+    with np.errstate(invalid="ignore"):
+        outliers = (mad > 0) & (np.abs(deviation[rest]) > mads * madScale * mad)
+    spikes[rest[outliers]] = True
+    return spikes, deviation
+
+def spikeRuns(times, values, spikes, deviation):
+    """
+    Runs of consecutive spikes, as an array of rows (start, end, count,
+    peak), the peak being the value of the run furthest from what was
+    expected
+    """
+    positions = np.flatnonzero(spikes)
+    if len(positions) == 0:
+        return np.zeros((0, 4))
+    # a run starts where a spike doesn't follow the one before it
+    starts = np.flatnonzero(np.diff(np.concatenate(([-2], positions))) != 1)
+    ends = np.append(starts[1:], len(positions)) - 1
+    # peak of each run, the spike with the largest deviation in it
+    order = np.lexsort((-np.abs(deviation[positions]), np.repeat(np.arange(len(starts)), ends - starts + 1)))
+    peaks = positions[order[starts]]
+    return np.column_stack((times[positions[starts]], times[positions[ends]],
+                            ends - starts + 1, values[peaks]))
+
+class SpikeReport(object):
+    """ Spike runs of all nodes, written out as CSV """
+
+    def __init__(self):
+        self.runs = []
+
+    def add(self, name, runs):
+        for start, end, count, peak in runs.tolist():
+            self.runs.append((name, start, end, int(count), peak))
+
+    def merge(self, other):
+        self.runs += other.runs
+
+    def spikes(self):
+        return sum(run[3] for run in self.runs)
+
+    def write(self, out):
+        writer = csv.writer(out)
+        writer.writerow(reportColumns)
+        for name, start, end, count, peak in self.runs:
+            writer.writerow([name, repr(start), repr(end), count, repr(peak)])
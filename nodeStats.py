@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+Single pass statistics of the values diagnostics.py plots.
+
+Values are added to the accumulators here one array at a time and are not
+kept. Every accumulator can be merged with another one of the same kind,
+so statistics of several nodes, clusters or files can be put together
+without going back to the values:
+
+  Moments          count, mean and standard deviation (Welford, with Chan's
+                   formula for adding a whole array or another Moments)
+  Histogram        counts over fixed bins when the range is known, otherwise
+                   over fine bins of power of two width that are widened as
+                   values come in, and rebinned into the plotted bins at the end
+  QuantileSketch   quantiles, such as the median and p99, within a relative
+                   error, from counts over logarithmically sized buckets
+  ValueStats       all of the above for one set of values
+  ClassStats       ValueStats of one type of node, with the moments of each
+                   node, merged by node name
+  Comoments        means, variances and covariance of pairs of values, for
+                   their correlation
+  OffsetStats      ClassStats of the clock offsets of one type of node, with
+                   the jitter of each node and the correlation of offsets
+                   and delays
+"""
+import copy, math, collections
+import numpy as np
+
+import densityGrid
+
+# bins of the plotted histograms
+histogramBins = 100
+# fine bins kept when the histogram range is not known in advance
+fineBins = 4096
+# relative error of the quantiles
+quantileAccuracy = 0.001
+
+class Moments(object):
+    """ Count, mean and sum of squared differences from the mean """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _combine(self, count, mean, m2):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self._combine(len(values), mean, float(((values - mean) ** 2).sum()))
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+
+    def std(self):
+        """ Standard deviation of the values, as the fit of a normal distribution gives it """
+        if self.count == 0:
+            return np.float64("nan")
+        return np.sqrt(np.float64(self.m2) / self.count)
+
+class Histogram(object):
+    """
+    Histogram of the finite values. With a range, the counts are those of
+    numpy.histogram(values, bins, range); without one, edges() spans the
+    smallest to the largest value, as matplotlib picks it, and the bins are
+    rebuilt from the fine bins, so counts can move between neighbouring bins.
+    """
+
+    def __init__(self, range=None, bins=histogramBins):
+        self.range = range
+        self.bins = bins
+        self.min = float("inf")
+        self.max = float("-inf")
+        if range is not None:
+            self.counts = np.zeros(bins, dtype=np.int64)
+        else:
+            # fine bin k covers [k * width, (k + 1) * width)
+            self.counts = None
+            self.width = None
+            self.low = 0
+            self.used = None
+
+    def _coarsen(self):
+        low = self.low // 2
+        new = np.zeros_like(self.counts)
+        np.add.at(new, (self.low + np.arange(fineBins)) // 2 - low, self.counts)
+        self.counts = new
+        self.width *= 2
+        self.low = low
+        self.used = [self.used[0] // 2, self.used[1] // 2]
+
+    def _cover(self, vmin, vmax):
+        """ Widens and moves the fine bins until they cover [vmin, vmax] """
+        if self.counts is None:
+            self.counts = np.zeros(fineBins, dtype=np.int64)
+            self.width = densityGrid.initialWidth(vmin, vmax, fineBins)
+            self.low = int(math.floor(vmin / self.width))
+        while True:
+            lo = int(math.floor(vmin / self.width))
+            hi = int(math.floor(vmax / self.width))
+            if self.used is not None:
+                lo = min(lo, self.used[0])
+                hi = max(hi, self.used[1])
+            if hi - lo < fineBins:
+                break
+            self._coarsen()
+        low = self.low
+        if lo < low:
+            low = lo
+        elif hi >= low + fineBins:
+            low = hi - fineBins + 1
+        if low != self.low:
+            delta = low - self.low
+            new = np.zeros_like(self.counts)
+            if delta >= 0:
+                new[:fineBins - delta] = self.counts[delta:]
+            else:
+                new[-delta:] = self.counts[:fineBins + delta]
+            self.counts = new
+            self.low = low
+        self.used = [lo, hi]
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        vmin = float(values.min())
+        vmax = float(values.max())
+        self.min = min(self.min, vmin)
+        self.max = max(self.max, vmax)
+        if self.range is not None:
+            self.counts += np.histogram(values, bins=self.bins, range=self.range)[0]
+            return
+        self._cover(vmin, vmax)
+        self.counts += np.bincount(np.floor(values / self.width).astype(np.int64) - self.low,
+                                   minlength=fineBins)
+
+    def merge(self, other):
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.range is not None:
+            self.counts += other.counts
+            return
+        if other.counts is None:
+            return
+        other = copy.deepcopy(other)
+        if self.counts is None:
+            self.counts = np.zeros(fineBins, dtype=np.int64)
+            self.width = other.width
+            self.low = other.low
+        while self.width < other.width:
+            self._coarsen()
+        while other.width < self.width:
+            other._coarsen()
+        self._cover(other.used[0] * self.width, other.used[1] * self.width)
+        while other.width < self.width:
+            other._coarsen()
+        lo, hi = other.used
+        self.counts[lo - self.low:hi - self.low + 1] += other.counts[lo - other.low:hi - other.low + 1]
+
+    def total(self):
+        return 0 if self.counts is None else int(self.counts.sum())
+
+    def edges(self):
+        if self.range is not None:
+            return np.linspace(self.range[0], self.range[1], self.bins + 1)
+        vmin, vmax = self.min, self.max
+        if vmin == vmax:
+            vmin -= 0.5
+            vmax += 0.5
+        return np.linspace(vmin, vmax, self.bins + 1)
+
+    def binCounts(self):
+        """ The edges of the plotted bins and the count of each bin """
+        edges = self.edges()
+        if self.range is not None or self.counts is None:
+            counts = self.counts if self.counts is not None else np.zeros(self.bins, dtype=np.int64)
+            return edges, counts
+        lo, hi = self.used
+        # each fine bin goes to the plotted bin its center falls into
+        centers = (np.arange(lo, hi + 1) + 0.5) * self.width
+        centers = np.clip(centers, edges[0], edges[-1])
+        counts = np.histogram(centers, bins=edges, weights=self.counts[lo - self.low:hi - self.low + 1])[0]
+        return edges, counts.astype(np.int64)
+
+    def draw(self, axes, **kwargs):
+        """ Draws the histogram with axes.hist, passing on kwargs. Nothing is drawn without values. """
+        if self.total() == 0:
+            return None
+        edges, counts = self.binCounts()
+        return axes.hist(edges[:-1], bins=edges, weights=counts, **kwargs)
+
+class QuantileSketch(object):
+    """
+    Counts of the finite values in buckets of sizes growing by a factor of
+    gamma, so the value of the nearest rank below a quantile is found within
+    quantileAccuracy of itself, and never outside the smallest and largest
+    values. numpy.percentile interpolates between the two ranks around it
+    instead.
+    """
+
+    # values closer to zero than this count as zero
+    minValue = 1e-12
+
+    def __init__(self, accuracy=quantileAccuracy):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.logGamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def _addBuckets(self, buckets, magnitudes):
+        if len(magnitudes) == 0:
+            return
+        indexes = np.ceil(np.log(magnitudes) / self.logGamma).astype(np.int64)
+        unique, counts = np.unique(indexes, return_counts=True)
+        for index, count in zip(unique.tolist(), counts.tolist()):
+            buckets[index] = buckets.get(index, 0) + count
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        self._addBuckets(self.positive, values[values >= self.minValue])
+        self._addBuckets(self.negative, -values[values <= -self.minValue])
+        self.zeros += int((np.abs(values) < self.minValue).sum())
+        self.count += len(values)
+        if len(values):
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        for buckets, others in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in others.items():
+                buckets[index] = buckets.get(index, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _value(self, index):
+        # the middle of the bucket, relative to the error
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return float("nan")
+        return min(max(self._quantile(q), self.min), self.max)
+
+    def _quantile(self, q):
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+class ValueStats(object):
+    """ Moments, histogram and quantiles of a set of values """
+
+    def __init__(self, histogramRange=None):
+        self.moments = Moments()
+        self.histogram = Histogram(histogramRange)
+        self.quantiles = QuantileSketch()
+
+    def add(self, values):
+        self.moments.add(values)
+        self.histogram.add(values)
+        self.quantiles.add(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.quantiles.merge(other.quantiles)
+
+    def mean(self):
+        return self.moments.mean if self.moments.count else float("nan")
+
+    def std(self):
+        return self.moments.std()
+
+    def median(self):
+        return self.quantiles.quantile(0.5)
+
+    def p99(self):
+        return self.quantiles.quantile(0.99)
+
+class ClassStats(object):
+    """
+    Statistics of the values of all nodes of one type. The values of a node
+    that comes up more than once, such as in the dumps of several days, are
+    put together as those of one node.
+    """
+
+    def __init__(self, histogramRange=None):
+        self.values = ValueStats(histogramRange)
+        # Moments of the values of each node, by name
+        self.nodes = collections.OrderedDict()
+
+    def addNode(self, name, values, moments=None):
+        """
+        Adds values of the node name, returns their standard deviation.
+        moments are those of values, when they are known already.
+        """
+        if moments is None:
+            moments = Moments()
+            moments.add(values)
+        if name in self.nodes:
+            self.nodes[name].merge(moments)
+        else:
+            self.nodes[name] = copy.copy(moments)
+        if len(values) == 0:
+            return float("nan")
+        self.values.add(values)
+        return moments.std()
+
+    def merge(self, other):
+        self.values.merge(other.values)
+        for name, moments in other.nodes.items():
+            if name in self.nodes:
+                self.nodes[name].merge(moments)
+            else:
+                self.nodes[name] = copy.deepcopy(moments)
+
+    def numNodes(self):
+        return len(self.nodes)
+
+    def stdDevs(self):
+        """ Standard deviation of each node that has values """
+        return [moments.std() for moments in self.nodes.values() if moments.count > 0]
+
+class Comoments(object):
+    """ Count, means, sums of squared differences and co-moment of pairs of values """
+
+    def __init__(self):
+        self.count = 0
+        self.means = np.zeros(2)
+        self.m2 = np.zeros(2)
+        self.cxy = 0.0
+
+    def _combine(self, count, means, m2, cxy):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = means - self.means
+        self.means = self.means + delta * count / total
+        self.m2 = self.m2 + m2 + delta * delta * self.count * count / total
+        self.cxy += cxy + delta[0] * delta[1] * self.count * count / total
+        self.count = total
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        finite = np.isfinite(x) & np.isfinite(y)
+        x = x[finite]
+        y = y[finite]
+        if len(x) == 0:
+            return
+        dx = x - x.mean()
+        dy = y - y.mean()
+        self._combine(len(x), np.array([x.mean(), y.mean()]),
+                      np.array([float((dx * dx).sum()), float((dy * dy).sum())]), float((dx * dy).sum()))
+
+    def merge(self, other):
+        self._combine(other.count, other.means, other.m2, other.cxy)
+
+    def correlation(self):
+        """ Pearson correlation coefficient of the pairs, NaN when it is not defined """
+        if self.count < 2 or self.m2[0] == 0 or self.m2[1] == 0:
+            return float("nan")
+        return self.cxy / math.sqrt(self.m2[0] * self.m2[1])
+
+class OffsetStats(object):
+    """
+    Statistics of the clock offsets of all nodes of one type: the offsets
+    as a ClassStats, the jitter of each node, the root mean square of the
+    differences between its successive offsets, and the correlation of the
+    offsets with the delays they were measured with
+    """
+
+    def __init__(self, histogramRange=None):
+        self.offsets = ClassStats(histogramRange)
+        # sum of squared differences between successive offsets and number of differences, by node
+        self.steps = collections.OrderedDict()
+        self.comoments = Comoments()
+
+    def addNode(self, name, delays, offsets, moments=None):
+        """ Adds the offsets of the node name and their delays, moments being those of the offsets """
+        self.offsets.addNode(name, offsets, moments)
+        steps = np.diff(offsets)
+        state = self.steps.setdefault(name, [0.0, 0])
+        state[0] += float((steps * steps).sum())
+        state[1] += len(steps)
+        self.comoments.add(delays, offsets)
+
+    def merge(self, other):
+        self.offsets.merge(other.offsets)
+        for name, (squares, count) in other.steps.items():
+            state = self.steps.setdefault(name, [0.0, 0])
+            state[0] += squares
+            state[1] += count
+        self.comoments.merge(other.comoments)
+
+    def jitters(self):
+        """ Jitter of each node that has successive offsets """
+        return [math.sqrt(squares / count) for squares, count in self.steps.values() if count > 0]
+
+    def jitter(self):
+        """ Average jitter of the nodes """
+        jitters = self.jitters()
+        return sum(jitters) / len(jitters) if jitters else float("nan")
+
+    def correlation(self):
+        return self.comoments.correlation()
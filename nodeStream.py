@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming reader of cluster data dumps, for diagnostics.py.
+
+A dump is a JSON array of {"node": ..., "entries": [...]} objects. Instead
+of decoding the whole array at once, iterNodes decodes one object at a time
+from a buffer that only has to hold the object being decoded, so memory use
+is bounded by the largest node and not by the file.
+"""
+import re, copy, json.scanner
+
+chunkSize = 1 << 20
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+# offset in the text of a decoding error, in the message of the error
+_errorOffset = re.compile(r"\(char ([0-9]+)")
+
+class _Buffer(object):
+    """ The part of a file that has been read but not decoded yet """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.size = size
+        self.text = f.read(size)
+        # position in text, and offset of text in the file
+        self.pos = 0
+        self.base = 0
+        self.eof = not self.text
+
+    def more(self):
+        """
+        Drops what has been decoded and reads at least as much as is left, so
+        a large object is read in a number of steps that grows with the log
+        of its size. Returns False at the end of the file.
+        """
+        if self.eof:
+            return False
+        data = self.f.read(max(self.size, len(self.text) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.base += self.pos
+        self.text = self.text[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def next(self):
+        """ Skips whitespace and returns the next character, or "" at the end """
+        while True:
+            self.pos = _whitespace.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos:self.pos + 1]
+            if not self.more():
+                return ""
+
+    def failure(self, error, decoder):
+        """
+        What a decoding error says went wrong and where in the file, or None
+        for an unterminated string, which is always at the end of the buffer
+        """
+        message = str(error)
+        if message.startswith("Unterminated string"):
+            return None
+        match = _errorOffset.search(message)
+        if match is None:
+            # python 2's scanner doesn't say where some values failed, its
+            # pure python one does
+            pure = copy.copy(decoder)
+            pure.scan_once = json.scanner.py_make_scanner(pure)
+            try:
+                pure.raw_decode(self.text, self.pos)
+                return None
+            except ValueError as e:
+                return self.failure(e, pure) if _errorOffset.search(str(e)) else None
+        return message.split(": line")[0], self.base + int(match.group(1))
+
+    def decode(self, decoder):
+        """ Decodes the value at pos, returning it, its text and its range in the file """
+        # A value cut off by the end of the buffer fails further on once more
+        # is read, a malformed one fails in the same place again, so it is
+        # reported without reading the rest of the file
+        last = None
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.text, self.pos)
+                break
+            except ValueError as e:
+                failure = self.failure(e, decoder)
+                if failure is not None and failure == last:
+                    raise
+                last = failure
+                if not self.more():
+                    raise
+        start = self.base + self.pos
+        text = self.text[self.pos:end]
+        self.pos = end
+        return value, text, start, self.base + end
+
+def iterNodes(f, decoder, size=chunkSize):
+    """
+    Yields (start, end, node) for every element of the JSON array in the
+    file f, decoded by decoder (a JSONDecoder). start and end are offsets in
+    what f.read() returns, bytes for a file opened in binary mode.
+    """
+    for start, end, text, node in iterNodeTexts(f, decoder, size):
+        yield start, end, node
+
+def iterNodeTexts(f, decoder, size=chunkSize):
+    """ Same as iterNodes, yielding (start, end, text, node) with the text of each node """
+    buffer = _Buffer(f, size)
+    if buffer.next() != "[":
+        raise ValueError("expected a JSON array at offset %d" % (buffer.base + buffer.pos))
+    buffer.pos += 1
+    if buffer.next() == "]":
+        return
+    while True:
+        buffer.next()
+        node, text, start, end = buffer.decode(decoder)
+        yield start, end, text, node
+        c = buffer.next()
+        if c == "]":
+            return
+        if c != ",":
+            raise ValueError("expected , or ] at offset %d" % (buffer.base + buffer.pos))
+        buffer.pos += 1
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Validation of cluster data nodes against a JSON schema, for diagnostics.py.
+
+jsonschema interprets the schema again for every node and every entry. Here
+the schema is turned once into the source of a Python function with the
+same checks written out, which is much faster. The generated function only
+says whether a node is valid; nodes it rejects are passed to
+jsonschema.validate, which raises the ValidationError, so the outcome for
+every node is the one jsonschema gives. Schemas using keywords other than
+type, properties, required and items are validated with jsonschema only.
+"""
+try:
+    _integerTypes = frozenset([int, long])
+    _stringTypes = frozenset([str, unicode])
+except NameError:
+    _integerTypes = frozenset([int])
+    _stringTypes = frozenset([str])
+
+# the Python types jsonschema accepts for each JSON type (bool is not a number)
+_jsonTypes = {
+    "integer": _integerTypes,
+    "number": _integerTypes | frozenset([float]),
+    "string": _stringTypes,
+    "boolean": frozenset([bool]),
+    "null": frozenset([type(None)]),
+    "object": frozenset([dict]),
+    "array": frozenset([list]),
+}
+
+# keywords that don't change what is valid
+_annotations = set(["$schema", "id", "title", "description"])
+_checked = set(["type", "properties", "required", "items"])
+
+class _Unsupported(Exception):
+    pass
+
+class _Generator(object):
+    """ Writes out the checks of a schema as lines of Python """
+
+    def __init__(self):
+        self.lines = []
+        self.names = 0
+
+    def name(self, prefix):
+        self.names += 1
+        return "%s%d" % (prefix, self.names)
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def schema(self, schema, var, indent):
+        if not isinstance(schema, dict) or set(schema) - _annotations - _checked:
+            raise _Unsupported()
+        jsonType = schema.get("type")
+        if jsonType is not None:
+            if jsonType not in _jsonTypes:
+                raise _Unsupported()
+            self.emit(indent, "if type(%s) not in _%s: return False" % (var, jsonType))
+        if "required" in schema or "properties" in schema:
+            if jsonType != "object":
+                # the keywords only apply to objects, which is left to jsonschema
+                raise _Unsupported()
+            required = schema.get("required", [])
+            for key in required:
+                self.emit(indent, "if %r not in %s: return False" % (key, var))
+            for key, subschema in sorted(schema.get("properties", {}).items()):
+                value = self.name("v")
+                if key in required:
+                    self.emit(indent, "%s = %s[%r]" % (value, var, key))
+                    self.schema(subschema, value, indent)
+                else:
+                    self.emit(indent, "if %r in %s:" % (key, var))
+                    self.emit(indent + 1, "%s = %s[%r]" % (value, var, key))
+                    self.schema(subschema, value, indent + 1)
+        if "items" in schema:
+            if jsonType != "array":
+                raise _Unsupported()
+            item = self.name("item")
+            self.emit(indent, "for %s in %s:" % (item, var))
+            self.schema(schema["items"], item, indent + 1)
+
+def compileSchema(schema):
+    """
+    Returns a function that returns True for the instances that are valid
+    against schema, or None if the schema can't be compiled
+    """
+    generator = _Generator()
+    generator.emit(0, "def check(node):")
+    try:
+        generator.schema(schema, "node", 1)
+    except _Unsupported:
+        return None
+    generator.emit(1, "return True")
+    namespace = dict(("_" + name, types) for name, types in _jsonTypes.items())
+    exec("\n".join(generator.lines) + "\n", namespace)
+    return namespace["check"]
+
+class NodeValidator(object):
+    """ jsonschema.validate(node, schema), compiled once for the schema """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.check = compileSchema(schema)
+
+    def validate(self, node):
+        """ Raises jsonschema.ValidationError if node is not valid """
+        if self.check is not None and self.check(node):
+            return
+        from jsonschema import validate
+        validate(node, self.schema)
+
+    def isValid(self, node):
+        """ Whether validate(node) passes, jsonschema is only imported for rejected nodes """
+        if self.check is not None and self.check(node):
+            return True
+        from jsonschema import validate, ValidationError
+        try:
+            validate(node, self.schema)
+        except ValidationError:
+            return False
+        return True
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Parser of the loopstats and peerstats files ntpd writes to /var/log/ntpstats,
+as copyntpstats.py mirrors them, into columnar arrays per node, written as a
+store (see columnStore.py) or as the JSON cleanJson.py and diagnostics.py
+read.
+
+The input is the folder copyntpstats.py copies to, with a folder per node
+holding the node's ntpstats folder. Every file of a kind is read, the current
+one (loopstats) as well as the rotated ones (loopstats.20150301), plain or
+compressed (see compressedFiles.py). The lines of a node are sorted by time
+and lines that are in more than one file are kept once.
+
+loopstats lines are
+
+    MJD seconds offset freq jitter wander poll
+
+and become the fields date, time, offset, freqOffset and jitter, so a
+loopstats store or JSON file is what diagnostics.py -f plots. peerstats lines
+are
+
+    MJD seconds address status offset delay dispersion jitter
+
+of which only the lines of the system peer (the peer ntpd synchronizes to,
+as told by its status word) are kept, as date, time, offset, delay,
+dispersion and jitter. Offsets, delays, dispersions and jitters are in
+seconds and frequencies in PPM, as ntpd writes them.
+
+No mode of diagnostics.py reads a peerstats store or JSON file: -f needs
+freqOffset, which only loopstats has, and -t needs the origin, receive,
+transmit and destination timestamps of each exchange, which ntpd doesn't
+write to peerstats.
+
+A file whose lines are all well formed is parsed at once by numpy. Files
+with other lines, such as the last line of a file that was being written to
+when it was copied, are parsed with a regular expression that skips them.
+
+usage: python ntpstatsParser.py -i ntpdataFolder [-p] [-o outputFile.json] [-c storeDir] [-j jobs] [--node pattern]...
+"""
+from __future__ import print_function
+import os, re, sys, json, getopt, fnmatch, warnings, multiprocessing
+import numpy as np
+
+import columnStore, compressedFiles
+
+usage = "usage: python ntpstatsParser.py -i ntpdataFolder [-p] [-o outputFile.json] [-c storeDir] [-j jobs] [--node pattern]..."
+
+# folder copyntpstats.py copies the files of a node to
+statsFolder = "ntpstats"
+
+loopstatsColumns = ["date", "time", "offset", "freqOffset", "jitter"]
+peerstatsColumns = ["date", "time", "offset", "delay", "dispersion", "jitter"]
+
+# fields of a line, and which of them become the columns
+_loopstatsFields = 7
+_loopstatsUsed = [0, 1, 2, 3, 4]
+
+_number = b"[-+]?(?:[0-9]+[.]?[0-9]*|[.][0-9]+)(?:[eE][-+]?[0-9]+)?"
+_loopstatsLine = re.compile(b"^([0-9]+) (" + _number + b") (" + _number + b") (" + _number + b") (" +
+                            _number + b") " + _number + b" [0-9]+[ \t\r]*$", re.M)
+# the second hex digit of the status word holds the peer selection, 6 is
+# the system peer and 7 the system peer with PPS
+_peerstatsLine = re.compile(b"^([0-9]+) (" + _number + b") [^ \n]+ [0-9a-fA-F][67efEF][0-9a-fA-F]{2} (" + _number +
+                            b") (" + _number + b") (" + _number + b") (" + _number + b")[ \t\r]*$", re.M)
+
+def columnsOf(kind):
+    return loopstatsColumns if kind == "loopstats" else peerstatsColumns
+
+def statsFiles(folder, kind):
+    """ The files of a kind in folder, current and rotated, compressed or not """
+    names = [name for name in os.listdir(folder) if name == kind or name.startswith(kind + ".")]
+    return [os.path.join(folder, name) for name in sorted(names)]
+
+def nodeFolders(root, nodePatterns=None):
+    """
+    (name, folder) of the nodes under root, in name order, the folder being
+    the node's ntpstats folder, or the node's own folder without one
+    """
+    nodes = []
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if not os.path.isdir(folder):
+            continue
+        if nodePatterns and not any(fnmatch.fnmatchcase(name, p) for p in nodePatterns):
+            continue
+        if os.path.isdir(os.path.join(folder, statsFolder)):
+            folder = os.path.join(folder, statsFolder)
+        nodes.append((name, folder))
+    return nodes
+
+def _lineCount(text):
+    return text.count(b"\n") + (1 if text and not text.endswith(b"\n") else 0)
+
+def _wellFormed(values, lines):
+    """ Whether the values numpy read from a loopstats file are those of its lines """
+    if len(values) != lines * _loopstatsFields:
+        return False
+    rows = values.reshape(lines, _loopstatsFields)
+    dates, times, polls = rows[:, 0], rows[:, 1], rows[:, 6]
+    return (np.all(dates == np.floor(dates)) and np.all(polls == np.floor(polls)) and
+            np.all((times >= 0) & (times < 86401)))
+
+def parseText(text, kind):
+    """ Array with a row of the columns of the kind for every well formed line of text """
+    width = len(columnsOf(kind))
+    if kind == "loopstats":
+        lines = _lineCount(text)
+        # numpy stops at the first thing that is not a number
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            values = np.fromstring(text, dtype=np.float64, sep=" ") if lines else np.zeros(0)
+        if _wellFormed(values, lines):
+            return values.reshape(lines, _loopstatsFields)[:, _loopstatsUsed]
+        rows = _loopstatsLine.findall(text)
+    else:
+        rows = _peerstatsLine.findall(text)
+    if not rows:
+        return np.zeros((0, width))
+    return np.array(rows).astype(np.float64)
+
+def parseFile(fileName, kind):
+    with compressedFiles.openRead(fileName) as f:
+        return parseText(f.read(), kind)
+
+def parseNode(folder, kind):
+    """
+    Arrays of the columns of the kind for the files of a node, in time
+    order, without repeated lines
+    """
+    parts = [parseFile(fileName, kind) for fileName in statsFiles(folder, kind)]
+    rows = np.concatenate(parts) if parts else np.zeros((0, len(columnsOf(kind))))
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    if len(rows) > 1:
+        # sorted by time, a line that is in two files has its copy next to it
+        keep = np.concatenate(([True], np.any(rows[1:] != rows[:-1], axis=1)))
+        rows = rows[keep]
+    columns = [rows[:, i] for i in range(rows.shape[1])]
+    columns[0] = columns[0].astype(np.int64)
+    return columns
+
+def _parseTask(args):
+    name, folder, kind = args
+    return name, parseNode(folder, kind)
+
+def parseNodes(root, kind, nodePatterns=None, jobs=1):
+    """ Yields the name and the columns of each node under root, in name order """
+    tasks = [(name, folder, kind) for name, folder in nodeFolders(root, nodePatterns)]
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield _parseTask(task)
+        return
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        for result in pool.imap(_parseTask, tasks):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+class JsonWriter(object):
+    """ Writes nodes as a JSON list of {"node": name, "entries": [...]} objects, an entry per line """
+
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+        self.first = True
+        self.entryFormat = "{" + ", ".join(('"%s": %%d' if name == "date" else '"%s": %%r') % name
+                                           for name in columns) + "}"
+
+    def addNode(self, name, columns):
+        start = "[" if self.first else ",\n"
+        self.first = False
+        # lists of python numbers, whose repr is the shortest that reads back the same
+        rows = zip(*[column.tolist() for column in columns])
+        entries = ",\n".join(self.entryFormat % row for row in rows)
+        text = start + '{"node": ' + json.dumps(name) + ', "entries":[\n' + entries + "]}"
+        self.out.write(text.encode("utf-8"))
+
+    def close(self):
+        self.out.write(b"[]\n" if self.first else b"]\n")
+        self.out.close()
+
+def main(argv):
+    root = ""
+    kind = "loopstats"
+    outputName = ""
+    storeName = ""
+    jobs = 1
+    nodePatterns = []
+    try:
+        opts, args = getopt.getopt(argv, "hi:po:c:j:", ["help", "ifolder=", "peerstats", "ofile=", "columns=", "jobs=", "node="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--ifolder"):
+            root = arg
+        elif opt in ("-p", "--peerstats"):
+            kind = "peerstats"
+        elif opt in ("-o", "--ofile"):
+            outputName = arg
+        elif opt in ("-c", "--columns"):
+            storeName = arg
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt == "--node":
+            nodePatterns.append(arg)
+
+    if root == "" or (outputName == "" and storeName == ""):
+        print(usage)
+        sys.exit(2)
+
+    columns = columnsOf(kind)
+    output = JsonWriter(compressedFiles.openWrite(outputName), columns) if outputName else None
+    store = columnStore.StoreWriter(storeName, columns) if storeName else None
+    nodes = entries = 0
+    for name, arrays in parseNodes(root, kind, nodePatterns, jobs):
+        if output is not None:
+            output.addNode(name, arrays)
+        if store is not None:
+            store.startNode(name)
+            store.addColumns(arrays)
+        nodes += 1
+        entries += len(arrays[0])
+    if output is not None:
+        output.close()
+    if store is not None:
+        store.close()
+    print("Parsed %d %s lines of %d nodes" % (entries, kind, nodes))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])